@@ -0,0 +1,99 @@
+import bisect
+
+from Ebook import EBook
+from commom_import import *
+
+
+def anchor_positions(document: qtg.QTextDocument, start=0, end=None) -> dict[str, int]:
+    """文档字符范围 [start, end) 中每个锚点第一次出现的位置（相对 start）
+
+    与 QTextBrowser.scrollToAnchor 查找的是同一批锚点（带锚点格式的文本片段上的
+    anchorNames），但只遍历一次，之后按名称直接查表。
+    """
+    if end is None:
+        end = document.characterCount()
+    positions = {}
+    block = document.findBlock(start)
+    while block.isValid() and block.position() < end:
+        it = block.begin()
+        while not it.atEnd():
+            fragment = it.fragment()
+            char_format = fragment.charFormat()
+            if char_format.isAnchor():
+                position = fragment.position()
+                if start <= position < end:
+                    for name in char_format.anchorNames():
+                        positions.setdefault(name, position - start)
+            it += 1
+        block = block.next()
+    return positions
+
+
+def find_anchor(document: qtg.QTextDocument, name, start=0, end=None) -> int | None:
+    """锚点在字符范围 [start, end) 中第一次出现的位置（相对 start），找到即停止；
+    没有建立锚点索引时单次跳转使用"""
+    if end is None:
+        end = document.characterCount()
+    block = document.findBlock(start)
+    while block.isValid() and block.position() < end:
+        it = block.begin()
+        while not it.atEnd():
+            fragment = it.fragment()
+            char_format = fragment.charFormat()
+            if char_format.isAnchor() and name in char_format.anchorNames():
+                position = fragment.position()
+                if start <= position < end:
+                    return position - start
+            it += 1
+        block = block.next()
+    return None
+
+
+class EBookAnchorIndex:
+    """一章的锚点索引：锚点名 -> 章节内字符位置，以及本章目录项按位置排序的列表
+
+    建立索引要遍历整章，不在加载章节时建立，而是在第一次滚动停下后建立。之后跳转到
+    锚点是一次查表；滚动时在目录项位置上二分查找视口顶部所在的目录项，章节中的锚点
+    再多，每次滚动的开销也只与本章目录项数的对数有关。
+    """
+    __slots__ = ("chapter_idx", "_positions", "_toc_positions", "_toc_indexes", "_toc_position")
+
+    def __init__(self, eBook: EBook, chapter_idx, positions: dict[str, int]):
+        self.chapter_idx = chapter_idx
+        self._positions = positions
+        entries = []
+        for toc_idx in eBook.toc_indexes_for_chapter(chapter_idx):
+            fragment = eBook.get_anchor(toc_idx).get_anchor()
+            position = positions.get(fragment) if fragment else 0
+            if position is not None:
+                entries.append((position, toc_idx))
+        entries.sort()
+        self._toc_positions = [position for position, _ in entries]
+        self._toc_indexes = [toc_idx for _, toc_idx in entries]
+        self._toc_position = {toc_idx: position for position, toc_idx in entries}
+
+    @classmethod
+    def build(cls, eBook: EBook, chapter_idx, document: qtg.QTextDocument, start=0, end=None) -> "EBookAnchorIndex":
+        return cls(eBook, chapter_idx, anchor_positions(document, start, end))
+
+    def __len__(self):
+        return len(self._positions)
+
+    def position(self, name) -> int | None:
+        """锚点在章节内的字符位置，章节中没有该锚点时返回 None"""
+        return self._positions.get(name)
+
+    def toc_position(self, toc_idx) -> int | None:
+        """目录项在本章内的字符位置，不指向本章或锚点不存在时返回 None"""
+        return self._toc_position.get(toc_idx)
+
+    def toc_index_at(self, position) -> int | None:
+        """章节内字符位置所在的目录项，即位置不超过 position 的最后一项；在本章第一项之前时返回 None"""
+        i = bisect.bisect_right(self._toc_positions, position) - 1
+        return self._toc_indexes[i] if i >= 0 else None
+
+    def toc_count(self):
+        return len(self._toc_indexes)
+
+
+__all__ = ["EBookAnchorIndex", "anchor_positions", "find_anchor"]
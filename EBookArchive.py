@@ -0,0 +1,147 @@
+import mmap
+import os
+import posixpath
+import zipfile
+from urllib.parse import unquote
+
+
+class EBookFolder:
+    """已解压到缓存目录的 EPUB，提供与 EBookArchive 相同的读取接口"""
+
+    def __init__(self, folder):
+        self.root = folder
+
+    def join(self, *parts):
+        return os.path.normpath(os.path.join(*parts))
+
+    def dirname(self, path):
+        return os.path.dirname(path)
+
+    def relpath(self, path):
+        """相对书籍根目录的 POSIX 路径"""
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def exists(self, path):
+        return os.path.isfile(path)
+
+    def open(self, path):
+        return open(path, "rb")
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+
+class _MappedFile:
+    """给 mmap 补上 zipfile 需要的文件接口（Python 3.13 之前 mmap 没有 seekable）"""
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+
+    def read(self, size=-1):
+        return self._mapped.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._mapped.seek(offset, whence)
+        return self._mapped.tell()
+
+    def tell(self):
+        return self._mapped.tell()
+
+    def seekable(self):
+        return True
+
+
+class EBookArchive:
+    """内存映射的 EPUB 归档，直接从 zip 中按需读取章节和资源，无需解压
+
+    中央目录只在打开时索引一次，之后的读取都是 O(1) 的字典查找加上
+    对应条目的解压。路径统一使用 zip 内部的 POSIX 相对路径，根目录为 ""。
+    """
+
+    root = ""
+
+    def __init__(self, epub_path):
+        self.epub_path = epub_path
+        self._file = open(epub_path, "rb")
+        try:
+            self._mmap = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._zip = zipfile.ZipFile(_MappedFile(self._mmap))
+        except Exception:
+            self._file.close()
+            raise
+        # 索引中央目录：规范化路径 -> ZipInfo，另建一个忽略大小写的备用索引
+        self._index = {}
+        self._lower_index = {}
+        for info in self._zip.infolist():
+            if info.is_dir():
+                continue
+            name = posixpath.normpath(info.filename)
+            self._index[name] = info
+            self._lower_index.setdefault(name.lower(), info)
+
+    def join(self, *parts):
+        path = posixpath.normpath(posixpath.join(*parts))
+        return "" if path == "." else path
+
+    def dirname(self, path):
+        return posixpath.dirname(path)
+
+    def relpath(self, path):
+        return path
+
+    def _lookup(self, path):
+        path = posixpath.normpath(path.lstrip("/"))
+        info = self._index.get(path)
+        if info is None:
+            # href 中可能带有 URL 编码，或者大小写与归档中不一致
+            path = unquote(path)
+            info = self._index.get(path) or self._lower_index.get(path.lower())
+        return info
+
+    def exists(self, path):
+        return self._lookup(path) is not None
+
+    def file_size(self, path):
+        info = self._lookup(path)
+        return None if info is None else info.file_size
+
+    def namelist(self):
+        return list(self._index)
+
+    def open(self, path):
+        info = self._lookup(path)
+        if info is None:
+            raise FileNotFoundError(f"{path} not found in {self.epub_path}")
+        return self._zip.open(info)
+
+    def read(self, path):
+        info = self._lookup(path)
+        if info is None:
+            raise FileNotFoundError(f"{path} not found in {self.epub_path}")
+        return self._zip.read(info)
+
+    def close(self):
+        self._zip.close()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def as_book_root(book_root):
+    """将缓存目录路径包装为 EBookFolder，EBookArchive 原样返回"""
+    if isinstance(book_root, (EBookFolder, EBookArchive)):
+        return book_root
+    return EBookFolder(book_root)
+
+
+__all__ = ["EBookArchive", "EBookFolder", "as_book_root"]
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+from logger import logger
+
+CACHE_ROOT = "eBookCache"
+# 解压缓存的默认磁盘预算
+DEFAULT_BUDGET_BYTES = 2 * 1024 ** 3
+# 指纹中参与哈希的首尾字节数
+FINGERPRINT_CHUNK = 64 * 1024
+
+
+def cache_path(*parts):
+    """返回 eBookCache 下的路径"""
+    return os.path.join(CACHE_ROOT, *parts)
+
+
+def book_fingerprint(epub_path):
+    """计算 EPUB 的内容指纹：文件大小 + 修改时间 + 首尾部分内容的哈希"""
+    stat = os.stat(epub_path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(epub_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_CHUNK))
+        if stat.st_size > 2 * FINGERPRINT_CHUNK:
+            f.seek(-FINGERPRINT_CHUNK, os.SEEK_END)
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()[:24]
+
+
+class EBookCacheManager:
+    """按内容指纹管理解压缓存，超出磁盘预算时按最近最少使用淘汰
+
+    每本书解压到 books/<指纹> 目录，目录中的 cache_meta.json 记录源文件、
+    大小和最后访问时间。解压先写入临时目录，写完元数据后再整体改名，
+    因此没有元数据的目录一定是中断的解压，会被重新构建。
+    """
+
+    META_FILE = "cache_meta.json"
+    PARTIAL_MARK = ".partial-"
+
+    def __init__(self, cache_root=None, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.books_root = os.path.join(cache_root or CACHE_ROOT, "books")
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._remove_partial_entries()
+
+    def get_extracted(self, epub_path):
+        """返回 EPUB 的解压目录，缓存缺失或失效时重新解压"""
+        fingerprint = book_fingerprint(epub_path)
+        folder = os.path.join(self.books_root, fingerprint)
+        with self._lock:
+            meta = self._read_meta(folder)
+            if meta is None:
+                meta = self._extract(epub_path, folder, fingerprint)
+                self._remove_stale_entries(meta["epub_path"], fingerprint)
+                self._evict(keep=fingerprint)
+            else:
+                meta["last_access"] = time.time()
+                self._write_meta(folder, meta)
+        return folder
+
+    def entries(self) -> list[dict]:
+        """所有完整缓存项的元数据"""
+        if not os.path.isdir(self.books_root):
+            return []
+        entries = []
+        for name in os.listdir(self.books_root):
+            meta = self._read_meta(os.path.join(self.books_root, name))
+            if meta is not None:
+                entries.append(meta)
+        return entries
+
+    def total_size(self):
+        return sum(meta["size"] for meta in self.entries())
+
+    def evict(self):
+        """淘汰最近最少使用的缓存项，直到总大小不超过预算"""
+        with self._lock:
+            self._evict()
+
+    def _evict(self, keep=None):
+        entries = sorted(self.entries(), key=lambda meta: meta["last_access"])
+        total = sum(meta["size"] for meta in entries)
+        for meta in entries:
+            if total <= self.budget_bytes:
+                break
+            if meta["fingerprint"] == keep:
+                continue
+            shutil.rmtree(os.path.join(self.books_root, meta["fingerprint"]),
+                          ignore_errors=True)
+            total -= meta["size"]
+            logger.info(f"Evicted cache entry of {meta['epub_path']}")
+
+    def _extract(self, epub_path, folder, fingerprint):
+        os.makedirs(self.books_root, exist_ok=True)
+        partial = tempfile.mkdtemp(
+            prefix=fingerprint + self.PARTIAL_MARK, dir=self.books_root)
+        try:
+            with zipfile.ZipFile(epub_path, "r") as zip_ref:
+                zip_ref.extractall(partial)
+                size = sum(info.file_size for info in zip_ref.infolist())
+            now = time.time()
+            meta = {
+                "fingerprint": fingerprint,
+                "epub_path": os.path.abspath(epub_path),
+                "size": size,
+                "created": now,
+                "last_access": now,
+            }
+            self._write_meta(partial, meta)
+            # 旧目录没有元数据，说明是中断的解压，整体替换
+            if os.path.exists(folder):
+                shutil.rmtree(folder)
+            os.replace(partial, folder)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        logger.info(f"Extracted {epub_path} into cache entry {fingerprint}")
+        return meta
+
+    def _remove_stale_entries(self, epub_path, fingerprint):
+        """同一源文件被修改后，旧指纹的缓存项不再有用"""
+        for meta in self.entries():
+            if meta["epub_path"] == epub_path and meta["fingerprint"] != fingerprint:
+                shutil.rmtree(os.path.join(self.books_root, meta["fingerprint"]),
+                              ignore_errors=True)
+
+    def _remove_partial_entries(self):
+        """清理上次运行中断留下的临时解压目录"""
+        if not os.path.isdir(self.books_root):
+            return
+        for name in os.listdir(self.books_root):
+            if self.PARTIAL_MARK in name:
+                shutil.rmtree(os.path.join(self.books_root, name),
+                              ignore_errors=True)
+
+    def _read_meta(self, folder):
+        try:
+            with open(os.path.join(folder, self.META_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self, folder, meta):
+        meta_path = os.path.join(folder, self.META_FILE)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=4)
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+_cache_manager = None
+
+
+def get_cache_manager() -> EBookCacheManager:
+    """进程内共享的解压缓存管理器"""
+    global _cache_manager
+    if _cache_manager is None:
+        _cache_manager = EBookCacheManager()
+    return _cache_manager
+
+
+__all__ = ["CACHE_ROOT", "EBookCacheManager", "book_fingerprint",
+           "cache_path", "get_cache_manager"]
@@ -0,0 +1,503 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from EBookCache import cache_path
+from EBookParser import normalize_html
+from EBookTracing import span
+from commom_import import *
+
+# 预处理规则变化时递增，旧的缓存结果随之失效
+SIMPLIFY_VERSION = 2
+# 预处理章节存储的表结构变化时递增，旧版本的存储会被整体重建
+STORE_SCHEMA_VERSION = 2
+# 预处理章节存储的磁盘预算（压缩后的 HTML），超出时删除最久未使用的章节
+DEFAULT_BUDGET_BYTES = 256 * 1024 ** 2
+# 进程内缓存的展开后样式表数，同一本书的各章通常共用少数几个样式表
+STYLESHEET_CACHE_SIZE = 32
+
+# QTextDocument 支持的 CSS 属性（Qt 文档 "Supported HTML Subset"），其余属性排版时被忽略
+_SUPPORTED_PROPERTIES = frozenset({
+    "background", "background-color", "background-image", "color",
+    "font", "font-family", "font-size", "font-style", "font-weight", "font-variant", "font-kerning",
+    "text-decoration", "text-indent", "text-align", "text-transform", "white-space",
+    "word-spacing", "letter-spacing", "line-height", "vertical-align",
+    "margin", "margin-top", "margin-bottom", "margin-left", "margin-right",
+    "padding", "padding-top", "padding-bottom", "padding-left", "padding-right",
+    "border", "border-width", "border-style", "border-color", "border-collapse",
+    "border-top-style", "border-bottom-style", "border-left-style", "border-right-style",
+    "border-top-color", "border-bottom-color", "border-left-color", "border-right-color",
+    "border-top-width", "border-bottom-width", "border-left-width", "border-right-width",
+    "page-break-before", "page-break-after", "float", "width", "height",
+    "list-style", "list-style-type",
+})
+# 没有内容也合法的元素，XHTML 中的 <x/> 写法对其他元素在 HTML 解析时不会闭合
+_VOID_TAGS = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+                        "param", "source", "track", "wbr"})
+# 没有内容时不影响排版的行内元素，去掉锚点后为空的直接删除
+_INLINE_TAGS = frozenset({"a", "abbr", "b", "cite", "code", "em", "font", "i", "q", "s", "small", "span",
+                          "strong", "sub", "sup", "u"})
+# QTextDocument 不认识的 HTML5 分节元素，按 div 处理才会分块
+_BLOCK_ALIASES = {name: "div" for name in (
+    "article", "aside", "figcaption", "figure", "footer", "header", "main", "nav", "section")}
+# 不在 @media 规则中或媒体查询匹配这些类型之一时，规则对屏幕显示有效
+_SCREEN_MEDIA_RE = re.compile(r"\b(?:all|screen)\b", re.IGNORECASE)
+
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+_SCRIPT_RE = re.compile(r"<script\b.*?</script\s*>", re.DOTALL | re.IGNORECASE)
+_STYLESHEET_RE = re.compile(r"<link\b[^>]*>|<style\b[^>]*>(.*?)</style\s*>", re.DOTALL | re.IGNORECASE)
+_SVG_RE = re.compile(r"<svg\b.*?</svg\s*>", re.DOTALL | re.IGNORECASE)
+_SVG_IMAGE_RE = re.compile(r"""<image\b[^>]*?\s(?:xlink:)?href\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+_HEAD_RE = re.compile(r"<head\b[^>]*>", re.IGNORECASE)
+_TOKEN_RE = re.compile(r"<[^>]*>|[^<]+")
+_TAG_RE = re.compile(r"<(/?)([A-Za-z][\w:.-]*)(.*?)(/?)>$", re.DOTALL)
+_ATTR_RE = re.compile(r"""([^\s=/"']+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+_URL_ATTRS = frozenset({"src", "href", "xlink:href"})
+
+_CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_TOKEN_RE = re.compile(r"\s*(?:@([\w-]+)([^{};]*)([{;])|([^{}@;]+)\{([^{}]*)\}|(\}))")
+_CSS_URL_RE = re.compile(r"""url\(\s*(["']?)([^"')]+)\1\s*\)""", re.IGNORECASE)
+_CSS_RULE_RE = re.compile(r"^(.*?) \{ (.*) \}$")
+_SELECTOR_NAME_RE = re.compile(r"([.#]?)(-?[A-Za-z_][\w-]*)")
+
+
+class SimplifiedChapter:
+    """预处理后的章节：可以直接交给 QTextDocument 的 HTML 和其中图片的本地路径"""
+    __slots__ = ("html", "images")
+
+    def __init__(self, html: str, images: list[str]):
+        self.html = html
+        self.images = images
+
+
+def _resolve(base_url: qtc.QUrl, href) -> str:
+    """相对地址按章节或样式表的地址改写为绝对地址，章内锚点和其他协议的地址保持不变"""
+    if not href or href.startswith("#"):
+        return href
+    url = qtc.QUrl(href)
+    if url.scheme() and not url.isLocalFile():
+        return href
+    return base_url.resolved(url).toString()
+
+
+def _flatten_declarations(declarations, base_url: qtc.QUrl) -> str:
+    """只保留 QTextDocument 支持的声明，url() 改写为绝对地址"""
+    kept = []
+    for declaration in declarations.split(";"):
+        name, sep, value = declaration.partition(":")
+        name = name.strip().lower()
+        value = value.strip()
+        if not sep or not value or (name not in _SUPPORTED_PROPERTIES and not name.startswith("-qt-")):
+            continue
+        value = _CSS_URL_RE.sub(lambda match: f'url("{_resolve(base_url, match.group(2))}")', value)
+        kept.append(f"{name}: {value}")
+    return "; ".join(kept)
+
+
+def _flatten_selectors(selectors) -> str:
+    """去掉带伪类或伪元素的选择器（文档中不会匹配），HTML5 分节元素改为 div"""
+    kept = []
+    for selector in selectors.split(","):
+        selector = " ".join(selector.split())
+        if not selector or ":" in selector:
+            continue
+        for name, alias in _BLOCK_ALIASES.items():
+            if name in selector:
+                selector = re.sub(rf"(?<![\w.#-]){name}(?![\w-])", alias, selector)
+        kept.append(selector)
+    return ", ".join(kept)
+
+
+def _skip_block(css, pos) -> int:
+    """跳过 pos 处已经打开的 {} 块，返回块结束之后的位置"""
+    depth = 1
+    while depth and pos < len(css):
+        char = css[pos]
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        pos += 1
+    return pos
+
+
+def flatten_stylesheet(css, base_url: qtc.QUrl) -> str:
+    """把样式表展开为 QTextDocument 能使用的规则
+
+    去掉 @font-face、@page、@import 等 at 规则，@media 只保留屏幕适用的规则并去掉外层，
+    每条规则只保留支持的选择器和声明，没有剩余内容的规则整条删除。
+    """
+    css = _CSS_COMMENT_RE.sub("", css)
+    rules = []
+    pos = 0
+    while pos < len(css):
+        match = _CSS_TOKEN_RE.match(css, pos)
+        if match is None:
+            # 无法识别的内容，跳到下一条语句或规则
+            next_pos = min((index for index in (css.find(";", pos), css.find("}", pos)) if index >= 0),
+                           default=len(css))
+            pos = next_pos + 1
+            continue
+        pos = match.end()
+        at_rule, query, opener, selectors, declarations = match.group(1, 2, 3, 4, 5)
+        if at_rule is not None:
+            if opener == "{" and not (at_rule.lower() == "media" and _SCREEN_MEDIA_RE.search(query)):
+                pos = _skip_block(css, pos)
+            continue
+        if selectors is None:
+            continue  # 适用的 @media 块结束
+        selectors = _flatten_selectors(selectors)
+        declarations = _flatten_declarations(declarations, base_url)
+        if selectors and declarations:
+            rules.append(f"{selectors} {{ {declarations} }}")
+    return "\n".join(rules)
+
+
+def _selector_used(selector, tags, classes, ids) -> bool:
+    """选择器中的元素、类和 id 都在章节中出现过时才可能匹配，属性选择器按可能匹配处理"""
+    for prefix, name in _SELECTOR_NAME_RE.findall(re.sub(r"\[[^\]]*\]", "", selector)):
+        if prefix == "." and name not in classes:
+            return False
+        if prefix == "#" and name not in ids:
+            return False
+        if not prefix and name.lower() not in tags:
+            return False
+    return True
+
+
+def _selector_ids(stylesheet) -> set[str]:
+    """flatten_stylesheet 的结果中 #id 选择器用到的 id"""
+    ids = set()
+    for line in stylesheet.splitlines():
+        match = _CSS_RULE_RE.match(line)
+        if match is not None:
+            ids.update(name for prefix, name in _SELECTOR_NAME_RE.findall(match.group(1)) if prefix == "#")
+    return ids
+
+
+def _used_rules(stylesheet, tags, classes, ids) -> list[str]:
+    """flatten_stylesheet 的结果中可能匹配章节内容的规则，每条规则只保留可能匹配的选择器
+
+    QTextDocument 解析 HTML 时每个元素都要与所有规则比较，整本书共用的样式表中
+    大部分规则在一章里用不到，去掉后解析耗时随之下降。
+    """
+    rules = []
+    for line in stylesheet.splitlines():
+        match = _CSS_RULE_RE.match(line)
+        if match is None:
+            continue
+        selectors = [selector for selector in match.group(1).split(", ")
+                     if _selector_used(selector, tags, classes, ids)]
+        if selectors:
+            rules.append(f"{', '.join(selectors)} {{ {match.group(2)} }}")
+    return rules
+
+
+def _parse_attrs(attrs) -> list[list[str]]:
+    parsed = []
+    for match in _ATTR_RE.finditer(attrs):
+        name, *values = match.groups()
+        value = next((value for value in values if value is not None), None)
+        parsed.append([name, value])
+    return parsed
+
+
+def _format_tag(name, attrs: list[list[str]]) -> str:
+    parts = [name]
+    for attr, value in attrs:
+        parts.append(attr if value is None else f'{attr}="{value.replace(chr(34), "&quot;")}"')
+    return f"<{' '.join(parts)}>"
+
+
+def _flush_bare_anchors(out: list[str], pending: list[str]):
+    """后面没有文字的锚点（图片之前、正文末尾）用零宽空格承载，空的 <a name> 会丢失"""
+    out.extend(f'<a name="{anchor}">&#8203;</a>' for anchor in pending)
+    pending.clear()
+
+
+def simplify_chapter(data: bytes, local_path, read_stylesheet) -> SimplifiedChapter:
+    """把章节 XHTML 转换为 QTextDocument 可以直接使用的 HTML
+
+    - 链接和内联的样式表按 flatten_stylesheet 展开，去掉本章用不到的规则后合并为 head
+      中的一个 style 块，style 属性同样只保留支持的声明；read_stylesheet(本地路径)
+      返回展开后的样式表
+    - src、href 中的相对地址改写为绝对地址，同一段 HTML 放进任何文档都能找到资源
+    - 去掉脚本和注释；只包着一张图片的 svg 改为 img；HTML5 分节元素改为 div；
+      非空元素的 <x/> 写法展开为 <x></x>，否则 HTML 解析时会吞掉后面的内容
+    - 锚点：QTextDocument 只把 id 记到其后第一段文字上，空元素、只含图片的块和
+      两个块之间的锚点都会丢失。除图片和链接外，元素的 id（以及 <a name>）在其后
+      第一段文字之前复制一个空 <a name>，其后是图片时放到图片上，跳转位置不变。
+      元素保留自己的 id，样式表中的 #id 规则仍然作用于原来的元素；<a name> 不会
+      匹配 #id 选择器，样式表用到的 id 也不放到图片上
+    """
+    base_url = qtc.QUrl.fromLocalFile(local_path)
+    html = normalize_html(data)
+    html = _COMMENT_RE.sub("", html)
+    html = _SCRIPT_RE.sub("", html)
+
+    stylesheets = []
+
+    def collect_stylesheet(match):
+        if match.group(1) is not None:
+            stylesheets.append(flatten_stylesheet(match.group(1), base_url))
+            return ""
+        attrs = dict((name.lower(), value) for name, value in _parse_attrs(match.group(0)[5:-1]))
+        if "stylesheet" in (attrs.get("rel") or "").lower() and attrs.get("href"):
+            url = base_url.resolved(qtc.QUrl(attrs["href"]))
+            if url.isLocalFile():
+                stylesheets.append(read_stylesheet(url.toLocalFile()))
+        return ""
+
+    html = _STYLESHEET_RE.sub(collect_stylesheet, html)
+
+    def svg_to_img(match):
+        images = _SVG_IMAGE_RE.findall(match.group(0))
+        return f'<img src="{images[0]}" alt=""/>' if len(images) == 1 else match.group(0)
+
+    html = _SVG_RE.sub(svg_to_img, html)
+    styled_ids = _selector_ids("\n".join(stylesheets))
+
+    out = []
+    images = []
+    tags, classes, ids = set(), set(), set()  # 章节中出现的元素、类和 id，用于删除用不到的样式规则
+    pending = []  # 等待放到下一段文字或图片之前的锚点
+    last_open = None  # 最近输出的开始标签在 out 中的下标和元素名
+
+    def flush_anchors():
+        out.extend(f'<a name="{anchor}"></a>' for anchor in pending)
+        pending.clear()
+
+    for token in _TOKEN_RE.findall(html):
+        if not token.startswith("<"):
+            if pending and not token.isspace():
+                flush_anchors()
+            out.append(token)
+            continue
+        match = _TAG_RE.match(token)
+        if match is None:
+            out.append(token)
+            continue
+        closing, name, attrs, self_closing = match.groups()
+        name = name.lower()
+        name = _BLOCK_ALIASES.get(name, name)
+        if closing:
+            if name == "body":
+                _flush_bare_anchors(out, pending)
+            if name in _INLINE_TAGS and last_open == (len(out) - 1, name):
+                out.pop()  # 锚点移走之后什么也不剩的行内元素
+            elif name not in _VOID_TAGS:
+                out.append(f"</{name}>")
+            continue
+        attrs = _parse_attrs(attrs)
+        tags.add(name)
+        is_link = name == "a" and any(attr.lower() == "href" for attr, _ in attrs)
+        keep_anchor = name == "img" or is_link
+        kept = []
+        for attr, value in attrs:
+            lower = attr.lower()
+            if value is not None and lower in _URL_ATTRS:
+                value = _resolve(base_url, value)
+                if name == "img" and lower == "src":
+                    image_path = qtc.QUrl(value).toLocalFile()
+                    if image_path and image_path not in images:
+                        images.append(image_path)
+            elif lower == "class" and value:
+                classes.update(value.split())
+            elif lower == "style" and value is not None:
+                value = _flatten_declarations(value, base_url)
+                if not value:
+                    continue
+            elif (lower == "id" or (lower == "name" and name == "a")) and value and not keep_anchor:
+                pending.append(value)
+                ids.add(value)
+                tags.add("a")
+                if name == "a":
+                    continue  # 不是链接的 <a> 只用来放锚点，由复制的锚点代替
+            kept.append([attr, value])
+        if name == "img" and pending:
+            # 图片只能承载自己的 id，没有 id 时用它承载一个样式表用不到的锚点
+            if not any(attr.lower() == "id" for attr, _ in kept) and pending[-1] not in styled_ids:
+                kept.append(["id", pending.pop()])
+            _flush_bare_anchors(out, pending)
+        elif is_link:
+            flush_anchors()
+        if self_closing and name not in _VOID_TAGS:
+            if name not in _INLINE_TAGS:
+                out.append(_format_tag(name, kept) + f"</{name}>")
+        else:
+            out.append(_format_tag(name, kept))
+            last_open = (len(out) - 1, name)
+    _flush_bare_anchors(out, pending)
+    html = "".join(out)
+
+    stylesheet = "\n".join(_used_rules("\n".join(stylesheets), tags, classes, ids))
+    if stylesheet:
+        style = f"<style>\n{stylesheet}\n</style>"
+        head = _HEAD_RE.search(html)
+        html = html[:head.end()] + style + html[head.end():] if head else style + html
+    return SimplifiedChapter(html, images)
+
+
+class EBookChapterStore:
+    """持久化的预处理章节，按 (书籍指纹, 书内路径) 保存压缩后的 HTML 和其中的图片
+
+    HTML 中的资源地址是绝对路径，base 记录处理时书籍的本地路径前缀，书籍移动
+    位置后前缀不同，按未缓存处理并覆盖。源文件变化后指纹随之变化，同一路径下旧指纹
+    的章节在写入新指纹时删除；打开时删除旧预处理版本的章节；总大小超出预算时删除
+    最久未使用的章节。
+    """
+
+    def __init__(self, db_path=None, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.db_path = db_path or cache_path("chapters.sqlite3")
+        self.budget_bytes = budget_bytes
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._migrate()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chapters WHERE version != ?", (SIMPLIFY_VERSION,))
+            self._total_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(html)), 0) FROM chapters").fetchone()[0]
+            self._evict()
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == STORE_SCHEMA_VERSION:
+                return
+            # 预处理结果只是缓存，版本不一致时直接重建
+            self._conn.execute("DROP TABLE IF EXISTS chapters")
+            self._conn.execute("""
+                CREATE TABLE chapters (
+                    fingerprint TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    epub_path TEXT NOT NULL,
+                    base TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    html BLOB NOT NULL,
+                    images TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (fingerprint, path)
+                )""")
+            self._conn.execute(
+                "CREATE INDEX chapters_epub_path ON chapters (epub_path)")
+            self._conn.execute(
+                "CREATE INDEX chapters_last_used ON chapters (last_used)")
+            self._conn.execute(f"PRAGMA user_version = {STORE_SCHEMA_VERSION}")
+
+    def get(self, fingerprint, path, base) -> SimplifiedChapter | None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT html, images FROM chapters WHERE fingerprint = ? AND path = ? AND base = ? AND version = ?",
+                (fingerprint, path, base, SIMPLIFY_VERSION)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE chapters SET last_used = ? WHERE fingerprint = ? AND path = ?",
+                                   (time.time(), fingerprint, path))
+        if row is None:
+            return None
+        html, images = row
+        return SimplifiedChapter(zlib.decompress(html).decode("utf-8"), images.split("\n") if images else [])
+
+    def put(self, fingerprint, epub_path, path, base, chapter: SimplifiedChapter):
+        html = zlib.compress(chapter.html.encode("utf-8"), 1)
+        epub_path = os.path.abspath(epub_path)
+        with self._lock, self._conn:
+            # 源文件被修改过，旧指纹的章节失效；书籍移动位置后，旧前缀的章节不会再被读取
+            self._delete("epub_path = ? AND fingerprint != ?", (epub_path, fingerprint))
+            self._delete("fingerprint = ? AND (base != ? OR path = ?)", (fingerprint, base, path))
+            self._conn.execute("INSERT INTO chapters VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (fingerprint, path, epub_path, base, SIMPLIFY_VERSION, html,
+                                "\n".join(chapter.images), time.time()))
+            self._total_bytes += len(html)
+            self._evict()
+
+    def _delete(self, where, params):
+        self._total_bytes -= self._conn.execute(
+            f"SELECT COALESCE(SUM(LENGTH(html)), 0) FROM chapters WHERE {where}", params).fetchone()[0]
+        self._conn.execute(f"DELETE FROM chapters WHERE {where}", params)
+
+    def _evict(self):
+        # 每次多删除一些，避免之后每写入一章都要淘汰
+        target = self.budget_bytes * 9 // 10
+        if self._total_bytes <= self.budget_bytes:
+            return
+        for fingerprint, path, size in self._conn.execute(
+                "SELECT fingerprint, path, LENGTH(html) FROM chapters ORDER BY last_used").fetchall():
+            if self._total_bytes <= target:
+                break
+            self._conn.execute("DELETE FROM chapters WHERE fingerprint = ? AND path = ?", (fingerprint, path))
+            self._total_bytes -= size
+
+    def total_bytes(self):
+        return self._total_bytes
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_chapter_store = None
+_chapter_store_lock = threading.Lock()
+
+
+def get_chapter_store() -> EBookChapterStore:
+    """进程内共享的预处理章节存储"""
+    global _chapter_store
+    with _chapter_store_lock:
+        if _chapter_store is None:
+            _chapter_store = EBookChapterStore()
+        return _chapter_store
+
+
+_stylesheets: OrderedDict[tuple[str, str], str] = OrderedDict()
+_stylesheets_lock = threading.Lock()
+
+
+def _book_stylesheet(eBook, local_path) -> str:
+    """书中样式表展开后的内容，按 (书籍指纹, 本地路径) 缓存，不存在时为空"""
+    key = (eBook.fingerprint, local_path)
+    with _stylesheets_lock:
+        css = _stylesheets.get(key)
+        if css is not None:
+            _stylesheets.move_to_end(key)
+            return css
+    data = eBook.read_file(local_path)
+    css = flatten_stylesheet(data.decode("utf-8-sig", "replace"), qtc.QUrl.fromLocalFile(local_path)) if data else ""
+    with _stylesheets_lock:
+        _stylesheets[key] = css
+        while len(_stylesheets) > STYLESHEET_CACHE_SIZE:
+            _stylesheets.popitem(last=False)
+    return css
+
+
+def load_simplified_chapter(eBook, local_path) -> SimplifiedChapter | None:
+    """章节（或书中其他 HTML 文档）预处理后的结果，先查磁盘缓存，没有时处理原文件
+    并写入缓存；文件不存在时返回 None。可在任意线程中调用"""
+    path = eBook.book_path(local_path)
+    base = eBook.local_path("")
+    store = get_chapter_store()
+    chapter = store.get(eBook.fingerprint, path, base)
+    if chapter is not None:
+        return chapter
+    data = eBook.read_file(local_path)
+    if data is None:
+        return None
+    with span("chapter.simplify", book=eBook.book_name, path=path) as attrs:
+        chapter = simplify_chapter(data, local_path, lambda css_path: _book_stylesheet(eBook, css_path))
+        attrs["bytes"] = len(data)
+    try:
+        store.put(eBook.fingerprint, eBook.epub_path, path, base, chapter)
+    except sqlite3.Error:
+        logger.warning(f"Failed to cache simplified chapter: {path}", exc_info=True)
+    return chapter
+
+
+__all__ = ["DEFAULT_BUDGET_BYTES", "EBookChapterStore", "SIMPLIFY_VERSION", "STORE_SCHEMA_VERSION",
+           "STYLESHEET_CACHE_SIZE", "SimplifiedChapter", "flatten_stylesheet", "get_chapter_store",
+           "load_simplified_chapter", "simplify_chapter"]
@@ -0,0 +1,310 @@
+import bisect
+
+from EBookAnchors import find_anchor
+from EBookChapterCache import load_simplified_chapter
+from EBookTracing import span
+from commom_import import *
+
+# 视口上下各预先布局多少屏的内容
+PRELOAD_SCREENS = 1
+# 同时布局的最多章节数，章节很短时窗口也不会无限增长
+MAX_WINDOW_CHAPTERS = 8
+# 还没有测量数据时，按每字节多少像素估算章节高度
+DEFAULT_PX_PER_BYTE = 0.25
+# 已卸载章节的图片超过此大小时重建文档。QTextDocument 缓存加载过的资源且无法单独删除，
+# 只有清空文档才能释放
+COMPACT_BYTES = 64 * 1024 ** 2
+
+
+def _frame_format(height=None) -> qtg.QTextFrameFormat:
+    frame_format = qtg.QTextFrameFormat()
+    frame_format.setMargin(0)
+    frame_format.setPadding(0)
+    frame_format.setBorder(0)
+    if height is not None:
+        frame_format.setHeight(qtg.QTextLength(qtg.QTextLength.Type.FixedLength, max(0.0, height)))
+    return frame_format
+
+
+class EBookContinuousScroller(qtc.QObject):
+    """连续滚动模式：整本书是一个滚动面，只有视口附近的章节窗口被加载和布局
+
+    文档结构为 [上方占位框架][章节框架 first..last][下方占位框架]，两个占位框架的
+    固定高度等于窗口之外各章节的高度之和：布局过的章节使用实际高度，其余按文件大小
+    估算。滚动时在窗口两端加载和卸载章节，卸载的章节记下实际高度；每次调整窗口后
+    把视口顶部所在章节及其偏移恢复到原来的位置，内容换入换出时阅读位置保持不动。
+    无论书有多长，文档中始终只有不超过 MAX_WINDOW_CHAPTERS 个章节。
+    """
+
+    def __init__(self, display):
+        super().__init__(display)
+        self.display = display
+        self.eBook = display.eBook
+        count = len(self.eBook.chapter_path_list)
+        self._sizes = [self.eBook.chapter_size(idx) for idx in range(count)]
+        self._heights: list[float | None] = [None] * count  # 布局过的章节的实际高度
+        self._prefix = [0.0] * (count + 1)  # 章节高度（实际或估算）的前缀和
+        self._frames: dict[int, qtg.QTextFrame] = {}
+        self.first = self.last = None  # 当前窗口的章节范围
+        self._top = self._bottom = None
+        self._adjusting = False  # 程序设置滚动位置时不触发窗口更新
+        self._update_timer = qtc.QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(0)  # 合并同一轮事件循环中的多次滚动
+        self._update_timer.timeout.connect(self.update_window)
+        self._scroll_bar().valueChanged.connect(self._on_scrolled)
+
+    def _scroll_bar(self) -> qtw.QScrollBar:
+        return self.display.verticalScrollBar()
+
+    def _layout(self) -> qtg.QAbstractTextDocumentLayout:
+        return self.display.document().documentLayout()
+
+    # ---------- 启动和停止 ----------
+
+    def start(self, chapter_idx, fragment=None, offset=0.0):
+        """清空文档，建立占位框架，并从 chapter_idx 开始显示"""
+        document = self.display.document()
+        self.display._resource_bytes.clear()
+        document.clear()
+        self._frames.clear()
+        self.first = self.last = None
+        cursor = qtg.QTextCursor(document)
+        self._top = cursor.insertFrame(_frame_format(0))
+        cursor.movePosition(qtg.QTextCursor.MoveOperation.End)
+        self._bottom = cursor.insertFrame(_frame_format(0))
+        self.jump_to(chapter_idx, fragment, offset)
+
+    def suspend(self):
+        """文档即将被清空（标签页休眠），放弃对框架的引用，之后用 start 重新建立"""
+        self._update_timer.stop()
+        self._frames.clear()
+        self.first = self.last = None
+        self._top = self._bottom = None
+
+    def stop(self):
+        self.suspend()
+        self._scroll_bar().valueChanged.disconnect(self._on_scrolled)
+
+    # ---------- 高度和坐标 ----------
+
+    def _rebuild_prefix(self):
+        measured_height = measured_size = 0
+        for height, size in zip(self._heights, self._sizes):
+            if height is not None and size:
+                measured_height += height
+                measured_size += size
+        px_per_byte = measured_height / measured_size if measured_size else DEFAULT_PX_PER_BYTE
+        total = 0.0
+        for idx, height in enumerate(self._heights):
+            self._prefix[idx] = total
+            total += height if height is not None else self._sizes[idx] * px_per_byte
+        self._prefix[-1] = total
+
+    def _frame_top(self, frame) -> float:
+        return self._layout().frameBoundingRect(frame).top()
+
+    def _next_top(self, idx) -> float:
+        """章节 idx 之后内容的顶部，即下一章（或下方占位框架）的顶部"""
+        frame = self._frames.get(idx + 1, self._bottom)
+        return self._frame_top(frame)
+
+    def _measure(self):
+        for idx in range(self.first, self.last + 1):
+            self._heights[idx] = self._next_top(idx) - self._frame_top(self._frames[idx])
+
+    def chapter_top(self, idx) -> float:
+        """章节 idx 顶部在文档中的 y 坐标，窗口之外的章节按占位高度推算"""
+        if idx in self._frames:
+            return self._frame_top(self._frames[idx])
+        if self.first is None:
+            return 0.0
+        if idx < self.first:
+            return self._frame_top(self._top) + self._prefix[idx]
+        return self._frame_top(self._bottom) + self._prefix[idx] - self._prefix[self.last + 1]
+
+    def chapter_at(self, y) -> tuple[int, float]:
+        """文档 y 坐标所在的章节下标和章节内的偏移"""
+        count = len(self._sizes)
+        if self.first is None:
+            return 0, 0.0
+        if y < self._frame_top(self._frames[self.first]):
+            relative = y - self._frame_top(self._top)
+            idx = min(max(bisect.bisect_right(self._prefix, relative) - 1, 0), max(self.first - 1, 0))
+        elif y >= self._frame_top(self._bottom) and self.last + 1 < count:
+            relative = y - self._frame_top(self._bottom) + self._prefix[self.last + 1]
+            idx = min(max(bisect.bisect_right(self._prefix, relative) - 1, self.last + 1), count - 1)
+        else:
+            idx = self.last
+            for loaded in range(self.first, self.last + 1):
+                if y < self._next_top(loaded):
+                    idx = loaded
+                    break
+        return idx, y - self.chapter_top(idx)
+
+    def position(self) -> tuple[int, float]:
+        """视口顶部所在的章节和章节内的偏移，用于保存和恢复阅读位置"""
+        return self.chapter_at(self._scroll_bar().value())
+
+    def chapter_range(self, idx) -> tuple[int, int] | None:
+        """已加载章节在文档中的字符范围"""
+        frame = self._frames.get(idx)
+        if frame is None:
+            return None
+        return frame.firstPosition(), frame.lastPosition()
+
+    # ---------- 窗口 ----------
+
+    def _chapter_html(self, idx) -> str:
+        """预处理后的章节 HTML，其中的地址已是绝对地址，不同目录的章节放在同一文档中也能找到资源"""
+        local_path = self.eBook.local_path(self.eBook.chapter_path_list[idx])
+        prepared = self.display.prefetcher.get_chapter(local_path)
+        if prepared is not None:
+            return prepared.html
+        chapter = load_simplified_chapter(self.eBook, local_path)
+        return chapter.html if chapter is not None else ""
+
+    def _insert(self, idx, before: qtg.QTextFrame):
+        cursor = qtg.QTextCursor(self.display.document())
+        cursor.setPosition(before.firstPosition() - 1)
+        frame = cursor.insertFrame(_frame_format())
+        cursor.insertHtml(self._chapter_html(idx))
+        self._frames[idx] = frame
+
+    def _remove(self, idx):
+        frame = self._frames.pop(idx)
+        cursor = qtg.QTextCursor(self.display.document())
+        cursor.setPosition(frame.firstPosition() - 1)
+        cursor.setPosition(frame.lastPosition() + 1, qtg.QTextCursor.MoveMode.KeepAnchor)
+        cursor.removeSelectedText()
+
+    def _set_spacer(self, frame, height):
+        frame.setFrameFormat(_frame_format(height))
+        # 修改框架格式不会自动重新布局
+        self.display.document().markContentsDirty(frame.firstPosition() - 1, 2)
+
+    def _set_window(self, first, last):
+        # 增删章节时滚动范围会变化，期间的滚动信号不代表用户操作
+        self._adjusting = True
+        try:
+            self._set_window_frames(first, last)
+        finally:
+            self._adjusting = False
+        self.display.highlight_matches()
+
+    def _set_window_frames(self, first, last):
+        with span("chapter.window", book=self.eBook.book_name, first=first, last=last) as attrs:
+            if self.first is not None:
+                self._measure()
+            loaded = set(self._frames)
+            for idx in sorted(loaded - set(range(first, last + 1))):
+                self._remove(idx)
+            kept = sorted(self._frames)
+            # 先于窗口中已有章节的倒序插入到最前，之后的依次插入到最后
+            for idx in range(min(kept[0], last + 1) if kept else last + 1, first, -1):
+                self._insert(idx - 1, self._frames.get(idx, self._bottom))
+            for idx in range(kept[-1] + 1 if kept else first, last + 1):
+                if idx not in self._frames:
+                    self._insert(idx, self._bottom)
+            attrs["loaded"] = len(set(self._frames) - loaded)
+            self.first, self.last = first, last
+            self._measure()
+            self._rebuild_prefix()
+            self._set_spacer(self._top, self._prefix[first])
+            self._set_spacer(self._bottom, self._prefix[-1] - self._prefix[last + 1])
+
+    def _scroll_to(self, y):
+        adjusting, self._adjusting = self._adjusting, True
+        try:
+            self._scroll_bar().setValue(int(round(y)))
+        finally:
+            self._adjusting = adjusting
+
+    def update_window(self):
+        """让窗口覆盖视口及其上下 PRELOAD_SCREENS 屏，并保持视口顶部的阅读位置"""
+        if self.first is None:
+            return
+        value = self._scroll_bar().value()
+        viewport_height = self.display.viewport().height()
+        preload = viewport_height * PRELOAD_SCREENS
+        anchor, offset = self.chapter_at(value)
+        first = self.chapter_at(max(0, value - preload))[0]
+        last = max(self.chapter_at(value + viewport_height + preload)[0], anchor)
+        if last - first + 1 > MAX_WINDOW_CHAPTERS:
+            first = max(first, anchor - 1)
+            last = max(min(last, first + MAX_WINDOW_CHAPTERS - 1), anchor)
+        if (first, last) != (self.first, self.last):
+            self._set_window(first, last)
+            if self._orphaned_bytes() > COMPACT_BYTES:
+                self.start(anchor, offset=offset)
+                return
+            self._scroll_to(self.chapter_top(anchor) + offset)
+            # 新加载章节的实际高度可能与估算相差很多，再检查一次视口是否被覆盖
+            self._update_timer.start()
+        self._track_current()
+
+    def _orphaned_bytes(self):
+        """已卸载章节中仍被文档资源缓存持有的图片字节数"""
+        live = set(self.display._image_resources().values())
+        return sum(size for path, size in self.display._resource_bytes.items() if path not in live)
+
+    def relayout(self):
+        """宽度或字体变化后，窗口之外章节的旧高度不再可靠，改用估算值并保持阅读位置"""
+        if self.first is None:
+            return
+        anchor, offset = self.position()
+        self._heights = [None] * len(self._heights)
+        self._measure()
+        self._rebuild_prefix()
+        self._set_spacer(self._top, self._prefix[self.first])
+        self._set_spacer(self._bottom, self._prefix[-1] - self._prefix[self.last + 1])
+        self._scroll_to(self.chapter_top(anchor) + offset)
+        self._update_timer.start()
+
+    def jump_to(self, idx, fragment=None, offset=0.0):
+        """跳转到章节 idx 的锚点 fragment，或章节内的像素偏移 offset"""
+        if idx not in self._frames:
+            count = len(self._sizes)
+            self._set_window(max(0, idx - 1), min(count - 1, idx + 1))
+        self.display.chapter_idx = idx
+        if fragment:
+            offset = self._anchor_offset(idx, fragment)
+        self._scroll_to(self.chapter_top(idx) + offset)
+        self.update_window()
+
+    def jump_to_position(self, idx, position, offset=0.0):
+        """跳转到章节 idx 内字符位置 position 所在的行，再向下偏移 offset 像素"""
+        self.jump_to(idx)
+        start, end = self.chapter_range(idx)
+        self._scroll_to(self.display._document_y(min(start + position, end)) + offset)
+        self.update_window()
+
+    def _anchor_offset(self, idx, fragment) -> float:
+        """锚点相对章节顶部的偏移，已建立锚点索引时查表，否则只在该章的框架中查找"""
+        start, end = self.chapter_range(idx)
+        index = self.display.built_anchor_index()
+        if index is not None:
+            position = index.position(fragment)
+        else:
+            position = find_anchor(self.display.document(), fragment, start, end + 1)
+        if position is None:
+            return 0.0
+        return self.display._document_y(start + position) - self.chapter_top(idx)
+
+    def _on_scrolled(self):
+        if self._adjusting:
+            return
+        self._track_current()
+        self._update_timer.start()
+
+    def _track_current(self):
+        if self.first is None:
+            return
+        idx, _ = self.position()
+        if idx != self.display.chapter_idx:
+            self.display.chapter_idx = idx
+            self.display.prefetcher.prefetch_around(idx, self.display.image_max_width())
+            self.display.chapter_changed.emit(idx)
+
+
+__all__ = ["COMPACT_BYTES", "DEFAULT_PX_PER_BYTE", "EBookContinuousScroller", "MAX_WINDOW_CHAPTERS", "PRELOAD_SCREENS"]
@@ -0,0 +1,273 @@
+import bisect
+import threading
+import time
+
+from EBookResources import get_icon
+from EBookSearch import iter_text
+from Ebook import EBook
+from commom_import import *
+
+# 结果分批发送到界面的最小间隔（秒），第一条结果总是立即发送
+FIND_BATCH_INTERVAL = 0.05
+# 输入停止多久后开始查找（毫秒）
+FIND_DELAY_MS = 150
+# 结果摘要中匹配位置前后保留的字符数
+FIND_CONTEXT_CHARS = 20
+
+_find_pool = None
+
+
+def get_find_pool() -> qtc.QThreadPool:
+    """书内查找专用的线程池，新的查找开始前旧的查找会被取消"""
+    global _find_pool
+    if _find_pool is None:
+        _find_pool = qtc.QThreadPool()
+        _find_pool.setMaxThreadCount(1)
+    return _find_pool
+
+
+class FindMatch:
+    """书内查找的一个结果：书脊下标、在章节中是第几次出现和上下文"""
+
+    def __init__(self, chapter_idx, occurrence, context):
+        self.chapter_idx = chapter_idx
+        self.occurrence = occurrence
+        self.context = context
+
+    def key(self):
+        return self.chapter_idx, self.occurrence
+
+
+class BookFindSignals(qtc.QObject):
+    found = qtc.pyqtSignal(int, list)  # 查找编号, [FindMatch]
+    progress = qtc.pyqtSignal(int, int, int)  # 查找编号, 已扫描章节数, 章节总数
+    finished = qtc.pyqtSignal(int)  # 查找编号
+
+
+class BookFindTask(qtc.QRunnable):
+    """按书脊顺序流式扫描章节，边解析边查找，结果分批发送
+
+    与 QTextDocument.find 一致，查找不区分大小写，同一章节内的结果互不重叠。
+    """
+
+    def __init__(self, eBook: EBook, query, generation, canceled: threading.Event):
+        super().__init__()
+        self.eBook = eBook
+        self.query = query
+        self.generation = generation
+        self.canceled = canceled
+        self.signals = BookFindSignals()
+
+    def run(self):
+        needle = self.query.lower()
+        batch = []
+        last_emit = 0.0
+        paths = self.eBook.chapter_path_list
+        try:
+            for chapter_idx, path in enumerate(paths):
+                if self.canceled.is_set():
+                    return
+                if not self.eBook.book_root.exists(path):
+                    continue
+                with self.eBook.book_root.open(path) as stream:
+                    for match in self._scan(stream, chapter_idx, needle):
+                        batch.append(match)
+                        now = time.perf_counter()
+                        if now - last_emit >= FIND_BATCH_INTERVAL:
+                            self.signals.found.emit(self.generation, batch)
+                            batch, last_emit = [], now
+                if batch:
+                    self.signals.found.emit(self.generation, batch)
+                    batch, last_emit = [], time.perf_counter()
+                self.signals.progress.emit(self.generation, chapter_idx + 1, len(paths))
+        except Exception:
+            # 书籍可能在查找过程中被关闭
+            logger.debug(f"Find failed: {self.eBook.book_name}", exc_info=True)
+            return
+        self.signals.finished.emit(self.generation)
+
+    def _scan(self, stream, chapter_idx, needle):
+        occurrence = 0
+        carry = ""
+        for piece in iter_text(stream):
+            if self.canceled.is_set():
+                return
+            text = carry + piece
+            lowered = text.lower()
+            position = lowered.find(needle)
+            match_end = 0
+            while position != -1:
+                start = max(0, position - FIND_CONTEXT_CHARS)
+                end = position + len(needle) + FIND_CONTEXT_CHARS
+                yield FindMatch(chapter_idx, occurrence, text[start:end].replace("\n", " "))
+                occurrence += 1
+                match_end = position + len(needle)
+                position = lowered.find(needle, match_end)
+            # 保留末尾不足一个查询长度的文字，跨块的匹配也能找到
+            carry = text[max(match_end, len(text) - len(needle) + 1):]
+
+
+class EBookFindBar(qtw.QWidget):
+    """当前书籍内的查找栏
+
+    输入后在后台扫描整本书，结果陆续到达时更新计数；上一个/下一个可以跨章节跳转，
+    需要切换章节时发出 match_activated，由主窗口加载章节后定位。
+    """
+    match_activated = qtc.pyqtSignal(object, str)  # FindMatch, 查询语句
+    closed = qtc.pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("findBar")
+        self.eBook: EBook | None = None
+        self.matches: list[FindMatch] = []
+        self._keys: list[tuple[int, int]] = []
+        self._current = -1
+        self._generation = 0
+        self._canceled = None
+        self._scanning = False
+        self._find_started = 0.0
+        self._start_chapter = 0
+
+        layout = qtw.QHBoxLayout(self)
+        layout.setContentsMargins(4, 2, 4, 2)
+        self._query_edit = qtw.QLineEdit()
+        self._query_edit.setPlaceholderText("在本书中查找")
+        self._query_edit.setClearButtonEnabled(True)
+        layout.addWidget(self._query_edit, 1)
+        self._count_label = qtw.QLabel()
+        layout.addWidget(self._count_label)
+        prev_button = qtw.QToolButton()
+        prev_button.setIcon(get_icon("figures/up_arrow.svg"))
+        prev_button.setToolTip("上一个")
+        prev_button.clicked.connect(self.prev_match)
+        layout.addWidget(prev_button)
+        next_button = qtw.QToolButton()
+        next_button.setIcon(get_icon("figures/down_arrow.svg"))
+        next_button.setToolTip("下一个")
+        next_button.clicked.connect(self.next_match)
+        layout.addWidget(next_button)
+        close_button = qtw.QToolButton()
+        close_button.setIcon(get_icon("figures/close_icon.svg"))
+        close_button.setToolTip("关闭查找")
+        close_button.clicked.connect(self.close_bar)
+        layout.addWidget(close_button)
+
+        self._find_timer = qtc.QTimer(self)
+        self._find_timer.setSingleShot(True)
+        self._find_timer.setInterval(FIND_DELAY_MS)
+        self._find_timer.timeout.connect(self.start_find)
+        self._query_edit.textChanged.connect(self._find_timer.start)
+        self._query_edit.returnPressed.connect(self.next_match)
+        qtg.QShortcut(qtg.QKeySequence("Shift+Return"), self._query_edit,
+                      self.prev_match, context=qtc.Qt.ShortcutContext.WidgetShortcut)
+        qtg.QShortcut(qtg.QKeySequence("Escape"), self, self.close_bar,
+                      context=qtc.Qt.ShortcutContext.WidgetWithChildrenShortcut)
+
+    def query(self):
+        return self._query_edit.text().strip()
+
+    def open_bar(self, eBook: EBook | None, chapter_idx=0):
+        self.show()
+        self._query_edit.setFocus()
+        self._query_edit.selectAll()
+        self.set_book(eBook, chapter_idx)
+
+    def close_bar(self):
+        self.cancel()
+        self.hide()
+        self.closed.emit()
+
+    def set_book(self, eBook: EBook | None, chapter_idx=0):
+        """切换到另一本书时重新查找"""
+        self._start_chapter = chapter_idx
+        if eBook is self.eBook:
+            return
+        self.eBook = eBook
+        if self.isVisible():
+            self.start_find()
+
+    def cancel(self):
+        if self._canceled is not None:
+            self._canceled.set()
+            self._canceled = None
+        self._scanning = False
+
+    def start_find(self):
+        """取消正在进行的查找并开始新的查找"""
+        self._find_timer.stop()
+        self.cancel()
+        self._generation += 1
+        self.matches.clear()
+        self._keys.clear()
+        self._current = -1
+        query = self.query()
+        if self.eBook is None or not query:
+            self._update_label()
+            return
+        self._canceled = threading.Event()
+        self._scanning = True
+        self._find_started = time.perf_counter()
+        task = BookFindTask(self.eBook, query, self._generation, self._canceled)
+        task.signals.found.connect(self._on_found)
+        task.signals.progress.connect(self._on_progress)
+        task.signals.finished.connect(self._on_finished)
+        get_find_pool().start(task)
+        self._update_label()
+
+    def _on_found(self, generation, matches: list[FindMatch]):
+        if generation != self._generation:
+            return
+        if not self.matches:
+            logger.debug(
+                f"First match in {(time.perf_counter() - self._find_started) * 1000:.0f} ms")
+        for match in matches:
+            key = match.key()
+            position = bisect.bisect(self._keys, key)
+            self._keys.insert(position, key)
+            self.matches.insert(position, match)
+            if position <= self._current:
+                self._current += 1
+        if self._current == -1:
+            # 第一个位于当前章节或之后的结果出现时自动跳转
+            position = bisect.bisect_left(self._keys, (self._start_chapter, 0))
+            if position < len(self.matches):
+                self._activate(position)
+        self._update_label()
+
+    def _on_progress(self, generation, scanned, total):
+        if generation == self._generation and self._scanning:
+            self._update_label(f"（已扫描 {scanned}/{total} 章）")
+
+    def _on_finished(self, generation):
+        if generation != self._generation:
+            return
+        self._scanning = False
+        self._canceled = None
+        if self._current == -1 and self.matches:
+            self._activate(0)
+        self._update_label()
+
+    def _update_label(self, suffix=""):
+        if not self.query():
+            self._count_label.clear()
+        elif not self.matches:
+            self._count_label.setText("正在查找…" if self._scanning else "无结果")
+        else:
+            current = self._current + 1 if self._current >= 0 else "-"
+            self._count_label.setText(f"{current}/{len(self.matches)}{suffix}")
+
+    def _activate(self, position):
+        self._current = position
+        self._update_label()
+        self.match_activated.emit(self.matches[position], self.query())
+
+    def next_match(self):
+        if not self.matches:
+            return
+        self._activate((self._current + 1) % len(self.matches))
+
+    def prev_match(self):
+        if not self.matches:
+            return
+        self._activate((self._current - 1) % len(self.matches))
@@ -0,0 +1,184 @@
+import os
+import threading
+from collections import OrderedDict
+
+from EBookTracing import span
+from commom_import import *
+
+# 所有标签页共享的已缩放图片缓存预算
+DEFAULT_BUDGET_BYTES = 256 * 1024 ** 2
+# 目标宽度按此粒度向下取整，窗口宽度的细微变化可以复用同一份缩放结果
+WIDTH_BUCKET = 64
+
+
+def width_bucket(max_width) -> int:
+    """显示宽度对应的缓存宽度档位，不超过 max_width"""
+    return max(WIDTH_BUCKET, int(max_width) // WIDTH_BUCKET * WIDTH_BUCKET)
+
+
+def decode_scaled(data: bytes, max_width, max_height=None) -> qtg.QImage:
+    """按目标宽度解码图片
+
+    通过 QImageReader.setScaledSize 在解码时直接缩放，JPEG 等格式不必先解码出
+    全尺寸图片。宽度不超过 max_width 的图片按原尺寸解码。指定 max_height 时
+    同时限制高度，按比例缩放到 max_width x max_height 之内。
+    """
+    buffer = qtc.QBuffer()
+    buffer.setData(qtc.QByteArray(data))
+    buffer.open(qtc.QIODeviceBase.OpenModeFlag.ReadOnly)
+    reader = qtg.QImageReader(buffer)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and max_height and size.height() > max_height:
+        max_width = min(max_width, max(1, size.width() * max_height // size.height()))
+    if size.isValid() and size.width() > max_width > 0:
+        height = max(1, round(size.height() * max_width / size.width()))
+        reader.setScaledSize(qtc.QSize(max_width, height))
+    image = reader.read()
+    if not image.isNull() and image.width() > max_width > 0:
+        # 无法预先读取尺寸的格式，解码后再缩放
+        image = image.scaledToWidth(
+            max_width, qtc.Qt.TransformationMode.SmoothTransformation)
+    return image
+
+
+def scaled_size(data: bytes, max_width) -> qtc.QSize | None:
+    """decode_scaled(data, max_width) 得到的图片尺寸，只读取文件头而不解码
+
+    无法预先读取尺寸的格式返回 None。
+    """
+    buffer = qtc.QBuffer()
+    buffer.setData(qtc.QByteArray(data))
+    buffer.open(qtc.QIODeviceBase.OpenModeFlag.ReadOnly)
+    reader = qtg.QImageReader(buffer)
+    size = reader.size()
+    if not size.isValid():
+        return None
+    if size.width() > max_width > 0:
+        size = qtc.QSize(max_width, max(1, round(size.height() * max_width / size.width())))
+    if reader.transformation() & qtg.QImageIOHandler.Transformation.TransformationRotate90:
+        size.transpose()
+    return size
+
+
+class EBookImageCache:
+    """按 (书籍指纹, 资源路径, 宽度档位) 缓存已缩放图片，超出预算时淘汰最久未使用的图片
+
+    缓存保存 QImage 而不是 QPixmap，后台线程也可以解码并写入缓存。
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._images: OrderedDict[tuple, qtg.QImage] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key) -> qtg.QImage | None:
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key, image: qtg.QImage):
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old.sizeInBytes()
+            self._images[key] = image
+            self._total_bytes += image.sizeInBytes()
+            while self._total_bytes > self.budget_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._total_bytes -= evicted.sizeInBytes()
+
+    def load(self, fingerprint, local_path, max_width, read) -> qtg.QImage | None:
+        """从缓存取出图片，未命中时调用 read(local_path) 读取数据并按档位宽度解码"""
+        key = (fingerprint, local_path, width_bucket(max_width))
+        image = self.get(key)
+        if image is not None:
+            return image
+        data = read(local_path)
+        if data is None:
+            return None
+        with span("image.decode", image=os.path.basename(local_path), width=key[2], size=len(data)):
+            image = decode_scaled(data, key[2])
+        if image.isNull():
+            return None
+        self.put(key, image)
+        return image
+
+    def image_size(self, fingerprint, local_path, max_width, read) -> qtc.QSize | None:
+        """load 得到的图片尺寸，只在缓存未命中且无法从文件头读取尺寸时才解码"""
+        key = (fingerprint, local_path, width_bucket(max_width))
+        image = self.get(key)
+        if image is not None:
+            return image.size()
+        data = read(local_path)
+        if data is None:
+            return None
+        size = scaled_size(data, key[2])
+        if size is None:
+            image = self.load(fingerprint, local_path, max_width, lambda _: data)
+            size = image.size() if image is not None else None
+        return size
+
+    def total_bytes(self):
+        return self._total_bytes
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._total_bytes = 0
+
+
+class ImageRescaleSignals(qtc.QObject):
+    finished = qtc.pyqtSignal(int, object)  # 宽度档位, {资源名: QImage}
+
+
+class ImageRescaleTask(qtc.QRunnable):
+    """窗口大小变化后在后台把章节中的图片重新解码到新的宽度档位"""
+
+    def __init__(self, fingerprint, resources: dict[str, str], max_width, read,
+                 canceled: threading.Event):
+        super().__init__()
+        self.fingerprint = fingerprint
+        self.resources = resources  # 文档中的资源名 -> 本地路径
+        self.max_width = max_width
+        self.read = read
+        self.canceled = canceled
+        self.signals = ImageRescaleSignals()
+
+    def run(self):
+        image_cache = get_image_cache()
+        images = {}
+        try:
+            for name, local_path in self.resources.items():
+                if self.canceled.is_set():
+                    return
+                image = image_cache.load(
+                    self.fingerprint, local_path, self.max_width, self.read)
+                if image is not None:
+                    images[name] = image
+        except Exception:
+            # 书籍可能在缩放过程中被关闭
+            logger.debug("Image rescale failed", exc_info=True)
+            return
+        if not self.canceled.is_set():
+            self.signals.finished.emit(width_bucket(self.max_width), images)
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> EBookImageCache:
+    """进程内所有标签页共享的图片缓存"""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = EBookImageCache()
+        return _image_cache
+
+
+__all__ = ["EBookImageCache", "ImageRescaleTask", "WIDTH_BUCKET", "decode_scaled", "get_image_cache", "scaled_size",
+           "width_bucket"]
@@ -0,0 +1,88 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from EBookCache import cache_path
+
+# 表结构或存储内容变化时递增，旧版本的索引会被整体重建
+SCHEMA_VERSION = 3
+
+
+class EBookIndex:
+    """已解析书籍的持久化索引，按内容指纹保存书脊、目录和元数据
+
+    再次打开同一本书时只需一次主键查询，不再解析 container.xml、OPF 和 toc.ncx。
+    源文件变化后指纹随之变化，同一路径下的旧记录会在写入新记录时删除。
+    路径以相对书籍根目录的 POSIX 路径保存，归档模式和解压模式可以共用。
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or cache_path("book_index.sqlite3")
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == SCHEMA_VERSION:
+                return
+            # 索引只是缓存，版本不一致时直接重建
+            self._conn.execute("DROP TABLE IF EXISTS books")
+            self._conn.execute("""
+                CREATE TABLE books (
+                    fingerprint TEXT PRIMARY KEY,
+                    epub_path TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            self._conn.execute(
+                "CREATE INDEX books_epub_path ON books (epub_path)")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def get(self, fingerprint) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM books WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, fingerprint, epub_path, data: dict):
+        epub_path = os.path.abspath(epub_path)
+        with self._lock, self._conn:
+            # 源文件被修改过，旧指纹的记录失效
+            self._conn.execute(
+                "DELETE FROM books WHERE epub_path = ? AND fingerprint != ?",
+                (epub_path, fingerprint))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?)",
+                (fingerprint, epub_path, json.dumps(data, ensure_ascii=False), time.time()))
+
+    def remove(self, fingerprint):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM books WHERE fingerprint = ?", (fingerprint,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_book_index = None
+_book_index_lock = threading.Lock()
+
+
+def get_book_index() -> EBookIndex:
+    """进程内共享的书籍索引"""
+    global _book_index
+    with _book_index_lock:
+        if _book_index is None:
+            _book_index = EBookIndex()
+        return _book_index
+
+
+__all__ = ["EBookIndex", "SCHEMA_VERSION", "get_book_index"]
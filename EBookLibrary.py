@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+import time
+
+from EBookArchive import EBookArchive
+from EBookCache import book_fingerprint, cache_path
+from EBookParser import OPFPackage
+
+# 表结构变化时递增，旧版本的书目会被重建（书库文件夹会保留）
+SCHEMA_VERSION = 2
+# 每个扫描任务处理的书籍数，进程池按批提交，减少进程间通信
+SCAN_BATCH = 64
+
+# 书目中保存的元数据字段
+BOOK_FIELDS = ("title", "author", "language", "series", "series_index")
+
+
+def read_book_info(epub_path) -> dict:
+    """读取一本书的元数据，只读取中央目录、container.xml 和 OPF，不解压章节
+
+    无法解析的书籍也会返回记录（书名为文件名），避免每次扫描都重新尝试。
+    """
+    info = {"epub_path": epub_path, "error": None}
+    try:
+        with EBookArchive(epub_path) as archive:
+            metadata = OPFPackage(archive).metadata
+    except Exception as e:
+        metadata = {}
+        info["error"] = f"{type(e).__name__}: {e}"
+    for field in BOOK_FIELDS:
+        info[field] = metadata.get(field)
+    if not info["title"]:
+        info["title"] = os.path.splitext(os.path.basename(epub_path))[0]
+    return info
+
+
+def read_books(entries) -> list[dict]:
+    """在子进程中读取一批书籍 [(路径, 文件大小, 修改时间)] 的元数据"""
+    books = []
+    for epub_path, size, mtime_ns in entries:
+        info = read_book_info(epub_path)
+        info["size"] = size
+        info["mtime_ns"] = mtime_ns
+        try:
+            info["fingerprint"] = book_fingerprint(epub_path)
+        except OSError:
+            info["fingerprint"] = None
+        books.append(info)
+    return books
+
+
+def walk_folder(folder, directories: list | None = None):
+    """递归列出文件夹中的 EPUB，生成 (路径, 文件大小, 修改时间)
+
+    使用 os.scandir，文件大小和修改时间大多直接来自目录项，不必逐个 stat。
+    directories 不为 None 时收集遍历到的所有文件夹，用于监视文件夹变化。
+    """
+    stack = [os.path.abspath(folder)]
+    while stack:
+        path = stack.pop()
+        if directories is not None:
+            directories.append(path)
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(".epub") and entry.is_file():
+                            stat = entry.stat()
+                            yield entry.path, stat.st_size, stat.st_mtime_ns
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+class EBookCatalog:
+    """书库书目：书库文件夹以及其中每本 EPUB 的元数据
+
+    书籍记录按路径保存文件大小和修改时间，重新扫描时两者都没有变化的书籍直接跳过。
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or cache_path("library.sqlite3")
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY)")
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == SCHEMA_VERSION:
+                return
+            # 书目可以重新扫描得到，版本不一致时直接重建
+            self._conn.execute("DROP TABLE IF EXISTS books")
+            self._conn.execute("""
+                CREATE TABLE books (
+                    epub_path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    fingerprint TEXT,
+                    title TEXT NOT NULL,
+                    author TEXT,
+                    language TEXT,
+                    series TEXT,
+                    series_index TEXT,
+                    error TEXT,
+                    updated REAL NOT NULL
+                )""")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # ---------- 书库文件夹 ----------
+
+    def add_folder(self, path):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO folders VALUES (?)", (os.path.abspath(path),))
+
+    def remove_folder(self, path):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM folders WHERE path = ?", (os.path.abspath(path),))
+
+    def folders(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT path FROM folders ORDER BY path")]
+
+    def library_paths(self) -> list[str]:
+        """书库文件夹中的所有 EPUB"""
+        paths = {}
+        for folder in self.folders():
+            for path, _, _ in walk_folder(folder):
+                paths[path] = None
+        return list(paths)
+
+    # ---------- 书籍 ----------
+
+    def books(self) -> list[dict]:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT epub_path, fingerprint, {', '.join(BOOK_FIELDS)}, error FROM books ORDER BY title")
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+    def plan_scan(self, directories: list | None = None):
+        """遍历书库文件夹，返回 (需要读取的 [(路径, 文件大小, 修改时间)], 已不存在的路径)"""
+        with self._lock:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in self._conn.execute(
+                "SELECT epub_path, size, mtime_ns FROM books")}
+        stale = []
+        found = set()
+        for folder in self.folders():
+            for path, size, mtime_ns in walk_folder(folder, directories):
+                if path in found:
+                    continue
+                found.add(path)
+                if known.get(path) != (size, mtime_ns):
+                    stale.append((path, size, mtime_ns))
+        removed = [path for path in known if path not in found]
+        return stale, removed
+
+    def put_books(self, books: list[dict]):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(book["epub_path"], book["size"], book["mtime_ns"], book["fingerprint"],
+                  *(book[field] for field in BOOK_FIELDS), book["error"], now)
+                 for book in books])
+
+    def remove_books(self, paths):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM books WHERE epub_path = ?", [(path,) for path in paths])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_library_catalog() -> EBookCatalog:
+    """进程内共享的书库书目"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = EBookCatalog()
+        return _catalog
+
+
+__all__ = ["BOOK_FIELDS", "EBookCatalog", "SCAN_BATCH", "SCHEMA_VERSION", "get_library_catalog",
+           "read_book_info", "read_books", "walk_folder"]
@@ -0,0 +1,64 @@
+import threading
+
+from Ebook import EBook, LOAD_STAGES
+from commom_import import *
+
+# 各加载阶段在进度条上的显示文字
+STAGE_LABELS = {
+    "extract": "正在打开书籍",
+    "spine": "正在解析章节",
+    "toc": "正在解析目录",
+}
+
+
+class EBookLoadCanceled(Exception):
+    pass
+
+
+class EBookLoadSignals(qtc.QObject):
+    progress = qtc.pyqtSignal(int, str)  # 百分比, 阶段说明
+    finished = qtc.pyqtSignal(object)  # EBook
+    failed = qtc.pyqtSignal(str)
+    canceled = qtc.pyqtSignal()
+
+
+class EBookLoadTask(qtc.QRunnable):
+    """在线程池中构建 EBook，逐阶段汇报进度，支持取消"""
+
+    def __init__(self, epub_path, now_toc_idx=0):
+        super().__init__()
+        self.epub_path = epub_path
+        self.now_toc_idx = now_toc_idx
+        self.signals = EBookLoadSignals()
+        self._canceled = threading.Event()
+
+    def cancel(self):
+        self._canceled.set()
+
+    def is_canceled(self):
+        return self._canceled.is_set()
+
+    def _report(self, stage):
+        if self._canceled.is_set():
+            raise EBookLoadCanceled()
+        percent = LOAD_STAGES.index(stage) * 100 // len(LOAD_STAGES)
+        self.signals.progress.emit(percent, STAGE_LABELS[stage])
+
+    def run(self):
+        try:
+            eBook = EBook(self.epub_path, self.now_toc_idx,
+                          progress=self._report)
+        except EBookLoadCanceled:
+            logger.info(f"Loading canceled: {self.epub_path}")
+            self.signals.canceled.emit()
+            return
+        except Exception as e:
+            logger.exception(f"Failed to load {self.epub_path}")
+            self.signals.failed.emit(str(e))
+            return
+        if self._canceled.is_set():
+            eBook.close()
+            self.signals.canceled.emit()
+            return
+        self.signals.progress.emit(100, "加载完成")
+        self.signals.finished.emit(eBook)
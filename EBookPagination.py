@@ -0,0 +1,538 @@
+import bisect
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from EBookCache import cache_path
+from EBookChapterCache import SIMPLIFY_VERSION, load_simplified_chapter
+from EBookImageCache import get_image_cache
+from EBookTracing import span
+from Ebook import EBook, EBookChapter
+from commom_import import *
+
+# 排版算法变化时递增，旧的分页结果随之失效
+PAGINATION_VERSION = 1
+# 分页结果存储的表结构变化时递增，旧版本的存储会被整体重建
+STORE_SCHEMA_VERSION = 2
+# 每本书保留的最多排版（字体和窗口大小的组合）数，超出后删除最久未使用的
+MAX_LAYOUTS_PER_BOOK = 8
+# 所有书籍合计保留的最多排版数，超出后删除最久未使用的，已删除或不再打开的书籍随之清理
+MAX_LAYOUTS = 128
+# 窗口大小或字体停止变化多久后重新分页（毫秒）
+RELAYOUT_DELAY_MS = 300
+# 滚轮转过多少角度翻一页，120 为鼠标滚轮的一格
+WHEEL_DEGREES_PER_PAGE = 120
+
+# 排版键的前缀，分页基于预处理后的章节，预处理规则变化时旧的分页结果同样失效
+LAYOUT_KEY_PREFIX = f"v{PAGINATION_VERSION}.{SIMPLIFY_VERSION}|"
+
+_pagination_pool = None
+
+
+def get_pagination_pool() -> qtc.QThreadPool:
+    """分页专用的线程池，同一时间只为一本书分页，不影响章节预读"""
+    global _pagination_pool
+    if _pagination_pool is None:
+        _pagination_pool = qtc.QThreadPool()
+        _pagination_pool.setMaxThreadCount(1)
+    return _pagination_pool
+
+
+class PageLayout:
+    """分页所依据的排版参数：字体、正文宽度、页高和图片宽度，key 用作持久化的键"""
+
+    def __init__(self, font: qtg.QFont, text_width, page_height, image_width):
+        self.font = qtg.QFont(font)
+        self.text_width = text_width
+        self.page_height = page_height
+        self.image_width = image_width
+        self.key = f"{LAYOUT_KEY_PREFIX}{font.toString()}|{text_width}x{page_height}|{image_width}"
+
+    @classmethod
+    def of(cls, display) -> "PageLayout":
+        viewport = display.viewport()
+        return cls(display.document().defaultFont(), viewport.width(), viewport.height(), display.image_max_width())
+
+
+def page_offsets(document: qtg.QTextDocument, page_height) -> list[int]:
+    """把排版好的文档按页高分页，返回每页第一行的字符位置
+
+    行不会被页面截断，放不下的行从下一页开始；第一页从文档顶部开始。
+    """
+    layout = document.documentLayout()
+    document.size()  # 触发整个文档的布局
+    offsets = [0]
+    page_top = 0.0
+    block = document.begin()
+    while block.isValid():
+        block_top = layout.blockBoundingRect(block).top()
+        text_layout = block.layout()
+        for i in range(text_layout.lineCount()):
+            line = text_layout.lineAt(i)
+            top = block_top + line.y()
+            if top > page_top and top + line.height() > page_top + page_height:
+                offsets.append(block.position() + line.textStart())
+                page_top = top
+        block = block.next()
+    return offsets
+
+
+class _PaginationDocument(qtg.QTextDocument):
+    """在后台线程中排版章节的文档，与 EBookChapterDisplay 读取相同的资源
+
+    图片只需要尺寸，用未初始化的同尺寸占位图片代替，不解码。
+    """
+
+    def __init__(self, eBook: EBook, image_width):
+        super().__init__()
+        self.eBook = eBook
+        self.image_width = image_width
+
+    def loadResource(self, type, name):
+        local_path = name.toLocalFile()
+        if type == qtg.QTextDocument.ResourceType.ImageResource:
+            size = get_image_cache().image_size(self.eBook.fingerprint, local_path,
+                                                self.image_width, self.eBook.read_file)
+            if size is not None:
+                return qtg.QImage(size, qtg.QImage.Format.Format_Mono)
+            return None
+        data = self.eBook.read_file(local_path)
+        if data is not None:
+            return qtc.QByteArray(data)
+        return super().loadResource(type, name)
+
+
+def paginate_chapter(eBook: EBook, chapter_idx, layout: PageLayout) -> list[int]:
+    """按 layout 排版书脊章节并分页，章节文件不存在时视为一页"""
+    local_path = eBook.local_path(eBook.chapter_path_list[chapter_idx])
+    chapter = load_simplified_chapter(eBook, local_path)
+    if chapter is None:
+        return [0]
+    document = _PaginationDocument(eBook, layout.image_width)
+    document.setDefaultFont(layout.font)
+    document.setBaseUrl(qtc.QUrl.fromLocalFile(local_path))
+    document.setHtml(chapter.html)
+    document.setTextWidth(layout.text_width)
+    return page_offsets(document, layout.page_height)
+
+
+class EBookPageMapStore:
+    """持久化的分页结果，按 (书籍指纹, 排版键, 章节下标) 保存每页起始的字符位置
+
+    同一本书、同样的字体和窗口大小只需分页一次，之后的会话直接读取。源文件变化后
+    指纹随之变化，同一路径下旧指纹的分页结果在读写新指纹时删除；打开时删除旧版本
+    排版键的结果；排版总数超过 MAX_LAYOUTS 时删除最久未使用的。
+    """
+
+    def __init__(self, db_path=None, max_layouts=MAX_LAYOUTS):
+        self.db_path = db_path or cache_path("page_maps.sqlite3")
+        self.max_layouts = max_layouts
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._migrate()
+        with self._lock, self._conn:
+            # 排版算法或章节预处理规则变化后，旧排版键的结果不会再被读取
+            self._conn.execute("DELETE FROM page_maps WHERE substr(layout, 1, ?) != ?",
+                               (len(LAYOUT_KEY_PREFIX), LAYOUT_KEY_PREFIX))
+            self._conn.execute("DELETE FROM page_layouts WHERE substr(layout, 1, ?) != ?",
+                               (len(LAYOUT_KEY_PREFIX), LAYOUT_KEY_PREFIX))
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == STORE_SCHEMA_VERSION:
+                return
+            # 分页结果只是缓存，版本不一致时直接重建
+            self._conn.execute("DROP TABLE IF EXISTS page_layouts")
+            self._conn.execute("DROP TABLE IF EXISTS page_maps")
+            self._conn.execute("""
+                CREATE TABLE page_layouts (
+                    fingerprint TEXT NOT NULL,
+                    layout TEXT NOT NULL,
+                    epub_path TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (fingerprint, layout)
+                )""")
+            self._conn.execute(
+                "CREATE INDEX page_layouts_epub_path ON page_layouts (epub_path)")
+            self._conn.execute(
+                "CREATE INDEX page_layouts_last_used ON page_layouts (last_used)")
+            self._conn.execute("""
+                CREATE TABLE page_maps (
+                    fingerprint TEXT NOT NULL,
+                    layout TEXT NOT NULL,
+                    chapter_idx INTEGER NOT NULL,
+                    offsets BLOB NOT NULL,
+                    PRIMARY KEY (fingerprint, layout, chapter_idx)
+                )""")
+            self._conn.execute(f"PRAGMA user_version = {STORE_SCHEMA_VERSION}")
+
+    def load(self, fingerprint, epub_path, layout) -> dict[int, list[int]]:
+        """已保存的各章分页结果，同时把该排版标记为最近使用，并清理多余的旧排版"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT chapter_idx, offsets FROM page_maps WHERE fingerprint = ? AND layout = ?",
+                (fingerprint, layout)).fetchall()
+            self._touch(fingerprint, epub_path, layout)
+            stale = self._conn.execute(
+                "SELECT fingerprint, layout FROM page_layouts WHERE fingerprint = ? "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                (fingerprint, MAX_LAYOUTS_PER_BOOK)).fetchall()
+            stale += self._conn.execute(
+                "SELECT fingerprint, layout FROM page_layouts ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                (self.max_layouts,)).fetchall()
+            self._remove_layouts(stale)
+        return {chapter_idx: array("I", offsets).tolist() for chapter_idx, offsets in rows}
+
+    def put(self, fingerprint, epub_path, layout, chapter_idx, offsets: list[int]):
+        with self._lock, self._conn:
+            # 排版在分页过程中也算作使用，不会因其他书籍打开而被淘汰后留下没有排版记录的结果
+            self._touch(fingerprint, epub_path, layout)
+            self._conn.execute("INSERT OR REPLACE INTO page_maps VALUES (?, ?, ?, ?)",
+                               (fingerprint, layout, chapter_idx, array("I", offsets).tobytes()))
+
+    def _touch(self, fingerprint, epub_path, layout):
+        epub_path = os.path.abspath(epub_path)
+        # 源文件被修改过，旧指纹的分页结果失效
+        superseded = self._conn.execute(
+            "SELECT fingerprint, layout FROM page_layouts WHERE epub_path = ? AND fingerprint != ?",
+            (epub_path, fingerprint)).fetchall()
+        self._remove_layouts(superseded)
+        self._conn.execute("INSERT OR REPLACE INTO page_layouts VALUES (?, ?, ?, ?)",
+                           (fingerprint, layout, epub_path, time.time()))
+
+    def _remove_layouts(self, layouts):
+        self._conn.executemany("DELETE FROM page_layouts WHERE fingerprint = ? AND layout = ?", layouts)
+        self._conn.executemany("DELETE FROM page_maps WHERE fingerprint = ? AND layout = ?", layouts)
+
+    def layout_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM page_layouts").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_page_map_store = None
+_page_map_store_lock = threading.Lock()
+
+
+def get_page_map_store() -> EBookPageMapStore:
+    """进程内共享的分页结果存储"""
+    global _page_map_store
+    with _page_map_store_lock:
+        if _page_map_store is None:
+            _page_map_store = EBookPageMapStore()
+        return _page_map_store
+
+
+class PaginationSignals(qtc.QObject):
+    paginated = qtc.pyqtSignal(str, dict)  # 排版键, {章节下标: 每页起始位置}
+
+
+class PaginationTask(qtc.QRunnable):
+    """先读取已保存的分页结果，再按 order 的顺序为其余章节分页，每完成一章就保存并通知"""
+
+    def __init__(self, eBook: EBook, layout: PageLayout, order: list[int], canceled: threading.Event):
+        super().__init__()
+        self.eBook = eBook
+        self.layout = layout
+        self.order = order
+        self.canceled = canceled
+        self.signals = PaginationSignals()
+
+    def run(self):
+        try:
+            store = get_page_map_store()
+            key = self.layout.key
+            cached = store.load(self.eBook.fingerprint, self.eBook.epub_path, key)
+            if cached and not self.canceled.is_set():
+                self.signals.paginated.emit(key, cached)
+            missing = [chapter_idx for chapter_idx in self.order if chapter_idx not in cached]
+            if not missing:
+                return
+            with span("pagination.book", book=self.eBook.book_name, chapters=len(missing)) as attrs:
+                for done, chapter_idx in enumerate(missing):
+                    if self.canceled.is_set():
+                        attrs["canceled_after"] = done
+                        return
+                    with span("pagination.chapter", chapter_idx=chapter_idx) as chapter_attrs:
+                        offsets = paginate_chapter(self.eBook, chapter_idx, self.layout)
+                        chapter_attrs["pages"] = len(offsets)
+                    store.put(self.eBook.fingerprint, self.eBook.epub_path, key, chapter_idx, offsets)
+                    self.signals.paginated.emit(key, {chapter_idx: offsets})
+        except Exception:
+            # 书籍可能在分页过程中被关闭
+            logger.debug("Pagination failed", exc_info=True)
+
+
+class EBookPageMap:
+    """整本书的页码表，所有章节分页完成后建立
+
+    全书页码 -> (章节下标, 起始位置) 和 (章节下标, 章内页码) -> 全书页码都是 O(1) 查找。
+    """
+
+    def __init__(self, chapters: dict[int, list[int]]):
+        self.first_page = array("I")  # 每章第一页的全书页码
+        self.page_chapters = array("I")
+        self.page_offsets = array("I")
+        for chapter_idx in range(len(chapters)):
+            self.first_page.append(len(self.page_offsets))
+            offsets = chapters[chapter_idx]
+            self.page_chapters.extend([chapter_idx] * len(offsets))
+            self.page_offsets.extend(offsets)
+
+    def page_count(self):
+        return len(self.page_offsets)
+
+    def locate(self, page) -> tuple[int, int]:
+        return self.page_chapters[page], self.page_offsets[page]
+
+    def page_number(self, chapter_idx, local_page):
+        return self.first_page[chapter_idx] + local_page
+
+
+class EBookPager(qtc.QObject):
+    """分页模式：视口每次显示一页，翻页时滚动到下一页第一行
+
+    分页在后台线程中进行，结果按书籍、字体和视口大小持久化。当前章节的分页结果
+    到达前按视口高度翻页；全部章节完成后显示全书页码。窗口大小或字体变化时按新的
+    排版重新分页，已经分页过的排版直接从存储中读取。
+    """
+
+    def __init__(self, display):
+        super().__init__(display)
+        self.display = display
+        self.eBook = display.eBook
+        self.layout: PageLayout | None = None
+        self.chapters: dict[int, list[int]] = {}  # 当前排版下已分页的章节
+        self.page_map: EBookPageMap | None = None
+        self.page = 0  # 当前章节内的页码
+        self._canceled = None
+        self._wheel_delta = 0
+        self._relayout_timer = qtc.QTimer(self)
+        self._relayout_timer.setSingleShot(True)
+        self._relayout_timer.setInterval(RELAYOUT_DELAY_MS)
+        self._relayout_timer.timeout.connect(self.relayout)
+
+    # ---------- 分页 ----------
+
+    def relayout(self):
+        """排版参数变化时丢弃当前分页并在后台按新排版分页，从当前章节开始"""
+        self._relayout_timer.stop()
+        layout = PageLayout.of(self.display)
+        if (self.layout is not None and layout.key == self.layout.key
+                and (self._canceled is not None or self.page_map is not None)):
+            return  # 正在或已经按同样的排版分页
+        self.cancel()
+        self.layout = layout
+        self.chapters = {}
+        self.page_map = None
+        count = len(self.eBook.chapter_path_list)
+        current = self.display.chapter_idx or 0
+        order = list(range(current, count)) + list(range(current))
+        self._canceled = threading.Event()
+        task = PaginationTask(self.eBook, layout, order, self._canceled)
+        task.signals.paginated.connect(self._on_paginated)
+        get_pagination_pool().start(task)
+        self.display.page_changed.emit()
+
+    def schedule_relayout(self):
+        """窗口大小或字体变化后，在停止变化时重新分页，期间按视口高度翻页"""
+        if self.layout is None:
+            return
+        key = PageLayout.of(self.display).key
+        if key == self.layout.key and (self._canceled is not None or self.page_map is not None):
+            self._relayout_timer.stop()  # 又回到了原来的大小
+            return
+        if key != self.layout.key:
+            self.cancel()
+            self.chapters = {}
+            self.page_map = None
+        self._relayout_timer.start()
+        self.display.page_changed.emit()
+
+    def cancel(self):
+        self._relayout_timer.stop()
+        if self._canceled is not None:
+            self._canceled.set()
+            self._canceled = None
+
+    def suspend(self):
+        """标签页休眠时停止分页，唤醒后由 on_chapter_loaded 继续"""
+        self.cancel()
+        self.layout = None
+
+    def _on_paginated(self, key, chapters: dict):
+        if self.layout is None or key != self.layout.key:
+            return
+        self.chapters.update(chapters)
+        if len(self.chapters) == len(self.eBook.chapter_path_list):
+            self._canceled = None
+            self.page_map = EBookPageMap(self.chapters)
+            logger.info(f"Paginated {self.eBook.book_name}: {self.page_map.page_count()} pages")
+        if self.display.chapter_idx in chapters and not self.display.hibernated:
+            self.sync()
+        else:
+            self.display.page_changed.emit()
+
+    # ---------- 页面和坐标 ----------
+
+    def _offsets(self) -> list[int] | None:
+        return self.chapters.get(self.display.chapter_idx)
+
+    def _page_top(self, page) -> float:
+        offsets = self._offsets()
+        if page == 0:
+            return 0.0
+        return self.display._document_y(min(offsets[page], self.display.document().characterCount() - 1))
+
+    def _content_bottom(self) -> float:
+        document = self.display.document()
+        return document.documentLayout().blockBoundingRect(document.lastBlock()).bottom()
+
+    def visible_height(self) -> float | None:
+        """当前页的内容高度，视口中其下方属于下一页的部分不显示；未分页时返回 None"""
+        offsets = self._offsets()
+        if offsets is None or self.page + 1 >= len(offsets):
+            return None
+        return self._page_top(self.page + 1) - self._page_top(self.page)
+
+    def prepare_document(self):
+        """在文档末尾留出一屏空白，最后一页也能滚动到视口顶部"""
+        document = self.display.document()
+        frame_format = document.rootFrame().frameFormat()
+        margin = max(document.documentMargin(), float(self.display.viewport().height()))
+        if frame_format.bottomMargin() != margin:
+            frame_format.setBottomMargin(margin)
+            document.rootFrame().setFrameFormat(frame_format)
+
+    def on_chapter_loaded(self):
+        """章节加载或标签页唤醒后：需要时开始分页，并对齐到视口顶部所在的页"""
+        self.prepare_document()
+        if self.layout is None:
+            self.relayout()
+        self.sync()
+
+    def sync(self):
+        """对齐到视口顶部所在的页"""
+        position = self.display.cursorForPosition(qtc.QPoint(0, 0)).position()
+        if self.display.verticalScrollBar().value() == 0:
+            position = 0
+        self.show_position(position)
+
+    def show_position(self, position):
+        """显示字符位置 position 所在的页，当前章节尚未分页时不移动"""
+        offsets = self._offsets()
+        if offsets is None:
+            self.display.page_changed.emit()
+            return
+        self._show_page(max(0, bisect.bisect_right(offsets, position) - 1))
+
+    def _show_page(self, page):
+        self.page = page
+        self.display.verticalScrollBar().setValue(int(self._page_top(page)))
+        self.display.viewport().update()
+        self.display.page_changed.emit()
+
+    # ---------- 翻页 ----------
+
+    def next_page(self):
+        offsets = self._offsets()
+        if offsets is not None:
+            if self.page + 1 < len(offsets):
+                self._show_page(self.page + 1)
+                return
+        else:
+            scroll_bar = self.display.verticalScrollBar()
+            height = self.display.viewport().height()
+            if scroll_bar.value() + height < self._content_bottom():
+                scroll_bar.setValue(scroll_bar.value() + height)
+                self.display.page_changed.emit()
+                return
+        self._turn_chapter(1)
+
+    def prev_page(self):
+        offsets = self._offsets()
+        if offsets is not None:
+            if self.page > 0:
+                self._show_page(self.page - 1)
+                return
+        else:
+            scroll_bar = self.display.verticalScrollBar()
+            if scroll_bar.value() > 0:
+                scroll_bar.setValue(max(0, scroll_bar.value() - self.display.viewport().height()))
+                self.display.page_changed.emit()
+                return
+        self._turn_chapter(-1)
+
+    def turn_by_wheel(self, delta):
+        """累计滚轮角度，每转过 WHEEL_DEGREES_PER_PAGE 翻一页"""
+        self._wheel_delta += delta
+        while self._wheel_delta <= -WHEEL_DEGREES_PER_PAGE:
+            self._wheel_delta += WHEEL_DEGREES_PER_PAGE
+            self.next_page()
+        while self._wheel_delta >= WHEEL_DEGREES_PER_PAGE:
+            self._wheel_delta -= WHEEL_DEGREES_PER_PAGE
+            self.prev_page()
+
+    def _turn_chapter(self, step):
+        """翻到下一章的第一页或上一章的最后一页"""
+        chapter_idx = self.display.chapter_idx
+        if chapter_idx is None or not 0 <= chapter_idx + step < len(self.eBook.chapter_path_list):
+            return
+        self._load_chapter(chapter_idx + step)
+        if step < 0:
+            self.go_to_last_page()
+
+    def _load_chapter(self, chapter_idx):
+        title = self.eBook.toc[self.eBook.toc_index_for_chapter(chapter_idx)]
+        self.display.load_chapter(EBookChapter(title, self.eBook.chapter_path_list[chapter_idx]))
+        self.display.chapter_changed.emit(chapter_idx)
+
+    def go_to_last_page(self):
+        offsets = self._offsets()
+        if offsets is not None:
+            self._show_page(len(offsets) - 1)
+            return
+        height = self.display.viewport().height()
+        self.display.verticalScrollBar().setValue(int(max(0.0, self._content_bottom() - height)))
+        self.display.page_changed.emit()
+
+    def go_to_page(self, page):
+        """跳转到全书页码 page（从 0 开始），需要全部章节已分页"""
+        if self.page_map is None or not 0 <= page < self.page_map.page_count():
+            return
+        chapter_idx, _ = self.page_map.locate(page)
+        if chapter_idx != self.display.chapter_idx:
+            self._load_chapter(chapter_idx)
+        self._show_page(page - self.page_map.first_page[chapter_idx])
+
+    # ---------- 页码 ----------
+
+    def page_number(self) -> int | None:
+        """当前页的全书页码（从 0 开始），尚未全部分页时返回 None"""
+        if self.page_map is None or self.display.chapter_idx is None:
+            return None
+        return self.page_map.page_number(self.display.chapter_idx, self.page)
+
+    def label(self) -> str:
+        page = self.page_number()
+        if page is not None:
+            return f"第 {page + 1:,} / {self.page_map.page_count():,} 页"
+        offsets = self._offsets()
+        progress = f"分页中 {len(self.chapters) * 100 // max(1, len(self.eBook.chapter_path_list))}%"
+        if offsets is None:
+            return progress
+        return f"本章第 {self.page + 1} / {len(offsets)} 页 · {progress}"
+
+
+__all__ = ["EBookPageMap", "EBookPageMapStore", "EBookPager", "LAYOUT_KEY_PREFIX", "MAX_LAYOUTS",
+           "MAX_LAYOUTS_PER_BOOK", "PAGINATION_VERSION", "PageLayout", "STORE_SCHEMA_VERSION", "get_page_map_store",
+           "get_pagination_pool", "page_offsets", "paginate_chapter"]
@@ -1,22 +1,81 @@
+import codecs
 import os
-import warnings
+import re
 import xml.etree.ElementTree as ET
 import zipfile
+from urllib.parse import unquote
 
-from bs4 import BeautifulSoup
-from ebooklib import epub
+from EBookArchive import EBookArchive, as_book_root
+from EBookCache import get_cache_manager
 
+# 为 True 时直接从 EPUB 归档中读取内容，不再解压到 eBookCache
+ARCHIVE_MODE = True
 
-def extract_chapters(epub_path):
-    """ 解析 EPUB 并提取所有章节 """
-    book = epub.read_epub(epub_path, options={'ignore_ncx': False})
-    chapters = []
-    for item in book.get_items():
-        if item.media_type == "application/xhtml+xml":  # 仅处理 HTML 章节
-            soup = BeautifulSoup(item.get_content(), "html.parser")
-            # 获取章节名和 HTML 内容
-            chapters.append((item.get_name(), soup.prettify()))
-    return chapters
+
+# iter_chapters 产出的内容：原始字节、可见文字或规范化的 HTML
+CHAPTER_MODES = ("raw", "text", "html")
+
+_XML_DECL_RE = re.compile(r"^\s*<\?xml[^>]*\?>\s*")
+_XML_ENCODING_RE = re.compile(rb"""^\s*<\?xml[^>]*\bencoding\s*=\s*["']([\w.:-]+)["']""")
+_DOCTYPE_RE = re.compile(r"^\s*<!DOCTYPE[^>]*>\s*", re.IGNORECASE)
+
+
+def chapter_encoding(head: bytes):
+    """按 BOM 和 XML 声明判断章节编码，默认 UTF-8"""
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    match = _XML_ENCODING_RE.match(head)
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode("ascii")).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def normalize_html(data: bytes) -> str:
+    """把章节 XHTML 解码为字符串，去掉 XML 声明和 DOCTYPE 并统一换行符
+
+    不重建文档树，标记保持原样，QTextBrowser 和 HTML 解析器可以直接使用。
+    """
+    html = data.decode(chapter_encoding(data[:256]), "replace")
+    html = _XML_DECL_RE.sub("", html, count=1)
+    html = _DOCTYPE_RE.sub("", html, count=1)
+    return html.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def iter_chapters(epub_path, mode="html"):
+    """按书脊顺序逐章产出 (书内路径, 内容)
+
+    mode 为 "raw" 时内容是原始字节，"text" 时是可见文字，"html" 时是 normalize_html
+    的结果。每次只读取一章，内存占用与书的大小无关；文字模式从归档中流式解析，
+    连整章的字节也不会保留。书脊中重复或不存在的文件会被跳过。
+    """
+    if mode not in CHAPTER_MODES:
+        raise ValueError(f"mode must be one of {CHAPTER_MODES}, got {mode!r}")
+    # EBookSearch 依赖本模块，在函数内导入避免循环导入
+    from EBookSearch import iter_text
+    with EBookArchive(epub_path) as archive:
+        seen = set()
+        for path in OPFPackage(archive).spine:
+            if path in seen or not archive.exists(path):
+                continue
+            seen.add(path)
+            if mode == "text":
+                with archive.open(path) as stream:
+                    content = "".join(iter_text(stream))
+            else:
+                content = archive.read(path)
+                if mode == "html":
+                    content = normalize_html(content)
+            yield path, content
+
+
+def extract_chapters(epub_path, mode="html"):
+    """ 解析 EPUB 并提取所有章节，一次性返回列表，逐章处理时应使用 iter_chapters """
+    return list(iter_chapters(epub_path, mode))
 
 
 def extract_epub(epub_path, output_folder):
@@ -29,105 +88,266 @@ def extract_epub(epub_path, output_folder):
     return output_folder
 
 
+def _parse_xml(book_root, path):
+    with book_root.open(path) as f:
+        return ET.parse(f)
+
+
 def get_opf_path(cache_folder):
-    """获取 content.opf 的路径"""
-    container_path = os.path.join(cache_folder, "META-INF", "container.xml")
-    tree = ET.parse(container_path)
+    """获取 content.opf 的路径，cache_folder 可以是缓存目录或 EBookArchive"""
+    book_root = as_book_root(cache_folder)
+    container_path = book_root.join(
+        book_root.root, "META-INF", "container.xml")
+    tree = _parse_xml(book_root, container_path)
     root = tree.getroot()
     # 寻找 rootfile 位置
     namespace = {'n': 'urn:oasis:names:tc:opendocument:xmlns:container'}
     opf_path = root.find("n:rootfiles/n:rootfile",
                          namespace).attrib['full-path']
-    return os.path.join(cache_folder, opf_path)
+    return book_root.join(book_root.root, opf_path)
+
+
+OPF_NS = {"opf": "http://www.idpf.org/2007/opf",
+          "dc": "http://purl.org/dc/elements/1.1/"}
+
+
+def resolve_href(book_root, base_dir, href):
+    """将 OPF/目录中的 href 解析为规范化的书内路径，保留 #锚点"""
+    path, sep, fragment = href.partition("#")
+    resolved = book_root.join(base_dir, unquote(path)) if path else base_dir
+    return resolved + sep + fragment
+
+
+class OPFPackage:
+    """一次解析 OPF 得到的包模型
+
+    manifest 为 id -> 条目的字典，spine 为书脊中 HTML 章节的规范化路径，
+    spine_index 为路径 -> 书脊下标的字典，查找都是 O(1)。
+    """
+
+    def __init__(self, cache_folder):
+        book_root = as_book_root(cache_folder)
+        self.book_root = book_root
+        self.opf_path = get_opf_path(book_root)
+        self.opf_dir = book_root.dirname(self.opf_path)
+        root = _parse_xml(book_root, self.opf_path).getroot()
+
+        self.manifest = {}
+        for item in root.iterfind("opf:manifest/opf:item", OPF_NS):
+            href = item.attrib.get("href")
+            if href is None:
+                continue
+            self.manifest[item.attrib.get("id")] = {
+                "path": resolve_href(book_root, self.opf_dir, href),
+                "media_type": item.attrib.get("media-type", ""),
+                "properties": item.attrib.get("properties", "").split(),
+            }
+
+        # 书脊中的 HTML 章节
+        self.spine = []
+        self.spine_index = {}
+        for itemref in root.iterfind("opf:spine/opf:itemref", OPF_NS):
+            item = self.manifest.get(itemref.attrib.get("idref"))
+            if item is None or "html" not in item["path"]:
+                continue
+            self.spine_index.setdefault(item["path"], len(self.spine))
+            self.spine.append(item["path"])
+
+        self.metadata = {}
+        for key, tag in (("title", "dc:title"), ("author", "dc:creator"), ("language", "dc:language")):
+            element = root.find(f"opf:metadata/{tag}", OPF_NS)
+            if element is not None and element.text:
+                self.metadata[key] = element.text.strip()
+        self._parse_series(root)
+        self.cover_path = self._find_cover(root)
+
+        # 先找 EPUB 2.0 的 toc.ncx，再找 EPUB 3.0 的 nav.xhtml
+        self.toc_path = None
+        for item in self.manifest.values():
+            if item["media_type"] == "application/x-dtbncx+xml":
+                self.toc_path = item["path"]
+                break
+        else:
+            for item in self.manifest.values():
+                if "nav" in item["properties"]:
+                    self.toc_path = item["path"]
+                    break
+
+    def _parse_series(self, root):
+        """丛书名和序号：EPUB 2.0 为 calibre 的 meta，EPUB 3.0 为 belongs-to-collection"""
+        for meta in root.iterfind("opf:metadata/opf:meta", OPF_NS):
+            name = meta.attrib.get("name")
+            prop = meta.attrib.get("property")
+            if name in ("calibre:series", "calibre:series_index"):
+                value = meta.attrib.get("content", "").strip()
+                key = "series" if name == "calibre:series" else "series_index"
+            elif prop in ("belongs-to-collection", "group-position"):
+                value = (meta.text or "").strip()
+                key = "series" if prop == "belongs-to-collection" else "series_index"
+            else:
+                continue
+            if value:
+                self.metadata.setdefault(key, value)
+
+    def _find_cover(self, root):
+        """封面图片路径：EPUB 3.0 的 cover-image 条目、EPUB 2.0 的 cover meta，
+        最后尝试 id 或文件名中带有 cover 的图片，找不到时返回 None"""
+        images = {item_id: item for item_id, item in self.manifest.items()
+                  if item["media_type"].startswith("image/")}
+        for item in images.values():
+            if "cover-image" in item["properties"]:
+                return item["path"]
+        for meta in root.iterfind("opf:metadata/opf:meta", OPF_NS):
+            if meta.attrib.get("name") == "cover":
+                item = images.get(meta.attrib.get("content"))
+                if item is not None:
+                    return item["path"]
+        for item_id, item in images.items():
+            if "cover" in (item_id or "").lower() or "cover" in item["path"].lower():
+                return item["path"]
+        return None
+
+    def chapter_index(self, anchor):
+        """锚点所在章节在书脊中的下标，不在书脊中时返回 None"""
+        return self.spine_index.get(anchor.split("#")[0])
 
 
 def parse_chapters(cache_folder):
     """解析 EPUB 章节并返回章节列表"""
-    opf_path = get_opf_path(cache_folder)
-    tree = ET.parse(opf_path)
-    root = tree.getroot()
-    namespace = {'n': 'http://www.idpf.org/2007/opf'}
-    manifest = root.find("n:manifest", namespace)
-    spine = root.find("n:spine", namespace)
-    # 获取所有 HTML 章节
-    chapters = []
-    for itemref in spine.findall("n:itemref", namespace):
-        item_id = itemref.attrib['idref']
-        item = manifest.find(f"n:item[@id='{item_id}']", namespace)
-        if item is not None and "html" in item.attrib['href']:
-            chapter_path = os.path.join(
-                os.path.dirname(opf_path), item.attrib['href'])
-            chapters.append(chapter_path)
-    return chapters
+    return OPFPackage(cache_folder).spine
+
+
+def parse_metadata(cache_folder) -> dict:
+    """读取 OPF 中的书名、作者和语言"""
+    return OPFPackage(cache_folder).metadata
 
 
 def find_toc_path(cache_folder):
     """查找 toc.ncx 文件路径"""
-    # 解析 content.opf
-    opf_path = get_opf_path(cache_folder)
-    tree = ET.parse(opf_path)
-    root = tree.getroot()
-    ns = {"opf": "http://www.idpf.org/2007/opf"}
+    toc_path = OPFPackage(cache_folder).toc_path
+    if toc_path is None:
+        print("未找到目录文件")
+    return toc_path
 
-    # 先找 EPUB 2.0 的 toc.ncx
-    item = root.find(
-        ".//opf:manifest/opf:item[@media-type='application/x-dtbncx+xml']", ns)
-    if item is not None:
-        return os.path.join(os.path.dirname(opf_path), item.attrib["href"])
 
-    # 再找 EPUB 3.0 的 nav.xhtml
-    item = root.find(".//opf:manifest/opf:item[@properties='nav']", ns)
-    if item is not None:
-        return os.path.join(os.path.dirname(opf_path), item.attrib["href"])
+def open_epub(epub_file, archive_mode=None):
+    """打开 EPUB，归档模式下返回 EBookArchive，否则解压并返回缓存目录"""
+    if archive_mode is None:
+        archive_mode = ARCHIVE_MODE
+    if archive_mode:
+        return EBookArchive(epub_file)
+    # 按内容指纹解压到缓存，文件更新后会自动重新解压
+    return get_cache_manager().get_extracted(epub_file)
 
-    print("未找到目录文件")
-    return None
 
+def load_epub(epub_file, archive_mode=None):
+    """加载 EPUB 并返回书籍根目录和 HTML 章节路径列表
 
-def load_epub(epub_file):
-    """加载 EPUB 并返回缓存目录中的 HTML 章节文件路径"""
-    epub_id = os.path.splitext(os.path.basename(epub_file))[0]
-    cache_folder = os.path.join("eBookCache", epub_id)
-    # 解压 EPUB
-    extract_epub(epub_file, cache_folder)
+    归档模式下返回 EBookArchive，章节路径为归档内部路径；
+    否则解压到缓存目录并返回目录路径和章节文件路径。
+    """
+    book_root = open_epub(epub_file, archive_mode)
     # 获取章节 HTML 文件列表
-    chapter_path_list = parse_chapters(cache_folder)
-    return cache_folder, chapter_path_list  # 返回缓存目录和 HTML 文件路径列表
+    chapter_path_list = parse_chapters(book_root)
+    return book_root, chapter_path_list  # 返回书籍根目录和 HTML 文件路径列表
 
 
-def parse_toc(epub_cache_folder) -> list:
-    """解析 toc.ncx，返回目录项列表（[(标题,锚点) ...]）"""
-    toc_file_path = find_toc_path(epub_cache_folder)
-    if toc_file_path is None or not os.path.exists(toc_file_path):
+NCX_NS = {"ncx": "http://www.daisy.org/z3986/2005/ncx/"}
+XHTML_NS = {"x": "http://www.w3.org/1999/xhtml"}
+EPUB_TYPE = "{http://www.idpf.org/2007/ops}type"
+
+
+def _walk_ncx(parent, level, book_root, base_dir, toc):
+    for nav_point in parent.iterfind("ncx:navPoint", NCX_NS):
+        label = nav_point.find("ncx:navLabel/ncx:text", NCX_NS)
+        content = nav_point.find("ncx:content", NCX_NS)
+        if content is not None:
+            title = label.text if label is not None and label.text else ""
+            toc.append((title.strip(), resolve_href(
+                book_root, base_dir, content.attrib["src"]), level))
+        _walk_ncx(nav_point, level + 1, book_root, base_dir, toc)
+
+
+def _walk_nav(ol, level, book_root, base_dir, toc):
+    for li in ol.iterfind("x:li", XHTML_NS):
+        link = li.find("x:a", XHTML_NS)
+        if link is not None and link.get("href"):
+            title = "".join(link.itertext()).strip()
+            toc.append((title, resolve_href(
+                book_root, base_dir, link.get("href")), level))
+        child = li.find("x:ol", XHTML_NS)
+        if child is not None:
+            _walk_nav(child, level + 1, book_root, base_dir, toc)
+
+
+def parse_toc_tree(epub_cache_folder, package: OPFPackage | None = None) -> list:
+    """解析 toc.ncx 或 EPUB 3 的 nav.xhtml，返回带层级的目录项（[(标题,锚点,层级) ...]）
+
+    目录项按文档顺序排列，层级从 0 开始，子项紧跟在父项之后。
+    已经解析过的 OPFPackage 可以通过 package 传入，避免重复解析 OPF。
+    """
+    book_root = as_book_root(epub_cache_folder)
+    if package is None:
+        package = OPFPackage(book_root)
+    toc_file_path = package.toc_path
+    if toc_file_path is None or not book_root.exists(toc_file_path):
         return []
-    tree = ET.parse(toc_file_path)
-    toc_path_father = os.path.dirname(toc_file_path)
-    root = tree.getroot()
-    ns = {"ncx": "http://www.daisy.org/z3986/2005/ncx/"}
+    root = _parse_xml(book_root, toc_file_path).getroot()
+    toc_path_father = book_root.dirname(toc_file_path)
     toc = []
-    for nav_point in root.findall(".//ncx:navPoint", ns):
-        title = nav_point.find(".//ncx:text", ns).text
-        anchor = nav_point.find(".//ncx:content", ns).attrib["src"]
-        toc.append((title, os.path.join(toc_path_father, anchor)))
+    nav_map = root.find("ncx:navMap", NCX_NS)
+    if nav_map is not None:
+        _walk_ncx(nav_map, 0, book_root, toc_path_father, toc)
+        return toc
+    # EPUB 3：优先使用 epub:type="toc" 的 nav
+    navs = list(root.iter(f"{{{XHTML_NS['x']}}}nav"))
+    navs.sort(key=lambda nav: "toc" not in nav.get(EPUB_TYPE, "").split())
+    if navs:
+        ol = navs[0].find("x:ol", XHTML_NS)
+        if ol is not None:
+            _walk_nav(ol, 0, book_root, toc_path_father, toc)
     return toc
 
 
-def extract_anchors(html_file):
+def parse_toc(epub_cache_folder, package: OPFPackage | None = None) -> list:
+    """解析 toc.ncx，返回目录项列表（[(标题,锚点) ...]）"""
+    return [(title, anchor) for title, anchor, _ in parse_toc_tree(epub_cache_folder, package)]
+
+
+def map_toc_to_spine(toc, package: OPFPackage):
+    """将目录项映射到书脊章节，返回 (标题, 锚点, 章节下标, 层级) 列表
+
+    toc 可以是 parse_toc 或 parse_toc_tree 的结果。指向书脊之外文件的
+    目录项会被丢弃；没有可用目录时按书脊生成一级目录。
+    """
+    entries = []
+    for title, anchor, *level in toc:
+        chapter_idx = package.chapter_index(anchor)
+        if chapter_idx is not None:
+            entries.append((title, anchor, chapter_idx, level[0] if level else 0))
+    if not entries:
+        for chapter_idx, path in enumerate(package.spine):
+            title = os.path.splitext(os.path.basename(path))[0]
+            entries.append((title, path, chapter_idx, 0))
+    return entries
+
+
+def extract_anchors(html_file, book_root=None):
     """解析 HTML 提取所有的锚点（id 标签）"""
+    # bs4 导入很慢，只在用到时导入，启动时不加载
+    from bs4 import BeautifulSoup
     anchors = []
-    with open(html_file, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
+    book_root = as_book_root(book_root or os.path.dirname(html_file))
+    with book_root.open(html_file) as f:
+        soup = BeautifulSoup(f, "html.parser", from_encoding="utf-8")
         # 找到所有带 id 的元素（h1, h2, div, span 可能会用作锚点）
         for tag in soup.find_all(attrs={"id": True}):
             anchors.append(tag["id"])
     return anchors
 
 
-warnings.filterwarnings("ignore", category=UserWarning, module="ebooklib.epub")
-warnings.filterwarnings(
-    "ignore", category=FutureWarning, module="ebooklib.epub")
-
-__all__ = ["load_epub", "parse_toc"]
+__all__ = ["CHAPTER_MODES", "OPFPackage", "chapter_encoding", "iter_chapters", "load_epub",
+           "map_toc_to_spine", "normalize_html", "parse_toc", "parse_toc_tree"]
 
 if __name__ == "__main__":
     # 示例：解析 EPUB 并打印章节
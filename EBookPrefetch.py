@@ -0,0 +1,148 @@
+import threading
+from collections import OrderedDict
+
+from EBookChapterCache import load_simplified_chapter
+from EBookImageCache import get_image_cache
+from Ebook import EBook
+from commom_import import *
+
+# 默认预读当前章节前后各几章
+PREFETCH_DEPTH = 1
+# 预读专用线程池的线程数，避免占满打开书籍所用的全局线程池
+PREFETCH_THREADS = 2
+
+_prefetch_pool = None
+
+
+def get_prefetch_pool() -> qtc.QThreadPool:
+    global _prefetch_pool
+    if _prefetch_pool is None:
+        _prefetch_pool = qtc.QThreadPool()
+        _prefetch_pool.setMaxThreadCount(PREFETCH_THREADS)
+    return _prefetch_pool
+
+
+class PreparedChapter:
+    """预读好的章节：预处理后的 HTML（见 EBookChapterCache）和其中图片的本地路径
+
+    图片已按显示宽度解码到共享的图片缓存中。
+    """
+
+    def __init__(self, local_path, html: str, images: list[str]):
+        self.local_path = local_path
+        self.html = html
+        self.images = images
+
+
+class ChapterPrefetchSignals(qtc.QObject):
+    ready = qtc.pyqtSignal(object)  # PreparedChapter
+
+
+class ChapterPrefetchTask(qtc.QRunnable):
+    """在后台取得预处理后的章节（没有缓存时处理并写入磁盘缓存），
+    把其中的图片解码到显示宽度，写入共享的图片缓存"""
+
+    def __init__(self, eBook: EBook, local_path, max_width, canceled: threading.Event):
+        super().__init__()
+        self.eBook = eBook
+        self.local_path = local_path
+        self.max_width = max_width
+        self.canceled = canceled
+        self.signals = ChapterPrefetchSignals()
+
+    def run(self):
+        try:
+            chapter = load_simplified_chapter(self.eBook, self.local_path)
+            if chapter is None:
+                return
+            image_cache = get_image_cache()
+            images = []
+            for image_path in chapter.images:
+                if self.canceled.is_set():
+                    return
+                image = image_cache.load(self.eBook.fingerprint, image_path,
+                                         self.max_width, self.eBook.read_file)
+                if image is not None:
+                    images.append(image_path)
+        except Exception:
+            # 书籍可能在预读过程中被关闭，预读失败时回退到同步加载
+            logger.debug(f"Prefetch failed: {self.local_path}", exc_info=True)
+            return
+        if not self.canceled.is_set():
+            self.signals.ready.emit(PreparedChapter(self.local_path, chapter.html, images))
+
+
+class EBookPrefetcher(qtc.QObject):
+    """为一个标签页预读当前章节前后 depth 个书脊文档
+
+    预读结果只保留当前窗口内的章节。hits/misses 统计章节加载时是否命中预读结果。
+    """
+
+    def __init__(self, eBook: EBook, depth=PREFETCH_DEPTH, parent=None):
+        super().__init__(parent)
+        self.eBook = eBook
+        self.depth = depth
+        self.hits = 0
+        self.misses = 0
+        self._prepared: OrderedDict[str, PreparedChapter] = OrderedDict()
+        self._pending: dict[str, threading.Event] = {}
+
+    def prefetch_around(self, chapter_idx, max_width):
+        """预读 chapter_idx 前后 depth 个章节，并丢弃窗口之外的预读结果"""
+        paths = self.eBook.chapter_path_list
+        window = set()
+        for offset in range(-self.depth, self.depth + 1):
+            idx = chapter_idx + offset
+            if 0 <= idx < len(paths):
+                window.add(self.eBook.local_path(paths[idx]))
+        for local_path in list(self._prepared):
+            if local_path not in window:
+                del self._prepared[local_path]
+        for local_path, canceled in list(self._pending.items()):
+            if local_path not in window:
+                canceled.set()
+                del self._pending[local_path]
+        current_path = self.eBook.local_path(paths[chapter_idx])
+        for local_path in window:
+            # 当前章节已经在加载，只保留已有的预读结果
+            if local_path == current_path:
+                continue
+            if local_path in self._prepared or local_path in self._pending:
+                continue
+            canceled = threading.Event()
+            task = ChapterPrefetchTask(
+                self.eBook, local_path, max_width, canceled)
+            task.signals.ready.connect(self._on_ready)
+            self._pending[local_path] = canceled
+            get_prefetch_pool().start(task)
+
+    def _on_ready(self, prepared: PreparedChapter):
+        if self._pending.pop(prepared.local_path, None) is None:
+            return  # 已经移出预读窗口
+        self._prepared[prepared.local_path] = prepared
+
+    def get_chapter(self, local_path) -> PreparedChapter | None:
+        return self._prepared.get(local_path)
+
+    def take_chapter(self, local_path) -> PreparedChapter | None:
+        """章节加载时取出预读结果并记录命中情况"""
+        prepared = self._prepared.get(local_path)
+        if prepared is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return prepared
+
+    def cancel(self):
+        for canceled in self._pending.values():
+            canceled.set()
+        self._pending.clear()
+        self._prepared.clear()
+
+    def memory_usage(self):
+        """预读的章节 HTML 占用的内存（按字符数估计），图片计入共享的图片缓存"""
+        return sum(len(prepared.html) for prepared in self._prepared.values())
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "prepared": len(self._prepared), "pending": len(self._pending)}
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import threading
+import time
+
+from EBookCache import cache_path
+from EBookTabWidget import EBookChapterDisplay
+from Ebook import EBookStub
+from commom_import import *
+
+# 最后一次翻页或滚动之后多久保存阅读位置（毫秒）
+SAVE_DELAY_MS = 1000
+# 连续滚动时最多多久保存一次（毫秒）
+MAX_SAVE_DELAY_MS = 5000
+# “最近阅读”菜单中的书籍数
+RECENT_BOOKS = 10
+
+_progress_pool = None
+
+
+def get_progress_pool() -> qtc.QThreadPool:
+    """写入阅读进度专用的线程池，单线程保证写入按提交顺序进行"""
+    global _progress_pool
+    if _progress_pool is None:
+        _progress_pool = qtc.QThreadPool()
+        _progress_pool.setMaxThreadCount(1)
+    return _progress_pool
+
+
+class ReadingProgress:
+    """一本书的阅读位置：目录项、书脊章节、视口顶部所在行在章节内的字符位置和相对该行的像素偏移
+
+    以字符位置而不是像素记录，窗口大小、字体或阅读模式变化后仍能回到同一行。
+    """
+    __slots__ = ("fingerprint", "epub_path", "title", "toc_idx", "chapter_idx", "position", "offset", "updated")
+
+    def __init__(self, fingerprint, epub_path, title, toc_idx, chapter_idx, position, offset, updated=None):
+        self.fingerprint = fingerprint
+        self.epub_path = epub_path
+        self.title = title
+        self.toc_idx = toc_idx
+        self.chapter_idx = chapter_idx
+        self.position = position
+        self.offset = offset
+        self.updated = time.time() if updated is None else updated
+
+
+class EBookProgressStore:
+    """持久化的阅读进度和会话（打开的标签页）
+
+    每次保存只更新发生变化的书籍，数据库使用 WAL 日志，程序崩溃时最多丢失
+    最近一次保存之后的位置。阅读历史按书籍指纹保存，按最近阅读时间有索引。
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or cache_path("progress.sqlite3")
+        # 新建的数据库中还没有会话，调用方可以改用旧版本保存在设置文件中的会话
+        self.is_new = not os.path.exists(self.db_path)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS progress (
+                    fingerprint TEXT PRIMARY KEY,
+                    epub_path TEXT NOT NULL,
+                    title TEXT,
+                    toc_idx INTEGER NOT NULL,
+                    chapter_idx INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    offset REAL NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS progress_updated ON progress (updated)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS progress_epub_path ON progress (epub_path)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS session (
+                    slot INTEGER PRIMARY KEY,
+                    epub_path TEXT NOT NULL,
+                    toc_idx INTEGER NOT NULL,
+                    title TEXT,
+                    current INTEGER NOT NULL
+                )""")
+
+    def get(self, fingerprint) -> ReadingProgress | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM progress WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        return ReadingProgress(*row) if row is not None else None
+
+    def recent(self, limit=RECENT_BOOKS) -> list[ReadingProgress]:
+        """最近阅读的书籍，按阅读时间倒序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM progress ORDER BY updated DESC LIMIT ?", (limit,)).fetchall()
+        return [ReadingProgress(*row) for row in rows]
+
+    def put_many(self, records: list[ReadingProgress]):
+        with self._lock, self._conn:
+            # 源文件被修改过，旧指纹的进度失效
+            self._conn.executemany(
+                "DELETE FROM progress WHERE epub_path = ? AND fingerprint != ?",
+                [(record.epub_path, record.fingerprint) for record in records])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(record.fingerprint, record.epub_path, record.title, record.toc_idx, record.chapter_idx,
+                  record.position, record.offset, record.updated) for record in records])
+
+    def session(self) -> tuple[list[EBookStub], int | None]:
+        """上次会话的标签页和当前标签页下标，没有保存过会话时返回 ([], None)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT epub_path, toc_idx, title, current FROM session ORDER BY slot").fetchall()
+        current = next((slot for slot, row in enumerate(rows) if row[3]), None)
+        return [EBookStub(epub_path, toc_idx, title) for epub_path, toc_idx, title, _ in rows], current
+
+    def set_session(self, stubs: list[EBookStub], current):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM session")
+            self._conn.executemany(
+                "INSERT INTO session VALUES (?, ?, ?, ?, ?)",
+                [(slot, stub.epub_path, stub._now_toc_idx, stub.current_title(), slot == current)
+                 for slot, stub in enumerate(stubs)])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_progress_store = None
+_progress_store_lock = threading.Lock()
+
+
+def get_progress_store() -> EBookProgressStore:
+    """进程内共享的阅读进度存储"""
+    global _progress_store
+    with _progress_store_lock:
+        if _progress_store is None:
+            _progress_store = EBookProgressStore()
+        return _progress_store
+
+
+class ProgressWriteTask(qtc.QRunnable):
+    """在后台写入阅读位置和会话，session 为 None 时会话没有变化"""
+
+    def __init__(self, records: list[ReadingProgress], session: tuple[list[EBookStub], int] | None):
+        super().__init__()
+        self.records = records
+        self.session = session
+
+    def run(self):
+        try:
+            store = get_progress_store()
+            if self.records:
+                store.put_many(self.records)
+            if self.session is not None:
+                store.set_session(*self.session)
+        except Exception:
+            logger.warning("Failed to save reading progress", exc_info=True)
+
+
+class EBookProgressTracker(qtc.QObject):
+    """记录各标签页的阅读位置和打开的标签页
+
+    翻页、滚动和跳转只标记标签页，停止操作 SAVE_DELAY_MS 后（持续滚动时最迟
+    MAX_SAVE_DELAY_MS 后）在界面线程中取出位置，交给后台线程写入数据库。
+    """
+
+    def __init__(self, tab_widget, parent=None):
+        super().__init__(parent)
+        self.tab_widget = tab_widget
+        self._dirty = set()  # 位置变化后尚未保存的标签页
+        self._session_dirty = False
+        self._dirty_since = None
+        self._timer = qtc.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(SAVE_DELAY_MS)
+        self._timer.timeout.connect(self.flush)
+        tab_widget.tabs_changed.connect(self.mark_session)
+        tab_widget.currentChanged.connect(self.mark_session)
+
+    def track(self, display):
+        display.position_changed.connect(lambda: self.mark(display))
+        display.destroyed.connect(lambda: self._dirty.discard(display))
+
+    def mark(self, display):
+        self._dirty.add(display)
+        self._schedule()
+
+    def mark_session(self):
+        self._session_dirty = True
+        self._schedule()
+
+    def _schedule(self):
+        now = time.monotonic()
+        if not self._timer.isActive():
+            self._dirty_since = now
+        elif now - self._dirty_since >= MAX_SAVE_DELAY_MS / 1000:
+            return  # 已经等待了足够久，不再推迟
+        self._timer.start()
+
+    def _record(self, display) -> ReadingProgress | None:
+        position = display.reading_position()
+        if position is None:
+            return None
+        eBook = display.eBook
+        return ReadingProgress(eBook.fingerprint, eBook.epub_path, eBook.current_title(),
+                               eBook._now_toc_idx, *position)
+
+    def _session(self):
+        books = self.tab_widget.get_session_books()
+        current = self.tab_widget.currentWidget()
+        current_book = current.eBook if isinstance(current, EBookChapterDisplay) else getattr(current, "stub", None)
+        current_idx = next((i for i, book in enumerate(books) if book is current_book), 0)
+        return [EBookStub(book.epub_path, book._now_toc_idx, book.current_title()) for book in books], current_idx
+
+    def flush(self):
+        """取出待保存的位置并提交到后台写入"""
+        self._timer.stop()
+        records = []
+        for display in self._dirty:
+            if not display.hibernated:
+                record = self._record(display)
+                if record is not None:
+                    records.append(record)
+        self._dirty.clear()
+        session = self._session() if self._session_dirty else None
+        self._session_dirty = False
+        if records or session is not None:
+            get_progress_pool().start(ProgressWriteTask(records, session))
+
+
+__all__ = ["EBookProgressStore", "EBookProgressTracker", "MAX_SAVE_DELAY_MS", "ProgressWriteTask", "RECENT_BOOKS",
+           "ReadingProgress", "SAVE_DELAY_MS", "get_progress_pool", "get_progress_store"]
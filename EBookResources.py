@@ -0,0 +1,64 @@
+import os
+
+from build_resources import RESOURCE_DIRS
+from commom_import import *
+
+# 预先打包的图标和 QSS，由 build_resources.py 生成，不加入版本库
+RESOURCE_BUNDLE = "resources.rcc"
+
+_registered = False
+_icons: dict[str, qtg.QIcon] = {}
+
+
+def _newest_source(root_dir) -> tuple[float, str | None]:
+    """打包目录中最新的文件 (修改时间, 路径)，没有文件时为 (0, None)"""
+    newest = 0.0, None
+    for directory in RESOURCE_DIRS:
+        for current, _, names in os.walk(os.path.join(root_dir, directory)):
+            for name in names:
+                path = os.path.join(current, name)
+                newest = max(newest, (os.path.getmtime(path), path))
+    return newest
+
+
+def register_resources(bundle_path=RESOURCE_BUNDLE) -> bool:
+    """注册资源包，之后的资源从映射到内存的资源包中读取；资源包不存在，或者
+    figures/、qss/ 中有比资源包新的文件时使用磁盘上的文件"""
+    global _registered
+    if not _registered and os.path.exists(bundle_path):
+        mtime, path = _newest_source(os.path.dirname(bundle_path) or ".")
+        if mtime > os.path.getmtime(bundle_path):
+            logger.warning(f"{path} is newer than resource bundle {bundle_path}, "
+                           f"using files on disk; run build_resources.py to rebuild it")
+            return False
+        _registered = qtc.QResource.registerResource(bundle_path)
+        if not _registered:
+            logger.warning(f"Failed to register resource bundle {bundle_path}")
+    return _registered
+
+
+def resource_path(path) -> str:
+    """资源的实际路径，path 相对于程序目录，如 "figures/close_icon.svg" """
+    return f":/{path}" if _registered else f"./{path}"
+
+
+def read_resource_text(path) -> str:
+    """读取文本资源，换行统一为 \\n"""
+    f = qtc.QFile(resource_path(path))
+    if not f.open(qtc.QIODevice.OpenModeFlag.ReadOnly | qtc.QIODevice.OpenModeFlag.Text):
+        raise FileNotFoundError(f"Resource not found: {path}")
+    try:
+        return bytes(f.readAll()).decode("utf-8")
+    finally:
+        f.close()
+
+
+def get_icon(path) -> qtg.QIcon:
+    """进程内共享的图标，每个文件只创建一次 QIcon，只在界面线程中使用"""
+    icon = _icons.get(path)
+    if icon is None:
+        icon = _icons[path] = qtg.QIcon(resource_path(path))
+    return icon
+
+
+__all__ = ["RESOURCE_BUNDLE", "get_icon", "read_resource_text", "register_resources", "resource_path"]
@@ -0,0 +1,476 @@
+import bisect
+import codecs
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter
+from html.parser import HTMLParser
+
+from EBookArchive import EBookArchive
+from EBookCache import book_fingerprint, cache_path
+from EBookParser import OPFPackage, chapter_encoding, map_toc_to_spine, parse_toc_tree
+
+# 表结构、分词或提取文字的方式变化时递增，旧版本的索引会被整体重建
+SCHEMA_VERSION = 3
+# 默认返回的结果条数
+MAX_RESULTS = 100
+# 摘要中命中位置前后保留的字符数
+SNIPPET_CHARS = 30
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 流式提取文字时每次读取的字节数
+STREAM_CHUNK = 64 * 1024
+# 判断章节编码时检查的开头字节数（BOM 和 XML 声明）
+ENCODING_HEAD = 256
+
+# 中日韩文字按二元组切分，其余文字按单词切分
+_CJK = "぀-ヿ㐀-䶿一-鿿가-힯豈-﫿"
+_TOKEN_RE = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+_SPACE_RE = re.compile(r"\s+")
+
+# 这些标签的内容不显示，不参与索引
+_SKIP_TAGS = {"head", "script", "style", "title"}
+# 这些标签前后断行，避免相邻段落的文字连成一个词
+_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6",
+               "blockquote", "section", "article", "pre", "dd", "dt", "td", "th"}
+
+
+def tokenize(text):
+    """切分文本，返回 (词项, 起始位置) 的迭代器
+
+    中日韩文字连续段切成重叠的二元组，并把段的最后一个字单独作为一元词项，
+    单字查询因此可以用前缀匹配找到所有包含该字的二元组；其余文字按单词切分并转为小写。
+    """
+    for match in _TOKEN_RE.finditer(text):
+        cjk, word = match.groups()
+        start = match.start()
+        if word is not None:
+            yield word.lower(), start
+            continue
+        for i in range(len(cjk) - 1):
+            yield cjk[i:i + 2], start + i
+        yield cjk[-1], start + len(cjk) - 1
+
+
+def query_terms(query):
+    """查询语句中必须全部出现的词项，单个汉字以 (字, True) 表示需要前缀匹配"""
+    terms = []
+    for match in _TOKEN_RE.finditer(query):
+        cjk, word = match.groups()
+        if word is not None:
+            terms.append((word.lower(), False))
+        elif len(cjk) == 1:
+            terms.append((cjk, True))
+        else:
+            terms.extend((cjk[i:i + 2], False) for i in range(len(cjk) - 1))
+    return list(dict.fromkeys(terms))
+
+
+class _TextExtractor(HTMLParser):
+    """提取章节的可见文字，并记录带 id 元素在文字中的位置"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.length = 0
+        self.ids = {}
+        self._skip = 0
+        self._space = True  # 已输出的文字为空或以空白结尾，下一段文字开头的空白不再输出
+
+    def _append(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+        self._space = text[-1].isspace()
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self._append("\n")
+        for name, value in attrs:
+            if name == "id" and value:
+                self.ids.setdefault(value, self.length)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in _SKIP_TAGS:
+            self._skip -= 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        # 行内元素之间只有空白的文本节点也是词的分隔，合并为一个空格；块的开头不输出空白
+        text = _SPACE_RE.sub(" ", data)
+        if self._space:
+            text = text.lstrip(" ")
+        if text:
+            self._append(text)
+
+    def text(self):
+        return "".join(self.parts)
+
+
+def extract_text(html: bytes):
+    """返回章节的纯文本和 {id: 文字位置}"""
+    parser = _TextExtractor()
+    parser.feed(html.decode(chapter_encoding(html[:ENCODING_HEAD]), "replace"))
+    parser.close()
+    return parser.text(), parser.ids
+
+
+def iter_text(stream, chunk_size=STREAM_CHUNK):
+    """从二进制文件流中逐块解析 HTML，边读边产出可见文字，不需要先读入整个文件
+
+    按开头的 BOM 和 XML 声明选择解码器，与 normalize_html 的判断相同。
+    """
+    head = b""
+    while len(head) < ENCODING_HEAD:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        head += chunk
+    decoder = codecs.getincrementaldecoder(chapter_encoding(head[:ENCODING_HEAD]))("replace")
+    parser = _TextExtractor()
+    while True:
+        if head:
+            chunk, head = head, b""
+        else:
+            chunk = stream.read(chunk_size)
+        parser.feed(decoder.decode(chunk, final=not chunk))
+        if not chunk:
+            parser.close()
+        if parser.parts:
+            yield "".join(parser.parts)
+            parser.parts.clear()
+        if not chunk:
+            return
+
+
+def index_book(epub_path, fingerprint=None):
+    """提取一本书所有书脊文档的文字并建立这本书的倒排表，在索引进程中运行
+
+    返回可以直接交给 EBookSearchIndex.put_book 的字典，写入线程只需插入数据。
+    """
+    stat = os.stat(epub_path)
+    with EBookArchive(epub_path) as archive:
+        package = OPFPackage(archive)
+        toc = map_toc_to_spine(parse_toc_tree(archive, package), package)
+        toc_by_chapter = {}
+        for toc_idx, (title, anchor, chapter_idx, _) in enumerate(toc):
+            toc_by_chapter.setdefault(chapter_idx, []).append(
+                (toc_idx, title, anchor.partition("#")[2]))
+        chapters = []
+        postings: dict[str, array] = {}
+        last_section = (0, 0, toc[0][0] if toc else "")
+        for chapter_idx, path in enumerate(package.spine):
+            if not archive.exists(path):
+                continue
+            text, ids = extract_text(archive.read(path))
+            # 章节内每个目录项的起始位置，用于把命中位置定位到最近的目录项
+            sections = []
+            for toc_idx, title, fragment in toc_by_chapter.get(chapter_idx, ()):
+                offset = ids.get(fragment, 0) if fragment else 0
+                sections.append((offset, toc_idx, title))
+            sections.sort()
+            if not sections:
+                # 不在目录中的章节归入前一个目录项
+                sections.append(last_section)
+            last_section = (0,) + sections[-1][1:]
+            terms = Counter(term for term, _ in tokenize(text))
+            for term, tf in terms.items():
+                postings.setdefault(term, array("I")).extend((chapter_idx, tf))
+            chapters.append({
+                "chapter_idx": chapter_idx,
+                "title": sections[0][2],
+                "text": zlib.compress(text.encode("utf-8")),
+                "sections": json.dumps(sections, ensure_ascii=False),
+                "length": sum(terms.values()),
+            })
+    return {
+        "epub_path": os.path.abspath(epub_path),
+        "fingerprint": fingerprint or book_fingerprint(epub_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "title": package.metadata.get("title") or os.path.splitext(os.path.basename(epub_path))[0],
+        "chapters": chapters,
+        # 按词项排序，写入时插入位置在 B 树中连续
+        "postings": [(term, postings[term].tobytes()) for term in sorted(postings)],
+    }
+
+
+class SearchHit:
+    """一条搜索结果：书籍、章节、目录位置和带命中位置的摘要"""
+
+    def __init__(self, epub_path, book_title, chapter_idx, toc_idx, chapter_title,
+                 snippet, match_start, match_length, score):
+        self.epub_path = epub_path
+        self.book_title = book_title
+        self.chapter_idx = chapter_idx  # 书脊下标
+        self.toc_idx = toc_idx  # 命中位置之前最近的目录项
+        self.chapter_title = chapter_title
+        self.snippet = snippet
+        self.match_start = match_start  # 命中文字在摘要中的位置
+        self.match_length = match_length
+        self.score = score
+
+    def matched_text(self):
+        return self.snippet[self.match_start:self.match_start + self.match_length]
+
+
+class EBookSearchIndex:
+    """书库的全文倒排索引
+
+    以章节为文档，postings 表每本书每个词项一行，chapters 为 (书脊下标, 词频)
+    交替排列的整数数组。查询时取所有词项的交集并按 BM25 排序，只对排在前面的
+    结果解压章节文字生成摘要。书籍按内容指纹
+    增量更新，文件大小和修改时间未变的书籍不会重新索引。
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or cache_path("search_index.sqlite3")
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._stats = None  # (章节数, 平均词项数, {(书籍 id, 书脊下标): 词项数})
+        self._migrate()
+        # WAL 模式下查询使用单独的连接，建立索引时不必等待写入完成
+        self._read_lock = threading.Lock()
+        self._read_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == SCHEMA_VERSION:
+                return
+            # 索引可以从书籍重建，版本不一致时直接丢弃
+            for table in ("postings", "chapters", "books"):
+                self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._conn.execute("""
+                CREATE TABLE books (
+                    book_id INTEGER PRIMARY KEY,
+                    epub_path TEXT NOT NULL UNIQUE,
+                    fingerprint TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            self._conn.execute("""
+                CREATE TABLE chapters (
+                    book_id INTEGER NOT NULL,
+                    chapter_idx INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    sections TEXT NOT NULL,
+                    text BLOB NOT NULL,
+                    PRIMARY KEY (book_id, chapter_idx)
+                )""")
+            self._conn.execute("""
+                CREATE TABLE postings (
+                    term TEXT NOT NULL,
+                    book_id INTEGER NOT NULL,
+                    chapters BLOB NOT NULL,
+                    PRIMARY KEY (term, book_id)
+                ) WITHOUT ROWID""")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # ---------- 书库 ----------
+
+    def book_paths(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT epub_path FROM books")]
+
+    def stale_paths(self, paths) -> list[tuple[str, str]]:
+        """新增或文件大小、修改时间变化过的书籍 [(路径, 指纹)]"""
+        stale = []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT size, mtime_ns FROM books WHERE epub_path = ?", (path,)).fetchone()
+            if row != (stat.st_size, stat.st_mtime_ns):
+                stale.append((path, book_fingerprint(path)))
+        return stale
+
+    def remove_missing(self) -> int:
+        """删除源文件已不存在的书籍"""
+        missing = [path for path in self.book_paths() if not os.path.exists(path)]
+        for path in missing:
+            self.remove_book(path)
+        return len(missing)
+
+    def _delete_book(self, epub_path):
+        row = self._conn.execute(
+            "SELECT book_id FROM books WHERE epub_path = ?", (epub_path,)).fetchone()
+        if row is None:
+            return
+        # 词项从保存的章节文字中重新切分，按主键删除，postings 不需要 book_id 索引
+        terms = set()
+        for text, in self._conn.execute("SELECT text FROM chapters WHERE book_id = ?", row):
+            terms.update(term for term, _ in tokenize(zlib.decompress(text).decode("utf-8")))
+        self._conn.executemany(
+            "DELETE FROM postings WHERE term = ? AND book_id = ?",
+            ((term, row[0]) for term in sorted(terms)))
+        self._conn.execute("DELETE FROM chapters WHERE book_id = ?", row)
+        self._conn.execute("DELETE FROM books WHERE book_id = ?", row)
+
+    def remove_book(self, epub_path):
+        with self._lock, self._conn:
+            self._delete_book(os.path.abspath(epub_path))
+            self._stats = None
+
+    def put_book(self, data: dict):
+        """写入 index_book 的结果，替换同一路径下的旧记录"""
+        with self._lock, self._conn:
+            self._delete_book(data["epub_path"])
+            book_id = self._conn.execute(
+                "INSERT INTO books (epub_path, fingerprint, title, size, mtime_ns, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (data["epub_path"], data["fingerprint"], data["title"],
+                 data["size"], data["mtime_ns"], time.time())).lastrowid
+            self._conn.executemany(
+                "INSERT INTO chapters VALUES (?, ?, ?, ?, ?, ?)",
+                ((book_id, chapter["chapter_idx"], chapter["title"], chapter["length"],
+                  chapter["sections"], chapter["text"]) for chapter in data["chapters"]))
+            self._conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                ((term, book_id, chapters) for term, chapters in data["postings"]))
+            self._stats = None
+
+    # ---------- 查询 ----------
+
+    def _collection_stats(self):
+        """BM25 需要的章节数、平均长度和每个章节的长度，索引变化前只读取一次"""
+        if self._stats is None:
+            lengths = {(book_id, chapter_idx): length for book_id, chapter_idx, length
+                       in self._read_conn.execute("SELECT book_id, chapter_idx, length FROM chapters")}
+            average = sum(lengths.values()) / len(lengths) if lengths else 1.0
+            self._stats = (len(lengths), average or 1.0, lengths)
+        return self._stats
+
+    def _term_postings(self, term, prefix) -> dict[tuple[int, int], int]:
+        """词项出现的 (书籍 id, 书脊下标) -> 词频，prefix 为 True 时合并所有以 term 开头的词项"""
+        if prefix:
+            rows = self._read_conn.execute(
+                "SELECT book_id, chapters FROM postings WHERE term >= ? AND term < ?",
+                (term, chr(ord(term) + 1)))
+        else:
+            rows = self._read_conn.execute(
+                "SELECT book_id, chapters FROM postings WHERE term = ?", (term,))
+        postings = {}
+        for book_id, blob in rows:
+            values = array("I")
+            values.frombytes(blob)
+            for chapter_idx, tf in zip(values[::2], values[1::2]):
+                key = (book_id, chapter_idx)
+                postings[key] = postings.get(key, 0) + tf
+        return postings
+
+    def search(self, query, limit=MAX_RESULTS) -> list[SearchHit]:
+        """返回包含查询中所有词项的章节，原文中连续出现查询语句的结果排在前面"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._read_lock:
+            count, average, lengths = self._collection_stats()
+            postings = []
+            for term, prefix in terms:
+                term_postings = self._term_postings(term, prefix)
+                if not term_postings:
+                    return []
+                postings.append(term_postings)
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for term_postings in postings[1:]:
+                candidates.intersection_update(term_postings)
+                if not candidates:
+                    return []
+            idfs = [math.log(1 + (count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+                    for term_postings in postings]
+            scores = {}
+            for chapter in candidates:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths.get(chapter, average) / average)
+                score = 0.0
+                for idf, term_postings in zip(idfs, postings):
+                    tf = term_postings[chapter]
+                    score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                scores[chapter] = score
+            top = heapq.nlargest(limit, scores, key=scores.get)
+            hits = [self._make_hit(chapter, query, terms, scores[chapter]) for chapter in top]
+        # 连续出现整个查询语句的结果优先
+        hits.sort(key=lambda hit: (hit.matched_text().lower() != _normalize_query(query),
+                                   -hit.score))
+        return hits
+
+    def _make_hit(self, chapter, query, terms, score) -> SearchHit:
+        book_id, chapter_idx = chapter
+        epub_path, book_title, sections, text = self._read_conn.execute(
+            "SELECT b.epub_path, b.title, c.sections, c.text FROM chapters c "
+            "JOIN books b ON b.book_id = c.book_id WHERE c.book_id = ? AND c.chapter_idx = ?",
+            (book_id, chapter_idx)).fetchone()
+        text = zlib.decompress(text).decode("utf-8")
+        lowered = text.lower()
+        needle = _normalize_query(query)
+        position = lowered.find(needle)
+        length = len(needle)
+        if position == -1:
+            # 查询语句没有连续出现，定位到第一个词项
+            term = terms[0][0]
+            position = max(0, lowered.find(term))
+            length = len(term)
+        sections = json.loads(sections)
+        section = bisect.bisect_right([offset for offset, _, _ in sections], position) - 1
+        _, toc_idx, title = sections[max(0, section)]
+        start = max(0, position - SNIPPET_CHARS)
+        end = min(len(text), position + length + SNIPPET_CHARS)
+        snippet = text[start:end].replace("\n", " ")
+        prefix = "…" if start > 0 else ""
+        suffix = "…" if end < len(text) else ""
+        return SearchHit(epub_path, book_title, chapter_idx, toc_idx, title,
+                         prefix + snippet + suffix, len(prefix) + position - start, length, score)
+
+    def close(self):
+        with self._read_lock:
+            self._read_conn.close()
+        with self._lock:
+            self._conn.close()
+
+
+def _normalize_query(query):
+    return _SPACE_RE.sub(" ", query.strip()).lower()
+
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index() -> EBookSearchIndex:
+    """进程内共享的全文索引"""
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = EBookSearchIndex()
+        return _search_index
+
+
+__all__ = ["EBookSearchIndex", "MAX_RESULTS", "SCHEMA_VERSION", "SearchHit", "get_search_index",
+           "index_book", "iter_text", "query_terms", "tokenize"]
@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+
+from EBookLibrary import get_library_catalog
+from EBookSearch import SearchHit, get_search_index, index_book
+from commom_import import *
+
+# 建立索引的进程数
+INDEX_PROCESSES = max(1, (os.cpu_count() or 2) - 1)
+# 输入停止多久后开始搜索（毫秒）
+SEARCH_DELAY_MS = 200
+
+_index_pool = None
+
+
+def get_index_pool() -> qtc.QThreadPool:
+    """建立索引专用的线程池，同一时间只运行一个索引任务"""
+    global _index_pool
+    if _index_pool is None:
+        _index_pool = qtc.QThreadPool()
+        _index_pool.setMaxThreadCount(1)
+    return _index_pool
+
+
+class SearchIndexSignals(qtc.QObject):
+    progress = qtc.pyqtSignal(int, int, str)  # 已完成, 总数, 书名
+    finished = qtc.pyqtSignal(int)  # 新索引的书籍数
+
+
+class SearchIndexTask(qtc.QRunnable):
+    """在进程池中提取书籍文字，并在当前线程写入全文索引
+
+    scan_library 为 True 时还会重新检查已索引的书籍，并遍历书库文件夹找出新增的书籍。
+    """
+
+    def __init__(self, paths, scan_library=False):
+        super().__init__()
+        self.paths = paths
+        self.scan_library = scan_library
+        self.signals = SearchIndexSignals()
+        self._canceled = threading.Event()
+
+    def cancel(self):
+        self._canceled.set()
+
+    def run(self):
+        index = get_search_index()
+        index.remove_missing()
+        paths = self.paths
+        if self.scan_library:
+            paths = list(dict.fromkeys(
+                paths + index.book_paths() + get_library_catalog().library_paths()))
+        stale = index.stale_paths(paths)
+        indexed = 0
+        if stale:
+            start = time.perf_counter()
+            # spawn 启动的子进程不会继承 Qt 的线程状态
+            # 启动时用不到进程池，在这里才导入
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(min(INDEX_PROCESSES, len(stale)), mp_context=context) as pool:
+                futures = {pool.submit(index_book, path, fingerprint): path
+                           for path, fingerprint in stale}
+                for done, future in enumerate(as_completed(futures), 1):
+                    if self._canceled.is_set():
+                        pool.shutdown(cancel_futures=True)
+                        break
+                    path = futures[future]
+                    try:
+                        index.put_book(future.result())
+                        indexed += 1
+                    except Exception as e:
+                        logger.warning(f"Failed to index {path}: {e}")
+                    self.signals.progress.emit(
+                        done, len(stale), os.path.splitext(os.path.basename(path))[0])
+            logger.info(
+                f"Indexed {indexed}/{len(stale)} books in {time.perf_counter() - start:.1f}s")
+        self.signals.finished.emit(indexed)
+
+
+class EBookSearchIndexer(qtc.QObject):
+    """合并索引请求，保证同一时间只有一个索引任务"""
+    progress = qtc.pyqtSignal(int, int, str)
+    finished = qtc.pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pending: dict[str, None] = {}
+        self._scan_library = False
+        self._task = None
+
+    def is_running(self):
+        return self._task is not None
+
+    def update(self, paths):
+        """增量索引 paths 中新增或修改过的书籍"""
+        self._pending.update(dict.fromkeys(os.path.abspath(path) for path in paths))
+        if self._task is None:
+            self._start()
+
+    def update_library(self):
+        """增量索引书库中所有的书籍，并删除已不存在的书籍"""
+        self._scan_library = True
+        if self._task is None:
+            self._start()
+
+    def _start(self):
+        if not self._pending and not self._scan_library:
+            return
+        self._task = SearchIndexTask(list(self._pending), self._scan_library)
+        self._pending.clear()
+        self._scan_library = False
+        self._task.signals.progress.connect(self.progress)
+        self._task.signals.finished.connect(self._on_finished)
+        get_index_pool().start(self._task)
+
+    def _on_finished(self, indexed):
+        self._task = None
+        self.finished.emit(indexed)
+        self._start()
+
+    def cancel(self):
+        self._pending.clear()
+        self._scan_library = False
+        if self._task is not None:
+            self._task.cancel()
+
+
+class EBookSearchDialog(qtw.QDialog):
+    """书库全文搜索，双击结果在对应位置打开书籍"""
+    hit_activated = qtc.pyqtSignal(object, str)  # SearchHit, 查询语句
+    folder_added = qtc.pyqtSignal(str)
+
+    def __init__(self, indexer: EBookSearchIndexer, parent=None):
+        super().__init__(parent)
+        self.indexer = indexer
+        self.setWindowTitle("全文搜索")
+        self.setObjectName("searchDialog")
+        self.resize(640, 480)
+
+        layout = qtw.QVBoxLayout(self)
+        self._query_edit = qtw.QLineEdit()
+        self._query_edit.setPlaceholderText("搜索书库中的文字")
+        self._query_edit.setClearButtonEnabled(True)
+        layout.addWidget(self._query_edit)
+
+        self._result_list = qtw.QListWidget()
+        self._result_list.setObjectName("searchResultList")
+        self._result_list.setWordWrap(True)
+        layout.addWidget(self._result_list)
+
+        self._status_label = qtw.QLabel()
+        layout.addWidget(self._status_label)
+        self._progress_bar = qtw.QProgressBar()
+        self._progress_bar.hide()
+        layout.addWidget(self._progress_bar)
+
+        button_layout = qtw.QHBoxLayout()
+        add_folder_button = qtw.QPushButton("添加文件夹…")
+        add_folder_button.clicked.connect(self.add_folder)
+        button_layout.addWidget(add_folder_button)
+        update_button = qtw.QPushButton("更新索引")
+        update_button.clicked.connect(self.indexer.update_library)
+        button_layout.addWidget(update_button)
+        button_layout.addStretch()
+        layout.addLayout(button_layout)
+
+        self._search_timer = qtc.QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DELAY_MS)
+        self._search_timer.timeout.connect(self.search)
+        self._query_edit.textChanged.connect(self._search_timer.start)
+        self._query_edit.returnPressed.connect(self.search)
+        self._result_list.itemActivated.connect(self.on_item_activated)
+        self.indexer.progress.connect(self.on_index_progress)
+        self.indexer.finished.connect(self.on_index_finished)
+
+    def add_folder(self):
+        folder = qtw.QFileDialog.getExistingDirectory(self, "添加书库文件夹")
+        if not folder:
+            return
+        get_library_catalog().add_folder(folder)
+        self.folder_added.emit(folder)
+        self.indexer.update_library()
+
+    def search(self):
+        self._search_timer.stop()
+        query = self._query_edit.text().strip()
+        self._result_list.clear()
+        if not query:
+            self._status_label.clear()
+            return
+        start = time.perf_counter()
+        hits = get_search_index().search(query)
+        elapsed = (time.perf_counter() - start) * 1000
+        for hit in hits:
+            item = qtw.QListWidgetItem(
+                f"《{hit.book_title}》 {hit.chapter_title}\n{hit.snippet}")
+            item.setData(qtc.Qt.ItemDataRole.UserRole, hit)
+            item.setToolTip(hit.epub_path)
+            self._result_list.addItem(item)
+        self._status_label.setText(f"找到 {len(hits)} 条结果，用时 {elapsed:.1f} ms")
+
+    def on_item_activated(self, item: qtw.QListWidgetItem):
+        hit: SearchHit = item.data(qtc.Qt.ItemDataRole.UserRole)
+        self.hit_activated.emit(hit, self._query_edit.text().strip())
+
+    def on_index_progress(self, done, total, book_name):
+        self._progress_bar.show()
+        self._progress_bar.setRange(0, total)
+        self._progress_bar.setValue(done)
+        self._status_label.setText(f"正在建立索引：{book_name}（{done}/{total}）")
+
+    def on_index_finished(self, indexed):
+        self._progress_bar.hide()
+        self._status_label.setText(f"索引已更新，新增或更新 {indexed} 本书")
+        if self._query_edit.text().strip():
+            self.search()
@@ -1,4 +1,16 @@
-from Ebook import EBook, EBookChapter
+import os
+import threading
+
+from EBookAnchors import EBookAnchorIndex
+from EBookChapterCache import load_simplified_chapter
+from EBookContinuous import EBookContinuousScroller
+from EBookImageCache import ImageRescaleTask, get_image_cache, width_bucket
+from EBookPagination import EBookPager
+from EBookPrefetch import EBookPrefetcher, get_prefetch_pool
+from EBookResources import get_icon
+from EBookTocModel import EBookTocModel
+from EBookTracing import get_tracer, span
+from Ebook import EBook, EBookChapter, EBookStub
 from commom_import import *
 
 
@@ -8,20 +20,20 @@ class EBookTabCloseButton(qtw.QPushButton):
         self.setFixedSize(qtc.QSize(20, 20))  # 稍微增大按钮尺寸
         self.hovered = False  # 记录鼠标悬停状态
         self.setObjectName("tabCloseButton")  # 设置对象名称以应用样式
-        self.setIcon(qtg.QIcon("./figures/close_icon.svg"))  # 设置图标
+        self.setIcon(get_icon("figures/close_icon.svg"))  # 设置图标
         self.setToolTip("关闭标签页")
         self.setFlat(True)  # 扁平样式
 
     def enterEvent(self, event):
         """鼠标进入按钮时"""
         self.hovered = True
-        self.setIcon(qtg.QIcon("./figures/close_icon_hover.svg"))
+        self.setIcon(get_icon("figures/close_icon_hover.svg"))
         self.update()
 
     def leaveEvent(self, event):
         """鼠标离开按钮时"""
         self.hovered = False
-        self.setIcon(qtg.QIcon("./figures/close_icon.svg"))
+        self.setIcon(get_icon("figures/close_icon.svg"))
         self.update()
 
 
@@ -38,8 +50,12 @@ class EBookTabBar(qtw.QTabBar):
         """在插入标签时自定义关闭按钮"""
         button = EBookTabCloseButton(self)
         button.clicked.connect(self.on_tab_close_requested)
+        # setTabButton 只隐藏原来的关闭按钮，它会一直留在标签栏中，每次切换主题都被重新套用样式
+        default_button = self.tabButton(index, qtw.QTabBar.ButtonPosition.RightSide)
         self.setTabButton(
             index, qtw.QTabBar.ButtonPosition.RightSide, button)  # 右侧放置关闭按钮
+        if default_button is not None:
+            default_button.deleteLater()
 
     def on_tab_close_requested(self):
         index = self.tabAt(self.sender().pos())
@@ -47,9 +63,59 @@ class EBookTabBar(qtw.QTabBar):
 
 
 class EBookChapterDisplay(qtw.QTextBrowser):
+    chapter_changed = qtc.pyqtSignal(int)  # 连续滚动或翻页时视口顶部所在的书脊章节发生变化
+    page_changed = qtc.pyqtSignal()  # 分页模式下当前页或分页进度发生变化
+    position_changed = qtc.pyqtSignal()  # 滚动、翻页或跳转改变了阅读位置
+    toc_changed = qtc.pyqtSignal(int)  # 滚动到章节中的另一个目录项，参数为新的目录下标
+    # 估算 QTextDocument 内存时每个字符的平均开销（文本、格式和布局）
+    DOCUMENT_BYTES_PER_CHAR = 64
+    # 窗口大小停止变化多久后重新缩放图片（毫秒）
+    RESCALE_DELAY_MS = 150
+    # 滚动停止多久后为当前章节建立锚点索引（毫秒）
+    ANCHOR_INDEX_DELAY_MS = 100
+
     def __init__(self, eBook: EBook, parent=None):
         super().__init__(parent)
         self.eBook = eBook
+        self.toc_model = None
+        self.chapter_idx = None  # 当前章节的书脊下标
+        self.find_query = None  # 书内查找的查询语句，加载章节后高亮所有匹配
+        self.scroller: EBookContinuousScroller | None = None  # 连续滚动模式下不为 None
+        self.pager: EBookPager | None = None  # 分页模式下不为 None
+        self._setting_source = False  # 由程序而不是点击链接设置 source
+        self._anchor_index: EBookAnchorIndex | None = None  # 当前章节的锚点索引，第一次使用时建立
+        self.hibernated = False
+        # (source, 首个可见字符位置, 像素偏移)，连续滚动模式下为 (None, 章节下标, 章节内偏移)
+        self._hibernated_state = None
+        self._hibernated_reading_position = None  # 休眠前的 reading_position()
+        self._resource_bytes: dict[str, int] = {}
+        self._image_bucket = None  # 当前文档中图片的宽度档位
+        self._reader_font: qtg.QFont | None = None  # 用户选择的阅读字体，None 时使用样式表中的字体
+        self._layout_attrs = None  # 加载章节后尚未绘制时，记录首次绘制（布局）span 的属性
+        self._rescale_canceled = None
+        self._rescale_timer = qtc.QTimer(self)
+        self._rescale_timer.setSingleShot(True)
+        self._rescale_timer.setInterval(self.RESCALE_DELAY_MS)
+        self._rescale_timer.timeout.connect(self.rescale_images)
+        # 套用样式表时字体会被连续重设几次，合并为一次重新布局
+        self._font_timer = qtc.QTimer(self)
+        self._font_timer.setSingleShot(True)
+        self._font_timer.setInterval(0)
+        self._font_timer.timeout.connect(self._apply_font)
+        # 滚动时合并同一轮事件中的多次滚动，再同步当前目录项
+        self._toc_timer = qtc.QTimer(self)
+        self._toc_timer.setSingleShot(True)
+        self._toc_timer.setInterval(0)
+        self._toc_timer.timeout.connect(self._on_toc_timer)
+        # 锚点索引在滚动停下后才建立，加载章节和连续滚动时不承担遍历整章的开销
+        self._index_timer = qtc.QTimer(self)
+        self._index_timer.setSingleShot(True)
+        self._index_timer.setInterval(self.ANCHOR_INDEX_DELAY_MS)
+        self._index_timer.timeout.connect(self._on_index_timer)
+        self._link_color: str | None = None  # 当前主题样式表中的链接颜色
+        self._stale_link_colors: set[int] = set()  # 文档中可能残留的旧主题链接颜色 (rgba)
+        # 在后台预读前后章节，翻页时直接使用预读结果
+        self.prefetcher = EBookPrefetcher(eBook, parent=self)
         self.setOpenExternalLinks(True)
         self.setOpenLinks(True)
         self.setAcceptRichText(True)
@@ -62,29 +128,766 @@ class EBookChapterDisplay(qtw.QTextBrowser):
             qtc.Qt.ScrollBarPolicy.ScrollBarAsNeeded)
         self.setHorizontalScrollBarPolicy(
             qtc.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.verticalScrollBar().valueChanged.connect(self.position_changed)
+        self.verticalScrollBar().valueChanged.connect(self._schedule_toc_sync)
+
+    def get_toc_model(self) -> EBookTocModel:
+        """本书的目录模型，第一次使用时创建"""
+        if self.toc_model is None:
+            self.toc_model = EBookTocModel(self.eBook, self)
+        return self.toc_model
+
+    def image_max_width(self):
+        return int(self.width() * 0.95)  # 让图片最大宽度适应 QTextBrowser
 
     def load_chapter(self, eBookChapter: EBookChapter):
-        local_url = qtc.QUrl.fromLocalFile(eBookChapter.path)
-        self.setSource(local_url)
-        self.scrollToAnchor(eBookChapter.get_anchor())
-        self.setWindowTitle(eBookChapter.title)
+        if self.scroller is not None:
+            self._jump_to_chapter(eBookChapter)
+            return
+        local_path = self.eBook.local_path(eBookChapter.path)
+        attrs = {"book": self.eBook.book_name, "chapter": eBookChapter.title}
+        with span("chapter.load", **attrs) as load_attrs:
+            prefetched = self.prefetcher.take_chapter(local_path) is not None
+            load_attrs["prefetched"] = prefetched
+            self._resource_bytes.clear()
+            self.cancel_rescale()
+            self._image_bucket = width_bucket(self.image_max_width())
+            chapter_idx = self.eBook.chapter_index(eBookChapter.path)
+            self.chapter_idx = chapter_idx
+            load_attrs["chapter_idx"] = chapter_idx
+            with span("chapter.set_source", **attrs):
+                self._set_source(qtc.QUrl.fromLocalFile(local_path))
+            with span("chapter.scroll_to_anchor", **attrs):
+                self.scroll_to_anchor(eBookChapter.get_anchor())
+            self._layout_attrs = attrs
+            self.setWindowTitle(eBookChapter.title)
+            logger.info(
+                f"Load chapter: {eBookChapter.title} from anchor: {eBookChapter.anchor}")
+            logger.debug(
+                f"Prefetch {'hit' if prefetched else 'miss'}: {self.prefetcher.stats()}")
+            self.highlight_matches()
+            if self.pager is not None:
+                self.pager.on_chapter_loaded()
+            if chapter_idx is not None:
+                self.prefetcher.prefetch_around(
+                    chapter_idx, self.image_max_width())
+        # 调用方已经设置了目录位置，加载时的滚动不需要同步目录
+        self._toc_timer.stop()
+        self.position_changed.emit()
+
+    def _jump_to_chapter(self, eBookChapter: EBookChapter, offset=0.0):
+        """连续滚动模式下跳转到章节的锚点，窗口中没有该章节时先加载"""
+        chapter_idx = self.eBook.chapter_index(eBookChapter.path)
+        if chapter_idx is None:
+            return
+        with span("chapter.load", book=self.eBook.book_name, chapter=eBookChapter.title,
+                  chapter_idx=chapter_idx, continuous=True):
+            self.setWindowTitle(eBookChapter.title)
+            if self.scroller.first is None:
+                self.scroller.start(chapter_idx, eBookChapter.get_anchor(), offset)
+            else:
+                self.scroller.jump_to(chapter_idx, eBookChapter.get_anchor(), offset)
         logger.info(
-            f"Load chapter: {eBookChapter.title} from anchor: {eBookChapter.anchor}")
+            f"Jump to chapter: {eBookChapter.title} from anchor: {eBookChapter.anchor}")
+        self.prefetcher.prefetch_around(chapter_idx, self.image_max_width())
+        self._toc_timer.stop()
+        self.position_changed.emit()
+
+    def is_continuous(self):
+        return self.scroller is not None
+
+    def set_continuous(self, enabled):
+        """切换连续滚动模式，保持当前章节和章节内的滚动位置"""
+        if enabled == self.is_continuous():
+            return
+        self._anchor_index = None
+        if enabled:
+            chapter_idx = self.chapter_idx
+            self.scroller = EBookContinuousScroller(self)
+            if chapter_idx is None:
+                return  # 还没有加载章节，第一次 load_chapter 时建立滚动面
+            if self.hibernated:
+                # 休眠的标签页只改写阅读位置，唤醒时按新模式恢复
+                self._hibernated_state = (None, chapter_idx, 0.0)
+                return
+            offset = float(self.verticalScrollBar().value())
+            self._resource_bytes.clear()
+            self.cancel_rescale()
+            self._image_bucket = width_bucket(self.image_max_width())
+            self.scroller.start(chapter_idx, offset=offset)
+            return
+        if self.hibernated:
+            _, chapter_idx, offset = self._hibernated_state
+        else:
+            chapter_idx, offset = self.scroller.position()
+        self.scroller.stop()
+        self.scroller.deleteLater()
+        self.scroller = None
+        path = self.eBook.chapter_path_list[chapter_idx]
+        if self.hibernated:
+            self._hibernated_state = (qtc.QUrl.fromLocalFile(self.eBook.local_path(path)), 0, offset)
+            return
+        title = self.eBook.toc[self.eBook.toc_index_for_chapter(chapter_idx)]
+        self.load_chapter(EBookChapter(title, path))
+        self.verticalScrollBar().setValue(int(offset))
+
+    def is_paged(self):
+        return self.pager is not None
+
+    def set_paged(self, enabled):
+        """切换分页模式：隐藏滚动条，翻页键和滚轮按页翻动"""
+        if enabled == self.is_paged():
+            return
+        if enabled:
+            self.set_continuous(False)
+            self.pager = EBookPager(self)
+            self.setVerticalScrollBarPolicy(qtc.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+            if self.chapter_idx is not None and not self.hibernated:
+                self.pager.on_chapter_loaded()
+            return
+        self.pager.cancel()
+        self.pager.deleteLater()
+        self.pager = None
+        self.setVerticalScrollBarPolicy(qtc.Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        document = self.document()
+        frame_format = document.rootFrame().frameFormat()
+        frame_format.setBottomMargin(document.documentMargin())
+        document.rootFrame().setFrameFormat(frame_format)
+        self.viewport().update()
+
+    def set_reading_mode(self, mode):
+        """chapter 逐章滚动，continuous 整本书连续滚动，paged 分页"""
+        self.set_paged(False)
+        self.set_continuous(mode == "continuous")
+        self.set_paged(mode == "paged")
+
+    def page_label(self) -> str:
+        return self.pager.label() if self.pager is not None else ""
+
+    def chapter_range(self) -> tuple[int, int]:
+        """当前章节在文档中的字符范围，单章模式下为整个文档"""
+        if self.scroller is not None and self.chapter_idx is not None:
+            chapter_range = self.scroller.chapter_range(self.chapter_idx)
+            if chapter_range is not None:
+                return chapter_range
+        return 0, self.document().characterCount()
+
+    def doSetSource(self, name, type=qtg.QTextDocument.ResourceType.UnknownResource):
+        """连续滚动模式下点击书内链接时在滚动面中跳转，而不是替换整个文档；
+        分页模式下按章节加载并对齐到锚点所在的页；逐章模式下点击链接打开另一章时同步当前章节"""
+        if self.scroller is not None and name.isLocalFile():
+            chapter_idx = self.eBook.chapter_index(self.eBook.book_path(name.toLocalFile()))
+            if chapter_idx is not None:
+                self.scroller.jump_to(chapter_idx, name.fragment() or None)
+                return
+        if self.pager is not None and not self._setting_source and name.isLocalFile():
+            path = self.eBook.book_path(name.toLocalFile())
+            chapter_idx = self.eBook.chapter_index(path)
+            if chapter_idx is not None:
+                title = self.eBook.toc[self.eBook.toc_index_for_chapter(chapter_idx)]
+                anchor = f"{path}#{name.fragment()}" if name.fragment() else None
+                self.load_chapter(EBookChapter(title, path, anchor))
+                self.chapter_changed.emit(chapter_idx)
+                return
+        if self._setting_source or not name.isLocalFile():
+            super().doSetSource(name, type)
+            return
+        chapter_idx = self.eBook.chapter_index(self.eBook.book_path(name.toLocalFile()))
+        super().doSetSource(name, type)
+        if chapter_idx is not None and chapter_idx != self.chapter_idx:
+            self.chapter_idx = chapter_idx
+            self._anchor_index = None
+            self.chapter_changed.emit(chapter_idx)
+
+    def built_anchor_index(self) -> EBookAnchorIndex | None:
+        """已经为当前章节建立的锚点索引，还没有建立时返回 None，不会建立索引"""
+        index = self._anchor_index
+        if self.hibernated or index is None or index.chapter_idx != self.chapter_idx:
+            return None
+        return index
+
+    def anchor_index(self) -> EBookAnchorIndex | None:
+        """当前章节的锚点索引，章节变化后第一次使用时重建；章节不在文档中时返回 None"""
+        if self.hibernated or self.chapter_idx is None:
+            return None
+        index = self.built_anchor_index()
+        if index is not None:
+            return index
+        if self.scroller is not None:
+            chapter_range = self.scroller.chapter_range(self.chapter_idx)
+            if chapter_range is None:
+                return None
+        else:
+            chapter_range = 0, self.document().characterCount()
+        with span("chapter.anchor_index", book=self.eBook.book_name,
+                  chapter_idx=self.chapter_idx) as attrs:
+            index = EBookAnchorIndex.build(self.eBook, self.chapter_idx, self.document(), *chapter_range)
+            attrs["anchors"] = len(index)
+            attrs["toc"] = index.toc_count()
+        self._anchor_index = index
+        return index
+
+    def scroll_to_anchor(self, fragment):
+        """把当前章节中的锚点滚动到视口顶部：已建立锚点索引时直接查表，否则由
+        scrollToAnchor 在文档中查找，不为一次跳转建立索引"""
+        if not fragment:
+            return
+        index = self.built_anchor_index()
+        position = index.position(fragment) if index is not None else None
+        if position is None:
+            self.scrollToAnchor(fragment)
+            return
+        start, _ = self.chapter_range()
+        self.verticalScrollBar().setValue(int(self._document_y(start + position)))
+
+    def sync_toc(self) -> bool:
+        """按视口顶部所在的位置更新书籍的当前目录项，改变时返回 True；
+        还没有锚点索引时安排在滚动停下后建立，之后再同步"""
+        index = self.built_anchor_index()
+        if index is None:
+            if not self.hibernated and self.chapter_idx is not None:
+                self._index_timer.start()
+            return False
+        if not index.toc_count():
+            return False
+        start, end = self.chapter_range()
+        top = self.cursorForPosition(qtc.QPoint(self.viewport().width() // 2, 0)).position()
+        top = min(max(top, start), end) - start
+        toc_idx = index.toc_index_at(top)
+        current = self.eBook._now_toc_idx
+        if toc_idx is None or toc_idx == current:
+            return False
+        current_position = index.toc_position(current)
+        if current_position is not None:
+            # 多个目录项指向同一位置时保留当前项
+            if current_position == index.toc_position(toc_idx):
+                return False
+            if current_position > top and self._toc_visible(start + current_position):
+                return False
+        self.eBook._now_toc_idx = toc_idx
+        return True
+
+    def _toc_visible(self, position) -> bool:
+        """视口顶部之后的目录项是否应保留为当前项：分页模式下在当前页中；滚动模式下
+        已滚到底，章节末尾的目录项滚不到视口顶部，跳转到这里时保留跳转的目标"""
+        if self.pager is not None:
+            height = self.pager.visible_height()
+            if height is None:
+                height = self.viewport().height()
+            bottom = self.cursorForPosition(qtc.QPoint(self.viewport().width() // 2, int(height) - 1))
+            return position <= bottom.position()
+        scroll_bar = self.verticalScrollBar()
+        return scroll_bar.value() >= scroll_bar.maximum()
+
+    def _schedule_toc_sync(self):
+        self._toc_timer.start()
+
+    def _on_toc_timer(self):
+        if self.sync_toc():
+            self.toc_changed.emit(self.eBook._now_toc_idx)
+
+    def _on_index_timer(self):
+        if self.anchor_index() is not None:
+            self._on_toc_timer()
+
+    def _set_source(self, url):
+        self._setting_source = True
+        try:
+            self.setSource(url)
+        finally:
+            self._setting_source = False
+
+    def paintEvent(self, event):
+        """QTextDocument 按需布局，加载章节后的首次绘制包含可见部分的布局，记为 chapter.layout"""
+        if self._layout_attrs is None or not get_tracer().enabled:
+            super().paintEvent(event)
+        else:
+            attrs, self._layout_attrs = self._layout_attrs, None
+            with span("chapter.layout", **attrs):
+                super().paintEvent(event)
+        if self.pager is not None:
+            self._paint_page_mask()
+
+    def _paint_page_mask(self):
+        """分页模式下遮住视口中属于下一页的内容"""
+        height = self.pager.visible_height()
+        viewport = self.viewport()
+        if height is None or height >= viewport.height():
+            return
+        painter = qtg.QPainter(viewport)
+        painter.fillRect(0, int(height), viewport.width(), viewport.height() - int(height),
+                         viewport.palette().color(viewport.backgroundRole()))
+
+    def keyPressEvent(self, event):
+        """分页模式下用翻页键、空格和方向键翻页"""
+        if self.pager is not None and not event.modifiers() & ~qtc.Qt.KeyboardModifier.KeypadModifier:
+            key = event.key()
+            if key in (qtc.Qt.Key.Key_PageDown, qtc.Qt.Key.Key_Space, qtc.Qt.Key.Key_Down, qtc.Qt.Key.Key_Right):
+                self.pager.next_page()
+                return
+            if key in (qtc.Qt.Key.Key_PageUp, qtc.Qt.Key.Key_Backspace, qtc.Qt.Key.Key_Up, qtc.Qt.Key.Key_Left):
+                self.pager.prev_page()
+                return
+        super().keyPressEvent(event)
+
+    def wheelEvent(self, event):
+        if self.pager is not None and not event.modifiers() & qtc.Qt.KeyboardModifier.ControlModifier:
+            self.pager.turn_by_wheel(event.angleDelta().y())
+            event.accept()
+            return
+        super().wheelEvent(event)
+
+    def memory_usage(self):
+        """估算本标签页占用的内存（字节）：文档、已加载的图片和预读结果"""
+        if self.hibernated:
+            return 0
+        return (self.document().characterCount() * self.DOCUMENT_BYTES_PER_CHAR
+                + sum(self._resource_bytes.values())
+                + self.prefetcher.memory_usage())
+
+    def _document_y(self, position):
+        """文档中字符位置所在行的顶部 y 坐标"""
+        block = self.document().findBlock(position)
+        y = self.document().documentLayout().blockBoundingRect(block).top()
+        line = block.layout().lineForTextPosition(position - block.position())
+        if line.isValid():
+            y += line.y()
+        return y
+
+    def reading_position(self) -> tuple[int, int, float] | None:
+        """阅读位置 (书脊章节, 视口顶部所在行在章节内的字符位置, 视口顶部相对该行的像素偏移)，
+        还没有加载章节时返回 None"""
+        if self.hibernated:
+            return self._hibernated_reading_position
+        if self.chapter_idx is None:
+            return None
+        # 连续滚动模式下左边缘落在章节框架的边距上，取视口中线处的字符
+        start, end = self.chapter_range()
+        top = self.cursorForPosition(qtc.QPoint(self.viewport().width() // 2, 0)).position()
+        position = min(max(top, start), end)
+        offset = self.verticalScrollBar().value() - self._document_y(position)
+        return self.chapter_idx, position - start, offset
+
+    def restore_position(self, chapter_idx, position, offset=0.0):
+        """回到 reading_position 记录的位置，章节已不存在时不移动"""
+        if not 0 <= chapter_idx < len(self.eBook.chapter_path_list):
+            return
+        if self.scroller is not None:
+            self.scroller.jump_to_position(chapter_idx, position, offset)
+            return
+        if chapter_idx != self.chapter_idx:
+            title = self.eBook.toc[self.eBook.toc_index_for_chapter(chapter_idx)]
+            self.load_chapter(EBookChapter(title, self.eBook.chapter_path_list[chapter_idx]))
+        position = min(position, self.document().characterCount() - 1)
+        self.verticalScrollBar().setValue(int(self._document_y(position) + offset))
+        if self.pager is not None:
+            self.pager.show_position(position)
+
+    def _hibernated_position(self):
+        if self.scroller is not None:
+            chapter_idx, offset = self.scroller.position()
+            return None, chapter_idx, offset
+        position = self.cursorForPosition(qtc.QPoint(0, 0)).position()
+        offset = self.verticalScrollBar().value() - self._document_y(position)
+        return self.source(), position, offset
+
+    def hibernate(self):
+        """释放文档和图片资源，只记录阅读位置"""
+        if self.hibernated:
+            return
+        self._hibernated_state = self._hibernated_position()
+        self._hibernated_reading_position = self.reading_position()
+        if self.scroller is not None:
+            self.scroller.suspend()
+        if self.pager is not None:
+            self.pager.suspend()
+        self.prefetcher.cancel()
+        self.cancel_rescale()
+        self._resource_bytes.clear()
+        self._anchor_index = None
+        self._index_timer.stop()
+        self.document().clear()
+        self.hibernated = True
+
+    def wake_up(self):
+        """重新加载休眠前的章节，并滚动回原来的位置"""
+        if not self.hibernated:
+            return
+        source, position, offset = self._hibernated_state
+        self.hibernated = False
+        self._hibernated_state = None
+        self._image_bucket = width_bucket(self.image_max_width())
+        if source is None:
+            self.scroller.start(position, offset=offset)
+            return
+        self._set_source(source)
+        if self.document().characterCount() <= 1:
+            self.reload()
+        position = min(position, self.document().characterCount() - 1)
+        self.verticalScrollBar().setValue(
+            int(self._document_y(position) + offset))
+        if self.pager is not None:
+            self.pager.on_chapter_loaded()
+        chapter_idx = self.eBook.chapter_index(self.eBook.get_anchor().path)
+        if chapter_idx is not None:
+            self.prefetcher.prefetch_around(
+                chapter_idx, self.image_max_width())
+
+    def highlight_text(self, text):
+        """从当前可见位置开始查找并选中 text，找不到时从章节开头查找"""
+        if not text:
+            return False
+        self.setTextCursor(self.cursorForPosition(qtc.QPoint(0, 0)))
+        found = self.find(text)
+        if not found:
+            self.moveCursor(qtg.QTextCursor.MoveOperation.Start)
+            found = self.find(text)
+        if found and self.pager is not None:
+            self.pager.show_position(self.textCursor().selectionStart())
+        return found
+
+    def set_find_query(self, query):
+        """设置书内查找的查询语句并高亮当前章节中的所有匹配，None 表示清除高亮"""
+        if query == self.find_query:
+            return
+        self.find_query = query
+        self.highlight_matches()
+
+    def highlight_matches(self):
+        selections = []
+        if self.find_query:
+            document = self.document()
+            char_format = qtg.QTextCharFormat()
+            char_format.setBackground(qtg.QColor(255, 235, 59, 160))
+            cursor = document.find(self.find_query)
+            while not cursor.isNull():
+                selection = qtw.QTextEdit.ExtraSelection()
+                selection.cursor = cursor
+                selection.format = char_format
+                selections.append(selection)
+                cursor = document.find(self.find_query, cursor)
+        self.setExtraSelections(selections)
+
+    def select_occurrence(self, text, occurrence):
+        """选中当前章节中 text 的第 occurrence 次出现（从 0 开始），不足时选中最后一次"""
+        document = self.document()
+        start, end = self.chapter_range()
+        found = qtg.QTextCursor()
+        cursor = document.find(text, start)
+        for _ in range(occurrence + 1):
+            if cursor.isNull() or cursor.selectionEnd() > end:
+                break
+            found = cursor
+            cursor = document.find(text, cursor)
+        if found.isNull():
+            return False
+        self.setTextCursor(found)
+        if self.pager is not None:
+            self.pager.show_position(found.selectionStart())
+        else:
+            self.ensureCursorVisible()
+        return True
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.hibernated or self._image_bucket is None:
+            return
+        if self.scroller is not None and event.size().width() != event.oldSize().width():
+            self.scroller.relayout()
+        if self.pager is not None:
+            self.pager.schedule_relayout()
+        if width_bucket(self.image_max_width()) != self._image_bucket:
+            self._rescale_timer.start()  # 拖动窗口边缘时只在停下后缩放一次
+
+    def changeEvent(self, event):
+        if event.type() == qtc.QEvent.Type.FontChange:
+            # QTextEdit 每次字体变化都会重新布局整篇文档，即使字体没有变；
+            # 跳过它的处理，在 _apply_font 中只在字体确实变化时布局一次
+            qtw.QAbstractScrollArea.changeEvent(self, event)
+            self._font_timer.start()
+            return
+        super().changeEvent(event)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._apply_font()
+        self._recolor_links()
+
+    def reader_font(self) -> qtg.QFont:
+        return self._reader_font if self._reader_font is not None else self.font()
+
+    def set_reader_font(self, font: qtg.QFont):
+        """设置阅读字体。样式表中有正文字体，每次套用样式表（包括切换到该标签页时）
+        都会覆盖 setFont 设置的字体，所以单独保存"""
+        self._reader_font = qtg.QFont(font)
+        self._font_timer.start()
+
+    def _apply_font(self):
+        """把阅读字体应用到文档，不可见的标签页推迟到显示时"""
+        font = self.reader_font()
+        if not self.isVisible() or self.document().defaultFont() == font:
+            return
+        self.document().setDefaultFont(font)
+        if self.hibernated:
+            return
+        if self.scroller is not None:
+            self.scroller.relayout()
+        if self.pager is not None:
+            self.pager.schedule_relayout()
+
+    def set_document_theme(self, stylesheet, link_color):
+        """换用主题的文档样式表，之后解析的章节直接使用；已解析的章节不重新解析，
+        只把旧主题写入的链接颜色换成新颜色，不可见的标签页推迟到显示时"""
+        self.document().setDefaultStyleSheet(stylesheet)
+        if self._link_color is not None and link_color != self._link_color:
+            self._stale_link_colors.add(qtg.QColor(self._link_color).rgba())
+        self._link_color = link_color
+        if self.isVisible():
+            self._recolor_links()
+
+    def _recolor_links(self):
+        stale = self._stale_link_colors - {qtg.QColor(self._link_color).rgba()}
+        self._stale_link_colors = set()
+        if not stale or self.hibernated:
+            return  # 休眠时文档已清空，唤醒时按新样式表重新解析
+        document = self.document()
+        # 每种字符格式只检查一次，没有旧颜色的链接时不遍历文档
+        formats = {index for index, text_format in enumerate(document.allFormats())
+                   if text_format.isCharFormat() and text_format.toCharFormat().isAnchor()
+                   and text_format.foreground().style() != qtc.Qt.BrushStyle.NoBrush
+                   and text_format.foreground().color().rgba() in stale}
+        if not formats:
+            return
+        with span("theme.document", book=self.eBook.book_name) as attrs:
+            ranges = []
+            block = document.begin()
+            while block.isValid():
+                it = block.begin()
+                while not it.atEnd():
+                    fragment = it.fragment()
+                    if fragment.charFormatIndex() in formats:
+                        ranges.append((fragment.position(), fragment.position() + fragment.length()))
+                    it += 1
+                block = block.next()
+            attrs["links"] = len(ranges)
+            char_format = qtg.QTextCharFormat()
+            char_format.setForeground(qtg.QColor(self._link_color))
+            cursor = qtg.QTextCursor(document)
+            cursor.beginEditBlock()
+            for start, end in ranges:
+                cursor.setPosition(start)
+                cursor.setPosition(end, qtg.QTextCursor.MoveMode.KeepAnchor)
+                cursor.mergeCharFormat(char_format)
+            cursor.endEditBlock()
+
+    def _image_resources(self) -> dict[str, str]:
+        """文档中引用的图片：资源名 -> 本地路径"""
+        resources = {}
+        base_url = self.source()
+        block = self.document().begin()
+        while block.isValid():
+            it = block.begin()
+            while not it.atEnd():
+                char_format = it.fragment().charFormat()
+                if char_format.isImageFormat():
+                    name = char_format.toImageFormat().name()
+                    resources[name] = base_url.resolved(
+                        qtc.QUrl(name)).toLocalFile()
+                it += 1
+            block = block.next()
+        return resources
+
+    def cancel_rescale(self):
+        self._rescale_timer.stop()
+        if self._rescale_canceled is not None:
+            self._rescale_canceled.set()
+            self._rescale_canceled = None
+
+    def rescale_images(self):
+        """在后台按新的显示宽度重新解码文档中的图片"""
+        self.cancel_rescale()
+        max_width = self.image_max_width()
+        self._image_bucket = width_bucket(max_width)
+        resources = self._image_resources()
+        if not resources:
+            return
+        self._rescale_canceled = threading.Event()
+        task = ImageRescaleTask(self.eBook.fingerprint, resources, max_width,
+                                self.eBook.read_file, self._rescale_canceled)
+        task.signals.finished.connect(self._on_images_rescaled)
+        get_prefetch_pool().start(task, 1)
+
+    def _on_images_rescaled(self, bucket, images: dict[str, qtg.QImage]):
+        if self.hibernated or bucket != self._image_bucket:
+            return  # 缩放期间窗口大小又变了，或标签页已休眠
+        self._rescale_canceled = None
+        position = self.cursorForPosition(qtc.QPoint(0, 0)).position()
+        offset = self.verticalScrollBar().value() - self._document_y(position)
+        document = self.document()
+        for name, image in images.items():
+            # QTextDocument 按相对 baseUrl 解析后的地址查找资源
+            url = document.baseUrl().resolved(qtc.QUrl(name))
+            document.addResource(
+                qtg.QTextDocument.ResourceType.ImageResource, url, image)
+            self._resource_bytes[url.toLocalFile()] = image.sizeInBytes()
+        document.markContentsDirty(0, document.characterCount())
+        self.verticalScrollBar().setValue(
+            int(self._document_y(position) + offset))
 
     def loadResource(self, type, name):
-        """拦截资源加载，动态缩放图片"""
-        resource = super().loadResource(type, name)
-        if type == qtg.QTextDocument.ResourceType.ImageResource and isinstance(resource, qtg.QPixmap):
-            max_width = self.width() * 0.95  # 让图片最大宽度适应 QTextBrowser
-            return resource.scaledToWidth(max_width, qtc.Qt.TransformationMode.SmoothTransformation)
-        return resource
+        """拦截资源加载：章节使用预处理后的 HTML，优先取预读结果，其次是磁盘缓存；
+        归档模式下其他资源直接从 EPUB 中读取，图片按显示宽度解码并放入各标签页共享的缓存"""
+        local_path = name.toLocalFile()
+        if type == qtg.QTextDocument.ResourceType.HtmlResource:
+            prepared = self.prefetcher.get_chapter(local_path)
+            if prepared is not None:
+                return prepared.html
+            chapter = load_simplified_chapter(self.eBook, local_path)
+            if chapter is not None:
+                return chapter.html
+        elif type == qtg.QTextDocument.ResourceType.ImageResource:
+            with span("resource.image", book=self.eBook.book_name, chapter_idx=self.chapter_idx,
+                      image=os.path.basename(local_path)) as attrs:
+                image = get_image_cache().load(self.eBook.fingerprint, local_path,
+                                               self.image_max_width(), self.eBook.read_file)
+                if image is not None:
+                    attrs["bytes"] = image.sizeInBytes()
+            if image is not None:
+                self._resource_bytes[local_path] = image.sizeInBytes()
+                return image
+        data = self.eBook.read_resource(local_path)
+        if data is not None:
+            return qtc.QByteArray(data)
+        return super().loadResource(type, name)
+
+
+class EBookLoadingTab(qtw.QWidget):
+    """书籍尚未加载或正在后台加载时占位的标签页，显示加载进度并可取消
+
+    会话恢复出的标签页在被激活或后台预热之前 task 为 None，只持有 EBookStub。
+    """
+    cancel_requested = qtc.pyqtSignal()
+
+    def __init__(self, stub: EBookStub, parent=None):
+        super().__init__(parent)
+        self.stub = stub
+        self.epub_path = stub.epub_path
+        self.book_name = stub.book_name
+        self.eBook = None
+        self.task = None
+        self.failed = False
+        self.pending_hit = None  # 加载完成后要定位的搜索结果
+        self.setObjectName("loadingTab")
+
+        layout = qtw.QVBoxLayout(self)
+        layout.addStretch()
+        self._label = qtw.QLabel(f"《{self.book_name}》将在切换到此标签页时加载")
+        self._label.setAlignment(qtc.Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(self._label)
+        self._progress_bar = qtw.QProgressBar()
+        self._progress_bar.setRange(0, 100)
+        self._progress_bar.setMaximumWidth(360)
+        layout.addWidget(self._progress_bar, 0,
+                         qtc.Qt.AlignmentFlag.AlignHCenter)
+        self._cancel_button = qtw.QPushButton("取消")
+        self._cancel_button.clicked.connect(self.cancel_requested)
+        layout.addWidget(self._cancel_button, 0,
+                         qtc.Qt.AlignmentFlag.AlignHCenter)
+        layout.addStretch()
+
+    def set_progress(self, percent, text):
+        self._progress_bar.setValue(percent)
+        self._label.setText(f"{text}：《{self.book_name}》")
+
+    def is_started(self):
+        return self.task is not None
+
+    def set_failed(self, message):
+        self.failed = True
+        self._progress_bar.hide()
+        self._cancel_button.hide()
+        self._label.setText(f"无法打开《{self.book_name}》：{message}")
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+class EBookTabPage(qtw.QWidget):
+    """QTabWidget 中的页面，标签页的内容只在页面显示时放在其中
+
+    主窗口的样式表变化时 Qt 会重新套用其中的每个控件，包括不可见的标签页。不显示的
+    内容放在主窗口之外的隐藏控件中，切换主题时只重新套用当前标签页；切换到某个标签页
+    时再把内容放回页面，按当前主题套用一次。
+    """
+
+    def __init__(self, content: qtw.QWidget, parent=None):
+        super().__init__(parent)
+        self.content = content
+        self.setFocusProxy(content)
+
+    def show_content(self):
+        if self.content.parent() is not self:
+            self.content.setParent(self)
+            self.content.setGeometry(self.rect())
+            self.content.show()
+
+    def park_content(self, parking: qtw.QWidget):
+        if self.content.parent() is not parking:
+            self.content.setParent(parking)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.content.parent() is self:
+            self.content.resize(event.size())
 
 
 class EBookTabWidget(qtw.QTabWidget):
+    """书籍标签页。widget、currentWidget、indexOf 等接口使用标签页的内容
+    （EBookChapterDisplay 或 EBookLoadingTab），不涉及包装它们的 EBookTabPage"""
+    tabs_changed = qtc.pyqtSignal()  # 标签页增加、关闭或移动
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setTabsClosable(True)
-        self.setTabBar(EBookTabBar())
+        # 不显示的标签页内容放在这个从不显示的控件中，不受主窗口样式表的影响
+        self._parking = qtw.QWidget()
+        self._shown_page: EBookTabPage | None = None
+        tab_bar = EBookTabBar()
+        # 在 QTabWidget 切换页面之前放回内容，原先的焦点可以移到新页面的内容中
+        tab_bar.currentChanged.connect(self._show_page)
+        self.setTabBar(tab_bar)
+        self.tabBar().tabMoved.connect(self.tabs_changed)
+        self.currentChanged.connect(self._park_hidden_page)
+
+    def _show_page(self, index):
+        page = super().widget(index)
+        if page is not None:
+            page.show_content()
+
+    def _park_hidden_page(self, index):
+        page = super().widget(index)
+        if self._shown_page is not None and self._shown_page is not page:
+            self._shown_page.park_content(self._parking)
+        self._shown_page = page
+
+    def addTab(self, widget, *args) -> int:
+        return super().addTab(self._wrap(widget), *args)
+
+    def insertTab(self, index, widget, *args) -> int:
+        return super().insertTab(index, self._wrap(widget), *args)
+
+    def _wrap(self, widget) -> EBookTabPage:
+        widget.setParent(self._parking)
+        return EBookTabPage(widget)
+
+    def tabInserted(self, index):
+        super().tabInserted(index)
+        self.tabs_changed.emit()
+
+    def tabRemoved(self, index):
+        super().tabRemoved(index)
+        self.tabs_changed.emit()
 
     def add_tab(self, eBook: EBook, eBookChapter: EBookChapter):
         tab = EBookChapterDisplay(eBook)
@@ -95,11 +898,88 @@ class EBookTabWidget(qtw.QTabWidget):
     def close_tab(self, index):
         self.removeTab(index)
 
+    def add_loading_tab(self, stub: EBookStub, activate=True) -> EBookLoadingTab:
+        tab = EBookLoadingTab(stub)
+        self.addTab(tab, stub.current_title())
+        if activate:
+            self.setCurrentWidget(tab)
+        return tab
+
+    def replace_tab(self, old_tab, new_tab, title):
+        """用 new_tab 原位替换 old_tab，保持标签顺序和当前选中状态"""
+        index = self.indexOf(old_tab)
+        was_current = self.currentIndex() == index
+        self.insertTab(index, new_tab, title)
+        self._remove_page(index + 1)
+        if was_current:
+            self.setCurrentIndex(index)
+        old_tab.deleteLater()
+
+    def _remove_page(self, index):
+        page = super().widget(index)
+        if page is self._shown_page:
+            self._shown_page = None
+        super().removeTab(index)
+        if page is not None:
+            page.deleteLater()
+
+    def removeTab(self, index):
+        widget = self.widget(index)
+        self._remove_page(index)
+        if isinstance(widget, EBookLoadingTab):
+            widget.cancel()
+            widget.deleteLater()
+        elif widget is not None:
+            widget.prefetcher.cancel()
+            widget.cancel_rescale()
+            if widget.pager is not None:
+                widget.pager.cancel()
+            widget.eBook.close()  # 释放归档的内存映射
+            widget.deleteLater()
+
     def currentWidget(self) -> EBookChapterDisplay:
-        return super().currentWidget()
+        page = super().currentWidget()
+        return page.content if page is not None else None
 
     def widget(self, index) -> EBookChapterDisplay:
-        return super().widget(index)
+        page = super().widget(index)
+        return page.content if page is not None else None
+
+    def indexOf(self, widget) -> int:
+        for i in range(self.count()):
+            if super().widget(i).content is widget:
+                return i
+        return -1
+
+    def setCurrentWidget(self, widget):
+        self.setCurrentIndex(self.indexOf(widget))
+
+    def find_tab(self, epub_path) -> int:
+        """已打开或正在加载的书籍所在的标签页索引，不存在时返回 -1"""
+        for i in range(self.count()):
+            widget = self.widget(i)
+            path = widget.epub_path if isinstance(
+                widget, EBookLoadingTab) else widget.eBook.epub_path
+            if path == epub_path:
+                return i
+        return -1
 
     def get_opened_books(self):
-        return [self.widget(i).eBook for i in range(self.count())]
+        return [self.widget(i).eBook for i in range(self.count())
+                if isinstance(self.widget(i), EBookChapterDisplay)]
+
+    def get_session_books(self) -> list[EBook | EBookStub]:
+        """需要保存到会话中的书籍，未加载的标签页以 EBookStub 表示"""
+        books = []
+        for i in range(self.count()):
+            widget = self.widget(i)
+            if isinstance(widget, EBookChapterDisplay):
+                books.append(widget.eBook)
+            elif not widget.failed:
+                books.append(widget.stub)
+        return books
+
+    def unstarted_loading_tabs(self) -> list[EBookLoadingTab]:
+        return [self.widget(i) for i in range(self.count())
+                if isinstance(self.widget(i), EBookLoadingTab)
+                and not self.widget(i).is_started()]
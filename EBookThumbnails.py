@@ -0,0 +1,288 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from EBookArchive import EBookArchive
+from EBookCache import cache_path
+from EBookImageCache import decode_scaled
+from EBookParser import OPFPackage
+from commom_import import *
+
+# 缩略图的最大尺寸，按显示尺寸的 THUMBNAIL_SCALE 倍解码，高分屏上也清晰
+THUMBNAIL_WIDTH = 96
+THUMBNAIL_HEIGHT = 144
+THUMBNAIL_SCALE = 2
+THUMBNAIL_QUALITY = 85
+# 持久化缩略图缓存的磁盘预算
+DEFAULT_BUDGET_BYTES = 64 * 1024 ** 2
+# 生成缩略图的进程数
+THUMBNAIL_PROCESSES = max(1, (os.cpu_count() or 2) - 1)
+# 排队等待的最多请求数，快速滚动时先前请求的（已滚出视野的）书籍会被丢弃
+MAX_PENDING = 64
+# 合并请求的间隔（毫秒），同一帧里绘制的书籍一起处理
+FLUSH_INTERVAL_MS = 30
+# 内存中保留的缩略图数
+MEMORY_THUMBNAILS = 1000
+
+
+def make_thumbnail(epub_path) -> bytes:
+    """在子进程中从归档读取封面并按缩略图尺寸解码，没有封面时返回 b""
+
+    不透明的封面保存为 JPEG，带透明通道的保存为 PNG。
+    """
+    with EBookArchive(epub_path) as archive:
+        cover_path = OPFPackage(archive).cover_path
+        if cover_path is None or not archive.exists(cover_path):
+            return b""
+        data = archive.read(cover_path)
+    image = decode_scaled(data, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+    if image.isNull():
+        return b""
+    buffer = qtc.QBuffer()
+    buffer.open(qtc.QIODeviceBase.OpenModeFlag.WriteOnly)
+    if image.hasAlphaChannel():
+        image.save(buffer, "PNG")
+    else:
+        image.save(buffer, "JPEG", THUMBNAIL_QUALITY)
+    return bytes(buffer.data())
+
+
+class EBookThumbnailCache:
+    """持久化的封面缩略图缓存，按书籍指纹保存，超出预算时删除最久未使用的缩略图
+
+    没有封面的书籍保存为空数据，不会反复尝试。
+    """
+
+    def __init__(self, db_path=None, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.db_path = db_path or cache_path("thumbnails.sqlite3")
+        self.budget_bytes = budget_bytes
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS thumbnails (
+                    fingerprint TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails (last_used)")
+            self._total_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM thumbnails").fetchone()[0]
+
+    def get_many(self, fingerprints) -> dict[str, bytes]:
+        fingerprints = list(fingerprints)
+        if not fingerprints:
+            return {}
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"SELECT fingerprint, data FROM thumbnails WHERE fingerprint IN "
+                f"({', '.join('?' * len(fingerprints))})", fingerprints).fetchall()
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE thumbnails SET last_used = ? WHERE fingerprint = ?",
+                [(now, fingerprint) for fingerprint, _ in rows])
+        return dict(rows)
+
+    def put_many(self, thumbnails: dict[str, bytes]):
+        now = time.time()
+        with self._lock, self._conn:
+            for fingerprint, data in thumbnails.items():
+                old = self._conn.execute(
+                    "SELECT LENGTH(data) FROM thumbnails WHERE fingerprint = ?",
+                    (fingerprint,)).fetchone()
+                if old is not None:
+                    self._total_bytes -= old[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?)", (fingerprint, data, now))
+                self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        # 每次多删除一些，避免之后每写入一张缩略图都要淘汰
+        target = self.budget_bytes * 9 // 10
+        if self._total_bytes <= self.budget_bytes:
+            return
+        for fingerprint, size in self._conn.execute(
+                "SELECT fingerprint, LENGTH(data) FROM thumbnails ORDER BY last_used").fetchall():
+            if self._total_bytes <= target:
+                break
+            self._conn.execute("DELETE FROM thumbnails WHERE fingerprint = ?", (fingerprint,))
+            self._total_bytes -= size
+
+    def total_bytes(self):
+        return self._total_bytes
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_thumbnail_cache = None
+_thumbnail_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> EBookThumbnailCache:
+    """进程内共享的缩略图缓存"""
+    global _thumbnail_cache
+    with _thumbnail_cache_lock:
+        if _thumbnail_cache is None:
+            _thumbnail_cache = EBookThumbnailCache()
+        return _thumbnail_cache
+
+
+_thumbnail_pool = None
+
+
+def get_thumbnail_pool() -> qtc.QThreadPool:
+    """加载缩略图专用的线程池，同一时间只运行一个加载任务"""
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        _thumbnail_pool = qtc.QThreadPool()
+        _thumbnail_pool.setMaxThreadCount(1)
+    return _thumbnail_pool
+
+
+class ThumbnailSignals(qtc.QObject):
+    loaded = qtc.pyqtSignal(dict)  # {指纹: 缩略图数据}
+    finished = qtc.pyqtSignal()
+
+
+class ThumbnailTask(qtc.QRunnable):
+    """先从持久化缓存读取缩略图，未命中的在进程池中生成后写入缓存"""
+
+    def __init__(self, requests: dict[str, str], executor, canceled: threading.Event):
+        super().__init__()
+        self.requests = requests  # 指纹 -> 书籍路径
+        self.executor = executor
+        self.canceled = canceled
+        self.signals = ThumbnailSignals()
+
+    def run(self):
+        try:
+            cache = get_thumbnail_cache()
+            cached = cache.get_many(self.requests)
+            if cached:
+                self.signals.loaded.emit(cached)
+            missing = [fingerprint for fingerprint in self.requests if fingerprint not in cached]
+            if missing and not self.canceled.is_set():
+                executor = self.executor()
+                futures = {fingerprint: executor.submit(make_thumbnail, self.requests[fingerprint])
+                           for fingerprint in missing}
+                thumbnails = {}
+                for fingerprint, future in futures.items():
+                    try:
+                        thumbnails[fingerprint] = future.result()
+                    except Exception as e:
+                        logger.warning(f"Failed to make thumbnail for {self.requests[fingerprint]}: {e}")
+                        thumbnails[fingerprint] = b""
+                cache.put_many(thumbnails)
+                self.signals.loaded.emit(thumbnails)
+        except Exception:
+            logger.debug("Thumbnail task failed", exc_info=True)
+        self.signals.finished.emit()
+
+
+class EBookThumbnailLoader(qtc.QObject):
+    """按需加载封面缩略图
+
+    视图只会为可见的条目请求 DecorationRole，因此只有可见的书籍会发出请求。
+    同一帧内的请求合并为一个任务，快速滚动时排队过久的请求被丢弃，
+    它们再次出现在视野中时会重新请求。
+    """
+    loaded = qtc.pyqtSignal(list)  # 加载完成的指纹
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._thumbnails: OrderedDict[str, qtg.QPixmap | None] = OrderedDict()
+        self._pending: OrderedDict[str, str] = OrderedDict()
+        self._in_flight: set[str] = set()
+        self._task = None
+        self._canceled = threading.Event()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._flush_timer = qtc.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(FLUSH_INTERVAL_MS)
+        self._flush_timer.timeout.connect(self._flush)
+
+    def contains(self, fingerprint):
+        return fingerprint in self._thumbnails
+
+    def thumbnail(self, fingerprint) -> qtg.QPixmap | None:
+        """已加载的缩略图，没有封面时返回 None"""
+        self._thumbnails.move_to_end(fingerprint)
+        return self._thumbnails[fingerprint]
+
+    def request(self, fingerprint, epub_path):
+        if fingerprint in self._in_flight:
+            return
+        self._pending[fingerprint] = epub_path
+        self._pending.move_to_end(fingerprint)
+        while len(self._pending) > MAX_PENDING:
+            self._pending.popitem(last=False)
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # 启动时用不到进程池，在这里才导入
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn 启动的子进程不会继承 Qt 的线程状态
+                context = multiprocessing.get_context("spawn")
+                self._executor = ProcessPoolExecutor(THUMBNAIL_PROCESSES, mp_context=context)
+            return self._executor
+
+    def _flush(self):
+        if self._task is not None or not self._pending or self._canceled.is_set():
+            return
+        requests = dict(self._pending)
+        self._pending.clear()
+        self._in_flight.update(requests)
+        self._task = ThumbnailTask(requests, self._get_executor, self._canceled)
+        self._task.signals.loaded.connect(self._on_loaded)
+        self._task.signals.finished.connect(self._on_finished)
+        get_thumbnail_pool().start(self._task)
+
+    def _on_loaded(self, thumbnails: dict):
+        for fingerprint, data in thumbnails.items():
+            image = qtg.QImage.fromData(data) if data else qtg.QImage()
+            if image.isNull():
+                self._thumbnails[fingerprint] = None
+            else:
+                pixmap = qtg.QPixmap.fromImage(image)
+                pixmap.setDevicePixelRatio(THUMBNAIL_SCALE)
+                self._thumbnails[fingerprint] = pixmap
+            self._thumbnails.move_to_end(fingerprint)
+            self._in_flight.discard(fingerprint)
+        while len(self._thumbnails) > MEMORY_THUMBNAILS:
+            self._thumbnails.popitem(last=False)
+        self.loaded.emit(list(thumbnails))
+
+    def _on_finished(self):
+        self._task = None
+        self._in_flight.clear()
+        self._flush()
+
+    def cancel(self):
+        self._canceled.set()
+        self._pending.clear()
+        self._flush_timer.stop()
+
+    def close(self):
+        """结束生成缩略图的进程，调用前应先 cancel 并等待线程池空闲"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+__all__ = ["EBookThumbnailCache", "EBookThumbnailLoader", "THUMBNAIL_HEIGHT", "THUMBNAIL_SCALE", "THUMBNAIL_WIDTH",
+           "get_thumbnail_cache", "get_thumbnail_pool", "make_thumbnail"]
@@ -1,7 +1,339 @@
+import os
+import threading
+import time
+
+from EBookLibrary import SCAN_BATCH, get_library_catalog, read_books
+from EBookThumbnails import (THUMBNAIL_HEIGHT, THUMBNAIL_SCALE, THUMBNAIL_WIDTH, EBookThumbnailLoader,
+                             get_thumbnail_pool)
 from commom_import import *
 
+# 扫描书库的进程数
+SCAN_PROCESSES = max(1, (os.cpu_count() or 2) - 1)
+# 文件夹内容变化后等待多久再重新扫描（毫秒），连续的变化只扫描一次
+RESCAN_DELAY_MS = 1000
+
+_library_pool = None
+
+
+def get_library_pool() -> qtc.QThreadPool:
+    """扫描书库专用的线程池，同一时间只运行一个扫描任务"""
+    global _library_pool
+    if _library_pool is None:
+        _library_pool = qtc.QThreadPool()
+        _library_pool.setMaxThreadCount(1)
+    return _library_pool
+
+
+class LibraryScanSignals(qtc.QObject):
+    updated = qtc.pyqtSignal(list)  # 新增或更新的书籍
+    removed = qtc.pyqtSignal(list)  # 已不存在的书籍路径
+    progress = qtc.pyqtSignal(int, int)  # 已读取, 需要读取的书籍数
+    finished = qtc.pyqtSignal(int, list)  # 读取的书籍数, 书库中的所有文件夹
+
+
+class LibraryScanTask(qtc.QRunnable):
+    """遍历书库文件夹，在进程池中读取新增或修改过的书籍的元数据并写入书目"""
+
+    def __init__(self):
+        super().__init__()
+        self.signals = LibraryScanSignals()
+        self._canceled = threading.Event()
+
+    def cancel(self):
+        self._canceled.set()
+
+    def run(self):
+        catalog = get_library_catalog()
+        start = time.perf_counter()
+        directories = []
+        stale, removed = catalog.plan_scan(directories)
+        if removed:
+            catalog.remove_books(removed)
+            self.signals.removed.emit(removed)
+        scanned = 0
+        batches = [stale[i:i + SCAN_BATCH] for i in range(0, len(stale), SCAN_BATCH)]
+        if len(batches) == 1:
+            # 只有一批时直接在当前线程读取，省去启动子进程的开销
+            scanned = self._store(catalog, read_books(batches[0]), scanned, len(stale))
+        elif batches:
+            # spawn 启动的子进程不会继承 Qt 的线程状态
+            # 启动时用不到进程池，在这里才导入
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(min(SCAN_PROCESSES, len(batches)), mp_context=context) as pool:
+                futures = [pool.submit(read_books, batch) for batch in batches]
+                for future in as_completed(futures):
+                    if self._canceled.is_set():
+                        pool.shutdown(cancel_futures=True)
+                        break
+                    try:
+                        scanned = self._store(catalog, future.result(), scanned, len(stale))
+                    except Exception as e:
+                        logger.warning(f"Failed to scan library batch: {e}")
+        logger.info(f"Scanned {scanned}/{len(stale)} books, removed {len(removed)} "
+                    f"in {time.perf_counter() - start:.1f}s")
+        self.signals.finished.emit(scanned, directories)
+
+    def _store(self, catalog, books, scanned, total):
+        catalog.put_books(books)
+        scanned += len(books)
+        self.signals.updated.emit(books)
+        self.signals.progress.emit(scanned, total)
+        return scanned
+
+
+class EBookLibraryScanner(qtc.QObject):
+    """合并扫描请求，并监视书库文件夹，文件夹内容变化后自动增量扫描
+
+    QFileSystemWatcher 不会递归监视，扫描结束后把遍历到的所有子文件夹都加入监视。
+    """
+    updated = qtc.pyqtSignal(list)
+    removed = qtc.pyqtSignal(list)
+    progress = qtc.pyqtSignal(int, int)
+    finished = qtc.pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._task = None
+        self._pending = False
+        self._watcher = qtc.QFileSystemWatcher(self)
+        self._rescan_timer = qtc.QTimer(self)
+        self._rescan_timer.setSingleShot(True)
+        self._rescan_timer.setInterval(RESCAN_DELAY_MS)
+        self._rescan_timer.timeout.connect(self.rescan)
+        self._watcher.directoryChanged.connect(self._rescan_timer.start)
+
+    def is_running(self):
+        return self._task is not None
+
+    def add_folder(self, path):
+        get_library_catalog().add_folder(path)
+        self.rescan()
+
+    def remove_folder(self, path):
+        get_library_catalog().remove_folder(path)
+        self.rescan()
+
+    def rescan(self):
+        """增量扫描书库，正在扫描时在本次扫描结束后再扫描一次"""
+        self._rescan_timer.stop()
+        if self._task is not None:
+            self._pending = True
+            return
+        self._pending = False
+        self._task = LibraryScanTask()
+        self._task.signals.updated.connect(self.updated)
+        self._task.signals.removed.connect(self.removed)
+        self._task.signals.progress.connect(self.progress)
+        self._task.signals.finished.connect(self._on_finished)
+        get_library_pool().start(self._task)
+
+    def _on_finished(self, scanned, directories):
+        self._task = None
+        watched = set(self._watcher.directories())
+        current = set(directories)
+        if watched - current:
+            self._watcher.removePaths(list(watched - current))
+        if current - watched:
+            self._watcher.addPaths(list(current - watched))
+        self.finished.emit(scanned)
+        if self._pending:
+            self.rescan()
+
+    def cancel(self):
+        self._pending = False
+        self._rescan_timer.stop()
+        if self._task is not None:
+            self._task.cancel()
+
+
+class EBookLibraryModel(qtc.QAbstractListModel):
+    """书目列表模型，扫描结果按批更新，已有的书籍原地刷新
+
+    封面缩略图在视图绘制条目时才请求，加载完成后刷新对应的行。
+    """
+    PathRole = qtc.Qt.ItemDataRole.UserRole
+
+    def __init__(self, thumbnails: EBookThumbnailLoader, parent=None):
+        super().__init__(parent)
+        self._books: list[dict] = []
+        self._rows: dict[str, int] = {}
+        self.thumbnails = thumbnails
+        self.thumbnails.loaded.connect(self._on_thumbnails_loaded)
+        self._placeholder = qtg.QPixmap(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+        self._placeholder.fill(qtg.QColor(128, 128, 128, 40))
+        self._placeholder.setDevicePixelRatio(THUMBNAIL_SCALE)
+
+    def reset(self, books: list[dict]):
+        self.beginResetModel()
+        self._books = list(books)
+        self._rows = {book["epub_path"]: row for row, book in enumerate(self._books)}
+        self.endResetModel()
+
+    def upsert(self, books: list[dict]):
+        new_books = []
+        for book in books:
+            row = self._rows.get(book["epub_path"])
+            if row is None:
+                new_books.append(book)
+                continue
+            self._books[row] = book
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+        if new_books:
+            first = len(self._books)
+            self.beginInsertRows(qtc.QModelIndex(), first, first + len(new_books) - 1)
+            for row, book in enumerate(new_books, first):
+                self._books.append(book)
+                self._rows[book["epub_path"]] = row
+            self.endInsertRows()
+
+    def remove(self, paths):
+        paths = set(paths)
+        self.reset([book for book in self._books if book["epub_path"] not in paths])
+
+    def rowCount(self, parent=qtc.QModelIndex()):
+        return 0 if parent.isValid() else len(self._books)
+
+    def _on_thumbnails_loaded(self, fingerprints):
+        fingerprints = set(fingerprints)
+        for row, book in enumerate(self._books):
+            if book["fingerprint"] in fingerprints:
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [qtc.Qt.ItemDataRole.DecorationRole])
+
+    def _decoration(self, book):
+        fingerprint = book["fingerprint"]
+        if fingerprint is None:
+            return self._placeholder
+        if not self.thumbnails.contains(fingerprint):
+            self.thumbnails.request(fingerprint, book["epub_path"])
+            return self._placeholder
+        return self.thumbnails.thumbnail(fingerprint) or self._placeholder
+
+    def data(self, index: qtc.QModelIndex, role=qtc.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        book = self._books[index.row()]
+        if role == qtc.Qt.ItemDataRole.DisplayRole:
+            details = [book["author"] or "佚名"]
+            if book["series"]:
+                series = book["series"]
+                if book["series_index"]:
+                    series += f" #{book['series_index']}"
+                details.append(series)
+            return f"{book['title']}\n{' · '.join(details)}"
+        if role == qtc.Qt.ItemDataRole.DecorationRole:
+            return self._decoration(book)
+        if role == qtc.Qt.ItemDataRole.ToolTipRole:
+            tooltip = book["epub_path"]
+            if book["language"]:
+                tooltip += f"\n语言：{book['language']}"
+            if book["error"]:
+                tooltip += f"\n无法解析：{book['error']}"
+            return tooltip
+        if role == self.PathRole:
+            return book["epub_path"]
+        return None
+
 
 class EBookTocDocker(qtw.QDockWidget):
+    """图书馆面板：书库文件夹中的书籍列表，双击打开"""
+    book_activated = qtc.pyqtSignal(str)
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("图书馆")
+        self.setObjectName("libraryDocker")
+        self.setFeatures(qtw.QDockWidget.DockWidgetFeature.NoDockWidgetFeatures)
+
+        container = qtw.QWidget()
+        layout = qtw.QVBoxLayout(container)
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.setSpacing(2)
+
+        header_layout = qtw.QHBoxLayout()
+        self._filter_edit = qtw.QLineEdit()
+        self._filter_edit.setPlaceholderText("筛选书名、作者、丛书")
+        self._filter_edit.setClearButtonEnabled(True)
+        header_layout.addWidget(self._filter_edit, 1)
+        folder_button = qtw.QToolButton()
+        folder_button.setText("文件夹")
+        folder_button.setPopupMode(qtw.QToolButton.ToolButtonPopupMode.InstantPopup)
+        self._folder_menu = qtw.QMenu(folder_button)
+        self._folder_menu.aboutToShow.connect(self._update_folder_menu)
+        folder_button.setMenu(self._folder_menu)
+        header_layout.addWidget(folder_button)
+        layout.addLayout(header_layout)
+
+        self.thumbnails = EBookThumbnailLoader(self)
+        self.model = EBookLibraryModel(self.thumbnails, self)
+        self._proxy = qtc.QSortFilterProxyModel(self)
+        self._proxy.setSourceModel(self.model)
+        self._proxy.setFilterCaseSensitivity(qtc.Qt.CaseSensitivity.CaseInsensitive)
+        self._proxy.setSortCaseSensitivity(qtc.Qt.CaseSensitivity.CaseInsensitive)
+        self._proxy.sort(0)
+        self._filter_edit.textChanged.connect(self._proxy.setFilterFixedString)
+
+        self._book_list = qtw.QListView()
+        self._book_list.setObjectName("libraryList")
+        self._book_list.setModel(self._proxy)
+        self._book_list.setUniformItemSizes(True)
+        self._book_list.setIconSize(qtc.QSize(
+            THUMBNAIL_WIDTH // THUMBNAIL_SCALE, THUMBNAIL_HEIGHT // THUMBNAIL_SCALE))
+        self._book_list.setEditTriggers(qtw.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self._book_list.activated.connect(self._on_activated)
+        layout.addWidget(self._book_list)
+
+        self._status_label = qtw.QLabel()
+        self._status_label.setObjectName("libraryStatusLabel")
+        layout.addWidget(self._status_label)
+        self.setWidget(container)
+
+        self.scanner = EBookLibraryScanner(self)
+        self.scanner.updated.connect(self.model.upsert)
+        self.scanner.removed.connect(self.model.remove)
+        self.scanner.progress.connect(self._on_progress)
+        self.scanner.finished.connect(self._on_finished)
+
+        # 先显示上次的书目，再在后台增量扫描
+        self.model.reset(get_library_catalog().books())
+        self._update_status()
+        qtc.QTimer.singleShot(0, self.scanner.rescan)
+
+    def shutdown(self):
+        """取消扫描和缩略图加载，等待后台任务结束"""
+        self.scanner.cancel()
+        self.thumbnails.cancel()
+        get_library_pool().waitForDone()
+        get_thumbnail_pool().waitForDone()
+        self.thumbnails.close()
+
+    def add_folder(self):
+        folder = qtw.QFileDialog.getExistingDirectory(self, "添加书库文件夹")
+        if folder:
+            self.scanner.add_folder(folder)
+
+    def _update_folder_menu(self):
+        self._folder_menu.clear()
+        self._folder_menu.addAction("添加文件夹…", self.add_folder)
+        self._folder_menu.addAction("重新扫描", self.scanner.rescan)
+        folders = get_library_catalog().folders()
+        if folders:
+            self._folder_menu.addSeparator()
+        for folder in folders:
+            self._folder_menu.addAction(
+                f"移除 {folder}", lambda folder=folder: self.scanner.remove_folder(folder))
+
+    def _on_activated(self, index: qtc.QModelIndex):
+        self.book_activated.emit(index.data(EBookLibraryModel.PathRole))
+
+    def _on_progress(self, done, total):
+        self._status_label.setText(f"正在扫描书库：{done}/{total}")
+
+    def _on_finished(self, scanned):
+        self._update_status()
+
+    def _update_status(self):
+        self._status_label.setText(f"共 {self.model.rowCount()} 本书")
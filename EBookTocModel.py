@@ -0,0 +1,112 @@
+from Ebook import EBook
+from commom_import import *
+
+
+class EBookTocModel(qtc.QAbstractItemModel):
+    """单本书的目录树模型，每个 EBook 只创建一次，切换标签页时直接换到视图上
+
+    节点的 internalId 为目录下标 + 1，0 表示根节点。父子关系在构造时按
+    目录层级一次算出，视图只会为展开且可见的节点请求数据。
+    """
+
+    def __init__(self, eBook: EBook, parent=None):
+        super().__init__(parent)
+        self._titles = eBook.toc
+        count = len(self._titles)
+        self._parent = [-1] * count  # 父节点的目录下标，-1 为根节点
+        self._row = [0] * count  # 在父节点下的行号
+        self._children = {-1: []}
+        stack = []  # (层级, 目录下标)
+        for toc_idx, level in enumerate(eBook.toc_levels):
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            parent_idx = stack[-1][1] if stack else -1
+            siblings = self._children.setdefault(parent_idx, [])
+            self._parent[toc_idx] = parent_idx
+            self._row[toc_idx] = len(siblings)
+            siblings.append(toc_idx)
+            stack.append((level, toc_idx))
+
+    def _toc_idx(self, index: qtc.QModelIndex):
+        return index.internalId() - 1 if index.isValid() else -1
+
+    def index(self, row, column, parent=qtc.QModelIndex()):
+        children = self._children.get(self._toc_idx(parent), ())
+        if column != 0 or not 0 <= row < len(children):
+            return qtc.QModelIndex()
+        return self.createIndex(row, 0, children[row] + 1)
+
+    def parent(self, index):
+        if not index.isValid():
+            return qtc.QModelIndex()
+        parent_idx = self._parent[self._toc_idx(index)]
+        if parent_idx == -1:
+            return qtc.QModelIndex()
+        return self.createIndex(self._row[parent_idx], 0, parent_idx + 1)
+
+    def rowCount(self, parent=qtc.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self._children.get(self._toc_idx(parent), ()))
+
+    def columnCount(self, parent=qtc.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=qtc.QModelIndex()):
+        return self._toc_idx(parent) in self._children
+
+    def data(self, index, role=qtc.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (qtc.Qt.ItemDataRole.DisplayRole, qtc.Qt.ItemDataRole.ToolTipRole):
+            return self._titles[self._toc_idx(index)]
+        return None
+
+    def index_for_toc(self, toc_idx) -> qtc.QModelIndex:
+        """目录下标对应的模型索引"""
+        return self.createIndex(self._row[toc_idx], 0, toc_idx + 1)
+
+    def toc_index(self, index: qtc.QModelIndex) -> int:
+        """模型索引对应的目录下标"""
+        return self._toc_idx(index)
+
+
+class EBookTocView(qtw.QTreeView):
+    """目录视图，行高统一，只对可见行进行布局"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setHeaderHidden(True)
+        self.setUniformRowHeights(True)
+        self.setEditTriggers(qtw.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setSelectionMode(
+            qtw.QAbstractItemView.SelectionMode.SingleSelection)
+
+    def model(self) -> EBookTocModel | None:
+        return super().model()
+
+    def setModel(self, model: EBookTocModel | None):
+        """切换模型时视图和表头都会新建选择模型，旧的仍以它们为父对象而不会释放，
+        这里只保留正在使用的选择模型"""
+        super().setModel(model)
+        for owner in (self, self.header()):
+            current = owner.selectionModel()
+            for selection_model in owner.findChildren(
+                    qtc.QItemSelectionModel, options=qtc.Qt.FindChildOption.FindDirectChildrenOnly):
+                if selection_model is not current:
+                    selection_model.deleteLater()
+
+    def clear(self):
+        self.setModel(None)
+
+    def set_current_toc(self, toc_idx):
+        """选中目录项，必要时展开其父节点并滚动到可见位置"""
+        model = self.model()
+        if model is None:
+            return
+        index = model.index_for_toc(toc_idx)
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
+
+    def toc_index(self, index: qtc.QModelIndex) -> int:
+        return self.model().toc_index(index)
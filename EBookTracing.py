@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from commom_import import *
+
+# 内存中保留的最近 span 数，超出后丢弃最早的
+MAX_SPANS = 20000
+# 性能面板的刷新间隔（毫秒）
+PANEL_INTERVAL_MS = 1000
+# 性能面板上显示的 span 及其简称
+PANEL_SPANS = (
+    ("book.open", "打开"),
+    ("chapter.load", "章节"),
+    ("resource.image", "图片"),
+    ("tab.switch", "切换"),
+    ("theme.switch", "主题"),
+    ("theme.document", "正文主题"),
+)
+
+
+class Span:
+    """一次计时：名称、开始时间、耗时（纳秒）、所在线程和属性（书名、章节等）"""
+    __slots__ = ("name", "start_ns", "duration_ns", "thread_id", "thread_name", "attrs")
+
+    def __init__(self, name, start_ns, duration_ns, thread_id, thread_name, attrs):
+        self.name = name
+        self.start_ns = start_ns
+        self.duration_ns = duration_ns
+        self.thread_id = thread_id
+        self.thread_name = thread_name
+        self.attrs = attrs
+
+
+class SpanStats:
+    """同名 span 的耗时统计（毫秒）"""
+
+    def __init__(self, name, durations_ms: list[float]):
+        durations_ms = sorted(durations_ms)
+        self.name = name
+        self.count = len(durations_ms)
+        self.total = sum(durations_ms)
+        self.p50 = percentile(durations_ms, 50)
+        self.p95 = percentile(durations_ms, 95)
+        self.max = durations_ms[-1] if durations_ms else 0.0
+        self.durations = durations_ms
+
+    def histogram(self, bounds=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)) -> list[tuple[str, int]]:
+        """按毫秒分桶的直方图 [(区间, 次数)]"""
+        counts = [0] * (len(bounds) + 1)
+        index = 0
+        for duration in self.durations:
+            while index < len(bounds) and duration >= bounds[index]:
+                index += 1
+            counts[index] += 1
+        labels = [f"<{bounds[0]}ms"]
+        labels += [f"{low}-{high}ms" for low, high in zip(bounds, bounds[1:])]
+        labels.append(f">={bounds[-1]}ms")
+        return list(zip(labels, counts))
+
+
+def percentile(sorted_values, p):
+    """已排序数据的百分位数（最近秩法），没有数据时返回 0"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class _SpanContext:
+    __slots__ = ("_tracer", "_name", "_attrs", "_start")
+
+    def __init__(self, tracer, name, attrs):
+        self._tracer = tracer
+        self._name = name
+        self._attrs = attrs
+        self._start = 0
+
+    def __enter__(self) -> dict:
+        self._start = time.perf_counter_ns()
+        return self._attrs
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter_ns() - self._start
+        if exc_type is not None:
+            self._attrs["error"] = exc_type.__name__
+        self._tracer.record(self._name, self._start, duration, self._attrs)
+        return False
+
+
+class _NullContext:
+    """关闭追踪时使用，不计时也不记录"""
+    __slots__ = ("_attrs",)
+
+    def __init__(self, attrs):
+        self._attrs = attrs
+
+    def __enter__(self) -> dict:
+        return self._attrs
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class EBookTracer:
+    """线程安全的 span 记录器
+
+    span 保存在固定容量的环形缓冲中，可以导出为 Chrome trace-event JSON
+    （在 chrome://tracing 或 Perfetto 中打开），或按名称汇总出 p50/p95。
+    """
+
+    def __init__(self, capacity=MAX_SPANS, enabled=True):
+        self.enabled = enabled
+        self._spans: deque[Span] = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        # 导出时间戳相对于记录器创建的时间
+        self._origin_ns = time.perf_counter_ns()
+
+    def span(self, name, **attrs):
+        """计时的上下文管理器，as 得到属性字典，可在块内补充属性"""
+        if not self.enabled:
+            return _NullContext(attrs)
+        return _SpanContext(self, name, attrs)
+
+    def record(self, name, start_ns, duration_ns, attrs=None):
+        thread = threading.current_thread()
+        span = Span(name, start_ns, duration_ns, thread.ident, thread.name, attrs or {})
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self, name=None) -> list[Span]:
+        with self._lock:
+            spans = list(self._spans)
+        if name is not None:
+            spans = [span for span in spans if span.name == name]
+        return spans
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def stats(self) -> dict[str, SpanStats]:
+        """按名称汇总的耗时统计"""
+        durations: dict[str, list[float]] = {}
+        for span in self.spans():
+            durations.setdefault(span.name, []).append(span.duration_ns / 1e6)
+        return {name: SpanStats(name, values) for name, values in sorted(durations.items())}
+
+    def format_stats(self) -> str:
+        lines = [f"{'span':<24}{'次数':>6}{'p50':>10}{'p95':>10}{'最大':>10}"]
+        for stats in self.stats().values():
+            lines.append(f"{stats.name:<24}{stats.count:>6}{stats.p50:>9.1f}ms"
+                         f"{stats.p95:>8.1f}ms{stats.max:>8.1f}ms")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """Chrome trace-event 格式的追踪数据，每个 span 为一个完整事件（ph = "X"）"""
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in self.spans():
+            threads.setdefault(span.thread_id, span.thread_name)
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".", 1)[0],
+                "ph": "X",
+                "ts": (span.start_ns - self._origin_ns) / 1000,
+                "dur": span.duration_ns / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {key: _json_value(value) for key, value in span.attrs.items()},
+            })
+        for thread_id, thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+                           "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+        logger.info(f"Trace exported to {path}")
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> EBookTracer:
+    """进程内共享的 span 记录器，环境变量 QEPUBER_TRACE=0 时关闭"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = EBookTracer(enabled=os.environ.get("QEPUBER_TRACE", "1") != "0")
+        return _tracer
+
+
+def span(name, **attrs):
+    """在共享记录器上计时，用法：with span("chapter.load", book=...) as attrs: ..."""
+    return get_tracer().span(name, **attrs)
+
+
+class EBookTracePanel(qtw.QLabel):
+    """状态栏上的性能面板，定时显示主要操作的 p50/p95，悬停时显示完整统计"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("tracePanel")
+        self._timer = qtc.QTimer(self)
+        self._timer.setInterval(PANEL_INTERVAL_MS)
+        self._timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self._timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self._timer.stop()
+
+    def refresh(self):
+        tracer = get_tracer()
+        stats = tracer.stats()
+        parts = []
+        for name, label in PANEL_SPANS:
+            if name in stats:
+                parts.append(f"{label} {stats[name].p50:.0f}/{stats[name].p95:.0f}ms")
+        self.setText("  ".join(parts) if parts else "暂无性能数据")
+        self.setToolTip("p50/p95 耗时\n" + tracer.format_stats())
+
+
+__all__ = ["EBookTracePanel", "EBookTracer", "MAX_SPANS", "Span", "SpanStats", "get_tracer", "percentile",
+           "span"]
@@ -1,6 +1,13 @@
 import os
 
-from EBookParser import load_epub, parse_toc
+from EBookArchive import EBookArchive, as_book_root
+from EBookCache import book_fingerprint
+from EBookIndex import get_book_index
+from EBookParser import OPFPackage, map_toc_to_spine, open_epub, parse_toc_tree
+from EBookTracing import span
+
+# 打开书籍的各个阶段，依次为解压/打开归档、解析书脊、解析目录
+LOAD_STAGES = ("extract", "spine", "toc")
 
 
 class EBookChapter:
@@ -18,18 +25,89 @@ class EBookChapter:
         return anchor_split[1]
 
 
+class EBookStub:
+    """会话恢复时尚未加载的书籍，只保存路径、当前章节标题和目录位置"""
+
+    def __init__(self, epub_path, now_toc_idx=0, title=None):
+        self.epub_path = epub_path
+        self.book_name = os.path.splitext(os.path.basename(epub_path))[0]
+        self._now_toc_idx = now_toc_idx
+        self.title = title or self.book_name
+
+    def current_title(self):
+        return self.title
+
+
 class EBook:
-    def __init__(self, epub_path, now_toc_idx=0):
+    def __init__(self, epub_path, now_toc_idx=0, progress=None):
+        """progress(stage) 在 LOAD_STAGES 的每个阶段开始前调用，可抛出异常以取消加载"""
         self.epub_path = epub_path
         self.book_name = os.path.splitext(os.path.basename(epub_path))[0]
-        self.cache_folder, self.chapter_path_list = load_epub(epub_path)
+        # 归档内的路径挂在 EPUB 文件路径之下，作为 QTextBrowser 的虚拟本地路径
+        self._archive_prefix = os.path.abspath(
+            epub_path).replace(os.sep, "/") + "/"
         self._now_toc_idx = now_toc_idx
-        self.toc, self.anchor = zip(*parse_toc(self.cache_folder))
-        self.archor_idx_to_chapter_idx = []
-        for i in range(len(self.anchor)):
-            chapter_idx = self.chapter_path_list.index(
-                self.anchor[i].split("#")[0])
-            self.archor_idx_to_chapter_idx.append(chapter_idx)
+        self._chapter_index = None
+        self._chapter_tocs = None
+        report = progress or (lambda stage: None)
+
+        with span("book.open", book=self.book_name) as attrs:
+            report("extract")
+            with span("book.extract", book=self.book_name):
+                self.fingerprint = book_fingerprint(epub_path)
+                # 归档模式下 book_root 为 EBookArchive，否则为解压后的缓存目录
+                self.book_root = as_book_root(open_epub(epub_path))
+            self.is_archive = isinstance(self.book_root, EBookArchive)
+            try:
+                indexed = get_book_index().get(self.fingerprint)
+                attrs["indexed"] = indexed is not None
+                if indexed is not None:
+                    self._load_index(indexed)
+                else:
+                    self._parse(report)
+                    get_book_index().put(
+                        self.fingerprint, epub_path, self._dump_index())
+            except BaseException:
+                self.book_root.close()
+                raise
+            attrs["chapters"] = len(self.chapter_path_list)
+
+    def _parse(self, report):
+        report("spine")
+        with span("book.opf", book=self.book_name):
+            package = OPFPackage(self.book_root)
+            self.chapter_path_list = package.spine
+            self.metadata = package.metadata
+        report("toc")
+        with span("book.toc", book=self.book_name) as attrs:
+            entries = map_toc_to_spine(
+                parse_toc_tree(self.book_root, package), package)
+            self.toc, self.anchor, chapter_indexes, self.toc_levels = zip(*entries)
+            self.archor_idx_to_chapter_idx = list(chapter_indexes)
+            attrs["entries"] = len(self.toc)
+
+    def _dump_index(self) -> dict:
+        """持久化索引中保存的内容，路径均相对书籍根目录"""
+        relpath = self.book_root.relpath
+        return {
+            "spine": [relpath(path) for path in self.chapter_path_list],
+            "toc": list(self.toc),
+            "anchors": [relpath(anchor) for anchor in self.anchor],
+            "anchor_to_chapter": self.archor_idx_to_chapter_idx,
+            "toc_levels": list(self.toc_levels),
+            "metadata": self.metadata,
+        }
+
+    def _load_index(self, indexed: dict):
+        root = self.book_root
+        self.chapter_path_list = [root.join(root.root, path)
+                                  for path in indexed["spine"]]
+        self.toc = tuple(indexed["toc"])
+        self.anchor = tuple(root.join(root.root, anchor)
+                            for anchor in indexed["anchors"])
+        self.archor_idx_to_chapter_idx = indexed["anchor_to_chapter"]
+        self.toc_levels = tuple(indexed["toc_levels"])
+        self.metadata = indexed["metadata"]
 
     def next_anchor(self):
         """get next anchor in toc"""
@@ -54,9 +132,82 @@ class EBook:
             anchor=self.anchor[toc_index]
         )
 
+    def toc_index_for_chapter(self, chapter_idx) -> int:
+        """指向该书脊章节的第一个目录项，没有时返回之前最近的目录项"""
+        best = 0
+        for toc_idx, idx in enumerate(self.archor_idx_to_chapter_idx):
+            if idx == chapter_idx:
+                return toc_idx
+            if idx < chapter_idx:
+                best = toc_idx
+        return best
+
+    def toc_indexes_for_chapter(self, chapter_idx) -> list[int]:
+        """指向该书脊章节的所有目录项，按目录顺序"""
+        if self._chapter_tocs is None:
+            self._chapter_tocs = {}
+            for toc_idx, idx in enumerate(self.archor_idx_to_chapter_idx):
+                self._chapter_tocs.setdefault(idx, []).append(toc_idx)
+        return self._chapter_tocs.get(chapter_idx, [])
+
     def get_anchor_count(self):
         return len(self.toc)
 
+    def current_title(self):
+        return self.toc[self._now_toc_idx]
+
+    def local_path(self, path):
+        """章节/资源路径对应的本地路径，归档模式下为虚拟路径"""
+        if self.is_archive:
+            return self._archive_prefix + path
+        return path
+
+    def book_path(self, local_path):
+        """local_path 的逆运算：本地路径（归档模式下为虚拟路径）对应的章节/资源路径"""
+        if self.is_archive and local_path.startswith(self._archive_prefix):
+            return local_path[len(self._archive_prefix):]
+        return local_path
+
+    def chapter_size(self, chapter_idx) -> int:
+        """书脊章节文件的字节数，归档模式下直接取自中央目录，不解压"""
+        path = self.chapter_path_list[chapter_idx]
+        if self.is_archive:
+            return self.book_root.file_size(path) or 0
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def chapter_index(self, path) -> int | None:
+        """章节路径在书脊中的下标"""
+        if self._chapter_index is None:
+            self._chapter_index = {}
+            for idx, chapter_path in enumerate(self.chapter_path_list):
+                self._chapter_index.setdefault(chapter_path, idx)
+        return self._chapter_index.get(path)
+
+    def read_file(self, local_path) -> bytes | None:
+        """读取本地路径（归档模式下为虚拟路径）指向的文件，不存在时返回 None"""
+        if self.is_archive:
+            return self.read_resource(local_path)
+        try:
+            with open(local_path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def read_resource(self, local_path) -> bytes | None:
+        """读取虚拟本地路径指向的归档内资源，不属于本书归档时返回 None"""
+        if not self.is_archive or not local_path.startswith(self._archive_prefix):
+            return None
+        member = local_path[len(self._archive_prefix):]
+        if not self.book_root.exists(member):
+            return None
+        return self.book_root.read(member)
+
+    def close(self):
+        self.book_root.close()
+
     def __eq__(self, value):
         if isinstance(value, EBook):
             return self.epub_path == value.epub_path
@@ -1,18 +1,47 @@
-from EBookTabWidget import EBookChapterDisplay, EBookTabWidget
+import os
+
+from EBookFindBar import EBookFindBar, FindMatch
+from EBookLoader import EBookLoadTask
+from EBookPagination import get_pagination_pool
+from EBookProgress import EBookProgressTracker, get_progress_pool, get_progress_store
+from EBookResources import get_icon
+from EBookSearch import SearchHit
+from EBookSearchDialog import EBookSearchDialog, EBookSearchIndexer, get_index_pool
+from EBookTabWidget import EBookChapterDisplay, EBookLoadingTab, EBookTabWidget
 from EBookTocDocker import EBookTocDocker
-from Ebook import EBook
-from Setting import SettingLoader, SettingSaver
+from EBookTracing import EBookTracePanel, get_tracer, span
+from EBookTocModel import EBookTocView
+from Ebook import EBook, EBookChapter, EBookStub
+from Setting import READING_MODES, SettingLoader, SettingSaver
+from TabMemoryManager import TabMemoryManager
 from ThemeManager import ThemeManager, Theme
 from commom_import import *
 
 index_html_path = "./html/test001.html"
 
+# 后台预热恢复标签页时，检查线程池是否空闲的间隔（毫秒）
+WARM_UP_INTERVAL_MS = 300
+# 阅读模式菜单项的名称，顺序与 READING_MODES 相同
+READING_MODE_NAMES = ("逐章显示", "连续滚动", "分页")
+
 
 class MainWindow(qtw.QMainWindow):
     def __init__(self, theme_manager: ThemeManager):
         super().__init__()
         self.theme_manager = theme_manager
+        theme_manager.attach(self)
         self.opened_ebooks_path: set[str] = set()
+        self._reader_font: qtg.QFont | None = None
+        self._reading_mode = "chapter"
+        self._thread_pool = qtc.QThreadPool.globalInstance()
+        self._restoring = False
+        # 打开过的书籍会在后台加入全文索引
+        self._search_indexer = EBookSearchIndexer(self)
+        self._search_dialog = None
+        # 线程池空闲时逐个加载尚未激活的恢复标签页
+        self._warm_up_timer = qtc.QTimer(self)
+        self._warm_up_timer.setInterval(WARM_UP_INTERVAL_MS)
+        self._warm_up_timer.timeout.connect(self.warm_up_next_tab)
         self.setup_ui()
         self.load_last_settings()
 
@@ -26,35 +55,66 @@ class MainWindow(qtw.QMainWindow):
         self.move(window_geometry.topLeft())
 
     def load_last_settings(self):
+        """恢复上次的会话：标签页先以占位形式创建，只加载当前标签页"""
         setting_loader = SettingLoader()
-        eBooks = setting_loader.get_last_read_ebooks()
-        for eBook in eBooks:
-            self.load_epub(eBook)
-        font = setting_loader.get_last_font()
-        for i in range(self._tab_widget.count()):
-            cur_widget: EBookChapterDisplay = self._tab_widget.widget(i)
-            cur_widget.setFont(font)
-        last_idx = setting_loader.get_last_idx()
+        self._reader_font = setting_loader.get_last_font()
+        self._reading_mode_actions[setting_loader.get_reading_mode()].trigger()
+        progress_store = get_progress_store()
+        stubs, last_idx = progress_store.session()
+        if progress_store.is_new:
+            # 旧版本在关闭时把会话保存在设置文件中
+            stubs, last_idx = setting_loader.get_last_read_ebooks(), setting_loader.get_last_idx()
+        self._restoring = True
+        for stub in stubs:
+            self._tab_widget.add_loading_tab(stub, activate=False)
         if last_idx is not None:
             self._tab_widget.setCurrentIndex(last_idx)
+        self._restoring = False
+        self.on_tab_widget_current_changed()
+        self._warm_up_timer.start()
         logger.info("Last settings loaded")
 
+    def warm_up_next_tab(self):
+        """线程池空闲时在后台加载下一个尚未激活的恢复标签页"""
+        if self._thread_pool.activeThreadCount() > 0:
+            return
+        pending = self._tab_widget.unstarted_loading_tabs()
+        if not pending:
+            self._warm_up_timer.stop()
+            return
+        self.start_loading(pending[0], priority=-1)
+
     def closeEvent(self, event: qtg.QCloseEvent):
         setting_saver = SettingSaver()
-        if self._tab_widget.count() > 0:
-            ebook_list = self._tab_widget.get_opened_books()
-            setting_saver.add_last_read_ebook(
-                ebook_list, self._tab_widget.currentIndex())
-            setting_saver.add_last_font(
-                self._tab_widget.currentWidget().font())
+        setting_saver.add_reading_mode(self._reading_mode)
+        if self._tab_widget.get_session_books():
+            font = self._reader_font
+            if font is None:
+                font = self._tab_widget.currentWidget().font()
+            setting_saver.add_last_font(font)
             setting_saver.add_opened_ebooks_path(self.opened_ebooks_path)
         setting_saver.save()
         logger.info("Settings saved")
+        # 阅读位置和会话随时保存，这里只写入最后一次变化
+        self._progress.mark_session()
+        self._progress.flush()
+        for i in range(self._tab_widget.count()):
+            widget = self._tab_widget.widget(i)
+            if isinstance(widget, EBookLoadingTab):
+                widget.cancel()
+            elif widget.pager is not None:
+                widget.pager.cancel()
+        self._search_indexer.cancel()
+        # 等待索引、分页等后台任务结束，退出时后台任务不会再向已销毁的对象发送信号
+        get_index_pool().waitForDone()
+        get_pagination_pool().waitForDone()
+        get_progress_pool().waitForDone()
+        self._library.shutdown()
         event.accept()
 
     def setup_ui(self):
         self.setWindowTitle("QEpuber - 现代电子书阅读器")
-        self.setWindowIcon(qtg.QIcon("./figures/book_reader_icon.png"))
+        self.setWindowIcon(get_icon("figures/book_reader_icon.png"))
         # 设置更大的默认窗口尺寸和居中位置
         self.resize(1200, 800)
         self.center_window()
@@ -88,9 +148,9 @@ class MainWindow(qtw.QMainWindow):
         left_splitter.setHandleWidth(3)
 
         # TOC列表
-        self._toc_list = qtw.QListWidget()
+        self._toc_list = EBookTocView()
         self._toc_list.setObjectName("tocList")
-        self._toc_list.itemClicked.connect(self.load_anchor_by_click_toc)
+        self._toc_list.clicked.connect(self.load_anchor_by_click_toc)
 
         # 创建TOC容器以添加标题
         toc_container = qtw.QWidget()
@@ -104,7 +164,10 @@ class MainWindow(qtw.QMainWindow):
         toc_layout.addWidget(self._toc_list)
 
         left_splitter.addWidget(toc_container)
-        left_splitter.addWidget(EBookTocDocker())
+        # 图书馆面板，双击书籍打开
+        self._library = EBookTocDocker()
+        self._library.book_activated.connect(self.load_epub_by_path)
+        left_splitter.addWidget(self._library)
         left_splitter.setSizes([300, 200])
         splitter.addWidget(left_splitter)
 
@@ -112,19 +175,38 @@ class MainWindow(qtw.QMainWindow):
         self._tab_widget = EBookTabWidget()
         self._tab_widget.setObjectName("bookTabWidget")
         splitter.addWidget(self._tab_widget)
+        # 超出内存预算时休眠最久未查看的标签页，切换回来时先恢复再刷新目录
+        self._tab_memory = TabMemoryManager(self._tab_widget, parent=self)
         self._tab_widget.currentChanged.connect(
             self.on_tab_widget_current_changed)
         self._tab_widget.tabCloseRequested.connect(self.remove_tab)
+        # 阅读位置和打开的标签页在变化后自动保存，不依赖正常退出
+        self._progress = EBookProgressTracker(self._tab_widget, parent=self)
 
         # 设置分割器比例
         splitter.setSizes([300, 900])
         self._layout.addWidget(splitter)
 
+        # 书内查找栏
+        self._find_bar = EBookFindBar()
+        self._find_bar.match_activated.connect(self.show_find_match)
+        self._find_bar.closed.connect(self.on_find_bar_closed)
+        self._find_bar.hide()
+        self._layout.addWidget(self._find_bar)
+
         # 添加状态栏
         self.statusBar().showMessage("就绪")
         self.statusBar().setObjectName("statusBar")
+        self._trace_panel = EBookTracePanel()
+        self._trace_panel.hide()
+        self.statusBar().addPermanentWidget(self._trace_panel)
+        self._page_label = qtw.QLabel()
+        self._page_label.setObjectName("pageLabel")
+        self._page_label.hide()
+        self.statusBar().addPermanentWidget(self._page_label)
 
     def remove_tab(self, index):
+        self._progress.flush()  # 关闭前保存该标签页的阅读位置
         self._tab_widget.removeTab(index)
         logger.info(f"Remove tab {index}")
 
@@ -138,10 +220,12 @@ class MainWindow(qtw.QMainWindow):
         self._tab_widget.setCurrentIndex(index)
         self.on_tab_widget_current_changed()
 
-    def load_anchor_by_click_toc(self, item):
+    def load_anchor_by_click_toc(self, index: qtc.QModelIndex):
+        if not isinstance(self._tab_widget.currentWidget(), EBookChapterDisplay):
+            return
         current_idx = self._tab_widget.currentIndex()
         eBook: EBook = self._tab_widget.currentWidget().eBook
-        toc_index = self._toc_list.currentRow()
+        toc_index = self._toc_list.toc_index(index)
         eBook._now_toc_idx = toc_index
         current_widget: EBookChapterDisplay = self._tab_widget.currentWidget()
         current_widget.load_chapter(eBook.get_anchor())
@@ -161,12 +245,19 @@ class MainWindow(qtw.QMainWindow):
         open_action = file_menu.addAction("Open EPUB")
         open_action.triggered.connect(self.load_epub_by_dialog)
         open_action.setShortcut("Ctrl+O")
+        search_action = file_menu.addAction("全文搜索")
+        search_action.triggered.connect(self.show_search_dialog)
+        search_action.setShortcut("Ctrl+Shift+F")
+        self._recent_menu = file_menu.addMenu("最近阅读")
+        self._recent_menu.aboutToShow.connect(self.update_recent_menu)
+        trace_action = file_menu.addAction("导出性能追踪…")
+        trace_action.triggered.connect(self.export_trace)
         exit_action = file_menu.addAction("Exit")
         exit_action.triggered.connect(self.close)
         exit_action.setShortcut("Ctrl+Q")
 
         file_button = qtw.QToolButton()
-        file_button.setIcon(qtg.QIcon("./figures/file_menu_bar.svg"))
+        file_button.setIcon(get_icon("figures/file_menu_bar.svg"))
         file_button.setMenu(file_menu)
         file_button.setPopupMode(
             qtw.QToolButton.ToolButtonPopupMode.MenuButtonPopup)
@@ -181,6 +272,20 @@ class MainWindow(qtw.QMainWindow):
         view_menu = qtw.QMenu()
         select_font_action = view_menu.addAction("字体设置")
         select_font_action.triggered.connect(self.update_font_for_tabs)
+        memory_action = view_menu.addAction("标签页内存")
+        memory_action.triggered.connect(self.show_tab_memory_usage)
+        reading_mode_menu = view_menu.addMenu("阅读模式")
+        reading_mode_group = qtg.QActionGroup(reading_mode_menu)
+        self._reading_mode_actions = {}
+        for mode, name in zip(READING_MODES, READING_MODE_NAMES):
+            action = self._reading_mode_actions[mode] = reading_mode_menu.addAction(name)
+            action.setCheckable(True)
+            action.setChecked(mode == self._reading_mode)
+            action.setActionGroup(reading_mode_group)
+            action.triggered.connect(lambda checked, m=mode: self.set_reading_mode(m))
+        trace_panel_action = view_menu.addAction("性能面板")
+        trace_panel_action.setCheckable(True)
+        trace_panel_action.toggled.connect(self.toggle_trace_panel)
 
         # 添加主题子菜单
         theme_menu = view_menu.addMenu("主题")
@@ -199,7 +304,7 @@ class MainWindow(qtw.QMainWindow):
                 lambda checked, t=theme: self.change_theme(t))
 
         view_button = qtw.QToolButton()
-        view_button.setIcon(qtg.QIcon("./figures/view_menu_bar.svg"))
+        view_button.setIcon(get_icon("figures/view_menu_bar.svg"))
         view_button.setMenu(view_menu)
         view_button.setPopupMode(
             qtw.QToolButton.ToolButtonPopupMode.MenuButtonPopup)
@@ -213,7 +318,7 @@ class MainWindow(qtw.QMainWindow):
         save_pre_setting_action.setCheckable(True)
 
         settings_button = qtw.QToolButton()
-        settings_button.setIcon(qtg.QIcon("./figures/settings_menu_bar.svg"))
+        settings_button.setIcon(get_icon("figures/settings_menu_bar.svg"))
         settings_button.setMenu(settings_menu)
         settings_button.setPopupMode(
             qtw.QToolButton.ToolButtonPopupMode.MenuButtonPopup)
@@ -231,9 +336,15 @@ class MainWindow(qtw.QMainWindow):
         prev_action = ebook_menu.addAction("Previous Chapter")
         prev_action.triggered.connect(self.prev_chapter)
         prev_action.setShortcut("[")
+        find_action = ebook_menu.addAction("在本书中查找")
+        find_action.triggered.connect(self.show_find_bar)
+        find_action.setShortcut("Ctrl+F")
+        go_to_page_action = ebook_menu.addAction("跳到指定页")
+        go_to_page_action.triggered.connect(self.go_to_page)
+        go_to_page_action.setShortcut("Ctrl+G")
 
         ebook_button = qtw.QToolButton()
-        ebook_button.setIcon(qtg.QIcon("./figures/ebook_menu_bar.svg"))
+        ebook_button.setIcon(get_icon("figures/ebook_menu_bar.svg"))
         ebook_button.setMenu(ebook_menu)
         ebook_button.setPopupMode(
             qtw.QToolButton.ToolButtonPopupMode.MenuButtonPopup)
@@ -244,13 +355,13 @@ class MainWindow(qtw.QMainWindow):
         tool_bar.addSeparator()
 
         prev_button = qtw.QToolButton()
-        prev_button.setIcon(qtg.QIcon("./figures/up_arrow.svg"))
+        prev_button.setIcon(get_icon("figures/up_arrow.svg"))
         prev_button.clicked.connect(self.prev_chapter)
         prev_button.setToolTip("上一章")
         prev_button.setObjectName("navButton")
 
         next_button = qtw.QToolButton()
-        next_button.setIcon(qtg.QIcon("./figures/down_arrow.svg"))
+        next_button.setIcon(get_icon("figures/down_arrow.svg"))
         next_button.clicked.connect(self.next_chapter)
         next_button.setToolTip("下一章")
         next_button.setObjectName("navButton")
@@ -261,64 +372,293 @@ class MainWindow(qtw.QMainWindow):
         return tool_bar
 
     def update_font_for_tabs(self):
-        dialog = qtw.QFontDialog()
-        dialog.setCurrentFont(self._tab_widget.currentWidget().font())
+        dialog = qtw.QFontDialog(self)
+        dialog.setCurrentFont(self._tab_widget.currentWidget().reader_font())
         if dialog.exec() == qtw.QDialog.DialogCode.Rejected:
             logger.info("Font change canceled")
             return
         font = dialog.selectedFont()
+        self._reader_font = font
         for i in range(self._tab_widget.count()):
-            cur_widget: EBookChapterDisplay = self._tab_widget.widget(i)
-            cur_widget.setFont(font)
+            cur_widget = self._tab_widget.widget(i)
+            if isinstance(cur_widget, EBookChapterDisplay):  # 加载中的标签页没有正文
+                cur_widget.set_reader_font(font)
         logger.info(f"Font changed to {font.family()} {font.pointSize()}pt")
 
+    def show_tab_memory_usage(self):
+        """显示每个标签页估算的内存占用，便于调整内存预算"""
+        budget = self._tab_memory.budget_bytes / 1024 ** 2
+        lines = [f"预算：{budget:.0f} MiB，合计：{self._tab_memory.total_usage() / 1024 ** 2:.1f} MiB", ""]
+        for book_name, usage, hibernated in self._tab_memory.usage_report():
+            state = "（已休眠）" if hibernated else ""
+            lines.append(f"{book_name}：{usage / 1024 ** 2:.1f} MiB{state}")
+        qtw.QMessageBox.information(self, "标签页内存", "\n".join(lines))
+
+    def set_reading_mode(self, mode):
+        """把所有标签页切换为逐章显示、整本书连续滚动或分页"""
+        if mode == self._reading_mode:
+            return
+        self._reading_mode = mode
+        for i in range(self._tab_widget.count()):
+            display = self._tab_widget.widget(i)
+            if isinstance(display, EBookChapterDisplay):
+                display.set_reading_mode(mode)
+        self.update_page_label()
+        logger.info(f"Reading mode changed to {self._reading_mode}")
+
+    def update_page_label(self):
+        """在状态栏显示当前标签页的页码，只在分页模式下显示"""
+        display = self._tab_widget.currentWidget()
+        paged = isinstance(display, EBookChapterDisplay) and display.is_paged()
+        self._page_label.setVisible(paged)
+        if paged:
+            self._page_label.setText(display.page_label())
+
+    def on_display_page_changed(self, display: EBookChapterDisplay):
+        if self._tab_widget.currentWidget() is display:
+            self.update_page_label()
+
+    def go_to_page(self):
+        """分页模式下按全书页码跳转，需要整本书已经分页"""
+        display = self._tab_widget.currentWidget()
+        if not isinstance(display, EBookChapterDisplay) or not display.is_paged():
+            return
+        pager = display.pager
+        if pager.page_map is None:
+            self.statusBar().showMessage("正在分页，请稍后再试", 3000)
+            return
+        page, ok = qtw.QInputDialog.getInt(
+            self, "跳到指定页", f"页码（1 - {pager.page_map.page_count()}）：",
+            pager.page_number() + 1, 1, pager.page_map.page_count())
+        if ok:
+            pager.go_to_page(page - 1)
+
+    def on_display_chapter_changed(self, display: EBookChapterDisplay, chapter_idx):
+        """连续滚动到另一章时同步目录位置和标签页标题"""
+        eBook = display.eBook
+        eBook._now_toc_idx = eBook.toc_index_for_chapter(chapter_idx)
+        display.sync_toc()  # 视口顶部可能已在本章靠后的目录项中
+        self.on_display_toc_changed(display)
+
+    def on_display_toc_changed(self, display: EBookChapterDisplay):
+        """在章节中滚动到另一个目录项时同步目录位置和标签页标题"""
+        self._tab_widget.setTabText(self._tab_widget.indexOf(display), display.eBook.current_title())
+        if self._tab_widget.currentWidget() is display:
+            self._toc_list.set_current_toc(display.eBook._now_toc_idx)
+
+    def toggle_trace_panel(self, visible):
+        """在状态栏显示或隐藏各项操作耗时的 p50/p95"""
+        self._trace_panel.setVisible(visible)
+
+    def export_trace(self):
+        """导出 Chrome trace-event JSON，可在 chrome://tracing 或 Perfetto 中查看"""
+        path, _ = qtw.QFileDialog.getSaveFileName(
+            self, "导出性能追踪", "QEpuber-trace.json", "Trace (*.json)")
+        if not path:
+            return
+        try:
+            get_tracer().export_chrome_trace(path)
+        except OSError as e:
+            qtw.QMessageBox.warning(self, "导出失败", str(e))
+            return
+        self.statusBar().showMessage(f"性能追踪已导出到 {path}", 3000)
+
     def change_theme(self, theme: Theme):
         """切换主题"""
         self.theme_manager.load_theme(theme)
+        for i in range(self._tab_widget.count()):
+            widget = self._tab_widget.widget(i)
+            if isinstance(widget, EBookChapterDisplay):
+                self.apply_document_theme(widget)
         logger.info(f"Theme changed to {theme.value}")
 
-    def load_epub(self, eBook: EBook):
+    def apply_document_theme(self, display: EBookChapterDisplay):
+        """把当前主题的正文样式应用到标签页"""
+        theme = self.theme_manager.current_theme
+        if theme is None:
+            return
+        display.set_document_theme(self.theme_manager.document_stylesheet(theme),
+                                   self.theme_manager.link_color(theme))
+
+    def update_recent_menu(self):
+        """列出最近阅读的书籍及读到的章节"""
+        self._recent_menu.clear()
+        for record in get_progress_store().recent():
+            if not os.path.exists(record.epub_path):
+                continue
+            book_name = os.path.splitext(os.path.basename(record.epub_path))[0]
+            action = self._recent_menu.addAction(f"{book_name} — {record.title}")
+            action.triggered.connect(
+                lambda checked, path=record.epub_path: self.load_epub_by_path(path))
+        if self._recent_menu.isEmpty():
+            self._recent_menu.addAction("（无）").setEnabled(False)
+
+    def load_epub(self, eBook: EBook, loading_tab: EBookLoadingTab | None = None):
+        pending_hit = loading_tab.pending_hit if loading_tab is not None else None
+        # 打开读过的书时回到上次的位置，打开搜索结果时以搜索结果为准
+        progress = get_progress_store().get(eBook.fingerprint) if pending_hit is None else None
+        if progress is not None and progress.toc_idx < eBook.get_anchor_count():
+            eBook._now_toc_idx = progress.toc_idx
         now_anchor = eBook.get_anchor()
         tab_widget = EBookChapterDisplay(eBook)
-        self._tab_widget.addTab(tab_widget, now_anchor.title)
+        self.apply_document_theme(tab_widget)
+        if self._reader_font is not None:
+            tab_widget.setFont(self._reader_font)
+        tab_widget.set_reading_mode(self._reading_mode)
+        tab_widget.chapter_changed.connect(
+            lambda chapter_idx: self.on_display_chapter_changed(tab_widget, chapter_idx))
+        tab_widget.page_changed.connect(lambda: self.on_display_page_changed(tab_widget))
+        tab_widget.toc_changed.connect(lambda toc_idx: self.on_display_toc_changed(tab_widget))
+        self._progress.track(tab_widget)
+        if loading_tab is None:
+            self._tab_widget.addTab(tab_widget, now_anchor.title)
+            self._tab_widget.setCurrentWidget(tab_widget)
+        else:
+            self._tab_widget.replace_tab(
+                loading_tab, tab_widget, now_anchor.title)
         tab_widget.load_chapter(now_anchor)
-        self._tab_widget.setCurrentIndex(self._tab_widget.count() - 1)
-
-        self._toc_list.clear()
-        for chapter in eBook.toc:
-            self._toc_list.addItem(chapter)
-        self._toc_list.setCurrentRow(eBook._now_toc_idx)
-        self.setWindowTitle(f"QEpuber - {eBook.book_name}")
+        if progress is not None:
+            tab_widget.restore_position(progress.chapter_idx, progress.position, progress.offset)
+        if pending_hit is not None:
+            self.show_search_hit(tab_widget, *pending_hit)
+        if self._tab_widget.currentWidget() is tab_widget:
+            self.on_tab_widget_current_changed()
 
         self.opened_ebooks_path.add(eBook.epub_path)
 
-    def load_epub_by_path(self, epub_path):
+    def load_epub_by_path(self, epub_path, now_toc_idx=0):
+        """在线程池中打开书籍，加载期间显示占位标签页"""
         if not epub_path:
             logger.info("No file selected")
             return
-        self.load_epub(EBook(epub_path))
+        index = self._tab_widget.find_tab(epub_path)
+        if index != -1:
+            self._tab_widget.setCurrentIndex(index)
+            return
+        loading_tab = self._tab_widget.add_loading_tab(
+            EBookStub(epub_path, now_toc_idx))
+        # 切换到新标签页时可能已经开始加载
+        if not loading_tab.is_started():
+            self.start_loading(loading_tab)
+
+    def start_loading(self, loading_tab: EBookLoadingTab, priority=0):
+        task = EBookLoadTask(loading_tab.epub_path,
+                             loading_tab.stub._now_toc_idx)
+        loading_tab.task = task
+        task.signals.progress.connect(loading_tab.set_progress)
+        task.signals.finished.connect(
+            lambda eBook: self.on_ebook_loaded(loading_tab, eBook))
+        task.signals.failed.connect(loading_tab.set_failed)
+        task.signals.canceled.connect(
+            lambda: self.on_ebook_load_canceled(loading_tab))
+        # 关闭占位标签页时会一并取消加载任务
+        loading_tab.cancel_requested.connect(
+            lambda: self.remove_tab(self._tab_widget.indexOf(loading_tab)))
+        self._thread_pool.start(task, priority)
+        self.statusBar().showMessage(f"正在打开 {loading_tab.book_name}")
+
+    def on_ebook_loaded(self, loading_tab: EBookLoadingTab, eBook: EBook):
+        if loading_tab.task.is_canceled() or self._tab_widget.indexOf(loading_tab) == -1:
+            # 加载完成前标签页已被关闭
+            eBook.close()
+            return
+        self.load_epub(eBook, loading_tab)
+        self.statusBar().showMessage(f"已打开 {eBook.book_name}", 3000)
+        self._search_indexer.update([eBook.epub_path])
+
+    def on_ebook_load_canceled(self, loading_tab: EBookLoadingTab):
+        index = self._tab_widget.indexOf(loading_tab)
+        if index != -1:
+            self.remove_tab(index)
+        self.statusBar().showMessage("已取消打开", 3000)
 
     def load_epub_by_dialog(self):
         epub_path, _ = qtw.QFileDialog.getOpenFileName(
             self, "Open EPUB", "", "EPUB Files (*.epub)")
-        ebook = EBook(epub_path)
-        if ebook in self._tab_widget.get_opened_books():
-            self._tab_widget.setCurrentIndex(
-                self._tab_widget.get_opened_books().index(ebook))
+        self.load_epub_by_path(epub_path)
+
+    def show_search_dialog(self):
+        if self._search_dialog is None:
+            self._search_dialog = EBookSearchDialog(self._search_indexer, self)
+            self._search_dialog.hit_activated.connect(self.open_search_hit)
+            self._search_dialog.folder_added.connect(self._library.scanner.rescan)
+        self._search_dialog.show()
+        self._search_dialog.raise_()
+        self._search_dialog.activateWindow()
+
+    def open_search_hit(self, hit: SearchHit, query: str):
+        """打开搜索结果所在的书籍并定位到命中位置"""
+        index = self._tab_widget.find_tab(hit.epub_path)
+        if index == -1:
+            self.load_epub_by_path(hit.epub_path, hit.toc_idx)
+            index = self._tab_widget.find_tab(hit.epub_path)
+        else:
+            self._tab_widget.setCurrentIndex(index)
+        widget = self._tab_widget.widget(index)
+        if isinstance(widget, EBookLoadingTab):
+            widget.pending_hit = (hit, query)
+            return
+        if widget.hibernated:
+            widget.wake_up()
+        self.show_search_hit(widget, hit, query)
+
+    def show_search_hit(self, display: EBookChapterDisplay, hit: SearchHit, query: str):
+        self.show_chapter(display, hit.chapter_idx, hit.toc_idx)
+        if not display.highlight_text(hit.matched_text()):
+            display.highlight_text(query)
+
+    def show_chapter(self, display: EBookChapterDisplay, chapter_idx, toc_idx=None):
+        """在标签页中加载书脊章节，并同步目录位置和标签页标题"""
+        eBook = display.eBook
+        if toc_idx is None:
+            toc_idx = eBook.toc_index_for_chapter(chapter_idx)
+        if toc_idx < eBook.get_anchor_count():
+            eBook._now_toc_idx = toc_idx
+        chapter = eBook.get_anchor()
+        # 不在目录中的章节直接按书脊打开
+        if (eBook.archor_idx_to_chapter_idx[eBook._now_toc_idx] != chapter_idx
+                and chapter_idx < len(eBook.chapter_path_list)):
+            chapter = EBookChapter(chapter.title, eBook.chapter_path_list[chapter_idx])
+        display.load_chapter(chapter)
+        self._tab_widget.setTabText(self._tab_widget.indexOf(display), chapter.title)
+        if self._tab_widget.currentWidget() is display:
+            self._toc_list.set_current_toc(eBook._now_toc_idx)
+
+    def show_find_bar(self):
+        display = self._tab_widget.currentWidget()
+        if not isinstance(display, EBookChapterDisplay):
+            return
+        self._find_bar.open_bar(display.eBook, display.chapter_idx or 0)
+
+    def show_find_match(self, match: FindMatch, query: str):
+        display = self._tab_widget.currentWidget()
+        if not isinstance(display, EBookChapterDisplay) or display.eBook is not self._find_bar.eBook:
             return
-        self.load_epub(ebook)
+        if display.chapter_idx != match.chapter_idx:
+            self.show_chapter(display, match.chapter_idx)
+        display.set_find_query(query)
+        display.select_occurrence(query, match.occurrence)
+
+    def on_find_bar_closed(self):
+        for index in range(self._tab_widget.count()):
+            display = self._tab_widget.widget(index)
+            if isinstance(display, EBookChapterDisplay):
+                display.set_find_query(None)
+        self._find_bar.eBook = None
 
     def next_chapter(self):
         if self._tab_widget.count() == 0:
             qtw.QMessageBox.warning(
                 self, "Error", "No eBook loaded", qtw.QMessageBox.StandardButton.Ok)
             return
+        if not isinstance(self._tab_widget.currentWidget(), EBookChapterDisplay):
+            return
         current_EBookTabWidget: EBookChapterDisplay = self._tab_widget.currentWidget()
         current_idx = self._tab_widget.currentIndex()
         eBook = current_EBookTabWidget.eBook
         next_chapter = eBook.next_anchor()
         current_EBookTabWidget.load_chapter(next_chapter)
-        self._toc_list.setCurrentRow(eBook._now_toc_idx)
+        self._toc_list.set_current_toc(eBook._now_toc_idx)
         self._tab_widget.setTabText(current_idx, next_chapter.title)
 
     def prev_chapter(self):
@@ -326,22 +666,38 @@ class MainWindow(qtw.QMainWindow):
             qtw.QMessageBox.warning(
                 self, "Error", "No eBook loaded", qtw.QMessageBox.StandardButton.Ok)
             return
+        if not isinstance(self._tab_widget.currentWidget(), EBookChapterDisplay):
+            return
         current_EBookTabWidget: EBookChapterDisplay = self._tab_widget.currentWidget()
         current_idx = self._tab_widget.currentIndex()
         eBook = current_EBookTabWidget.eBook
         prev_chapter = eBook.prev_anchor()
         current_EBookTabWidget.load_chapter(prev_chapter)
-        self._toc_list.setCurrentRow(eBook._now_toc_idx)
+        self._toc_list.set_current_toc(eBook._now_toc_idx)
         self._tab_widget.setTabText(current_idx, prev_chapter.title)
 
     def on_tab_widget_current_changed(self):
-        if self._tab_widget.count() == 0:
-            self.setWindowTitle("QEpuber")
-            self._toc_list.clear()
-            return
-        eBook: EBook = self._tab_widget.currentWidget().eBook
-        self._toc_list.clear()
-        for chapter in eBook.toc:
-            self._toc_list.addItem(chapter)
-        self._toc_list.setCurrentRow(eBook._now_toc_idx)
-        self.setWindowTitle(f"QEpuber - {eBook.book_name}")
+        with span("tab.switch") as attrs:
+            if self._tab_widget.count() == 0:
+                self.setWindowTitle("QEpuber")
+                self._toc_list.clear()
+                return
+            current_widget = self._tab_widget.currentWidget()
+            attrs["book"] = current_widget.book_name if isinstance(
+                current_widget, EBookLoadingTab) else current_widget.eBook.book_name
+            if isinstance(current_widget, EBookLoadingTab):
+                if not self._restoring and not current_widget.is_started():
+                    self.start_loading(current_widget, priority=1)
+                if self._find_bar.isVisible():
+                    self._find_bar.set_book(None)
+                self._toc_list.clear()
+                self.setWindowTitle(f"QEpuber - {current_widget.book_name}")
+                return
+            eBook: EBook = current_widget.eBook
+            # 每本书的目录模型只创建一次，切换标签页时直接替换
+            self._toc_list.setModel(current_widget.get_toc_model())
+            self._toc_list.set_current_toc(eBook._now_toc_idx)
+            self.setWindowTitle(f"QEpuber - {eBook.book_name}")
+            self.update_page_label()
+            if self._find_bar.isVisible():
+                self._find_bar.set_book(eBook, current_widget.chapter_idx or 0)
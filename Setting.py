@@ -1,27 +1,21 @@
 import json
+import os
 
 from PyQt6.QtGui import QFont
 
-from Ebook import EBook
+from EBookCache import cache_path
+from Ebook import EBookStub
 
-setting_path = "./eBookCache/pre_settings.json"
+setting_path = cache_path("pre_settings.json")
+
+# 阅读模式：逐章显示、整本书连续滚动或分页
+READING_MODES = ("chapter", "continuous", "paged")
 
 
 class SettingSaver:
     def __init__(self):
         self.setting = {}
 
-    def add_last_read_ebook(self, eBooks: list[EBook], last_idx: int = None):
-        if last_idx is not None:
-            self.setting["last_idx"] = last_idx
-        last_read = []
-        for eBook in eBooks:
-            last_read.append({
-                "epub_path": eBook.epub_path,
-                "_now_toc_idx": eBook._now_toc_idx
-            })
-        self.setting["last_read"] = last_read
-
     def add_last_font(self, font: QFont):
         self.setting["font"] = {
             "family": font.family(),
@@ -30,10 +24,15 @@ class SettingSaver:
             "italic": font.italic()
         }
 
+    def add_reading_mode(self, mode: str):
+        self.setting["reading_mode"] = mode
+
     def add_opened_ebooks_path(self, eBookPaths: set[str]):
         self.setting["opened_ebooks_path"] = list(eBookPaths)
 
     def save(self):
+        # 归档模式下不再解压，eBookCache 目录不一定存在
+        os.makedirs(os.path.dirname(setting_path), exist_ok=True)
         with open(setting_path, "w") as f:
             json.dump(self.setting, f, indent=4)
 
@@ -50,12 +49,17 @@ class SettingLoader:
         except FileNotFoundError:
             return None
 
-    def get_last_read_ebooks(self) -> list[EBook]:
+    def get_last_read_ebooks(self) -> list[EBookStub]:
+        """旧版本保存的上次打开的书籍，只返回占位信息，由调用方按需加载
+
+        会话现在由 EBookProgressStore 随时保存，这里只用于从旧版本迁移。
+        """
         if "last_read" not in self.setting:
             return []
         eBooks = []
         for data in self.setting["last_read"]:
-            eBooks.append(EBook(data["epub_path"], data["_now_toc_idx"]))
+            eBooks.append(EBookStub(
+                data["epub_path"], data["_now_toc_idx"], data.get("title")))
         return eBooks
 
     def get_last_idx(self) -> int | None:
@@ -72,6 +76,10 @@ class SettingLoader:
         font.setItalic(font_data["italic"])
         return font
 
+    def get_reading_mode(self) -> str:
+        mode = self.setting.get("reading_mode")
+        return mode if mode in READING_MODES else READING_MODES[0]
+
     def get_opened_ebooks_path(self) -> set[str]:
         if "opened_ebooks_path" not in self.setting:
             return set()
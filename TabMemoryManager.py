@@ -0,0 +1,70 @@
+import time
+
+from EBookTabWidget import EBookChapterDisplay, EBookTabWidget
+from commom_import import *
+
+# 所有标签页文档和图片的默认内存预算
+DEFAULT_BUDGET_BYTES = 512 * 1024 ** 2
+# 定期检查内存预算的间隔（毫秒）
+CHECK_INTERVAL_MS = 30 * 1000
+
+
+class TabMemoryManager(qtc.QObject):
+    """按内存预算休眠最久未查看的后台标签页
+
+    休眠的标签页释放 QTextDocument 和图片资源，只保留 EBook 状态和阅读位置，
+    再次切换到该标签页时原位恢复。当前标签页永远不会被休眠。
+    """
+
+    def __init__(self, tab_widget: EBookTabWidget, budget_bytes=DEFAULT_BUDGET_BYTES, parent=None):
+        super().__init__(parent)
+        self.tab_widget = tab_widget
+        self.budget_bytes = budget_bytes
+        self._last_viewed: dict[EBookChapterDisplay, float] = {}
+        self.tab_widget.currentChanged.connect(self.on_current_changed)
+        self._timer = qtc.QTimer(self)
+        self._timer.setInterval(CHECK_INTERVAL_MS)
+        self._timer.timeout.connect(self.enforce_budget)
+        self._timer.start()
+
+    def _displays(self) -> list[EBookChapterDisplay]:
+        return [self.tab_widget.widget(i) for i in range(self.tab_widget.count())
+                if isinstance(self.tab_widget.widget(i), EBookChapterDisplay)]
+
+    def on_current_changed(self):
+        current = self.tab_widget.currentWidget()
+        if isinstance(current, EBookChapterDisplay):
+            if current.hibernated:
+                current.wake_up()
+            self._last_viewed[current] = time.monotonic()
+        # 等切换完成后再检查预算，避免拖慢标签页切换
+        qtc.QTimer.singleShot(0, self.enforce_budget)
+
+    def enforce_budget(self):
+        displays = self._displays()
+        self._last_viewed = {display: self._last_viewed.get(display, 0.0)
+                             for display in displays}
+        total = self.total_usage()
+        if total <= self.budget_bytes:
+            return
+        current = self.tab_widget.currentWidget()
+        candidates = sorted(
+            (display for display in displays
+             if display is not current and not display.hibernated),
+            key=lambda display: self._last_viewed[display])
+        for display in candidates:
+            if total <= self.budget_bytes:
+                break
+            usage = display.memory_usage()
+            display.hibernate()
+            total -= usage
+            logger.info(
+                f"Hibernated tab {display.eBook.book_name} ({usage / 1024 ** 2:.1f} MiB)")
+
+    def total_usage(self):
+        return sum(display.memory_usage() for display in self._displays())
+
+    def usage_report(self) -> list[tuple[str, int, bool]]:
+        """每个标签页的 (书名, 估算内存字节数, 是否休眠)"""
+        return [(display.eBook.book_name, display.memory_usage(), display.hibernated)
+                for display in self._displays()]
@@ -1,5 +1,8 @@
 from enum import Enum
+from string import Template
 
+from EBookResources import read_resource_text
+from EBookTracing import span
 from commom_import import *
 
 
@@ -12,118 +15,248 @@ class Theme(Enum):
 
 
 class ThemeManager:
-    # 主题颜色配置字典
+    """从 QSS 模板和 THEME_COLORS 编译主题，编译结果按主题缓存
+
+    切换主题时不再读取文件；编译出的样式表与当前相同时只替换调色板，避免整个界面
+    重新套用样式表。样式表只套用在主窗口上，不在主窗口中的控件（例如不在当前标签页
+    中的页面）切换主题时不重新套用。书籍正文的颜色由 document_stylesheet 和调色板
+    提供，各模板中正文的字体、边框和内边距相同，切换主题不会重新排版。
+    """
+    # 主题颜色配置字典：window、window_text、button、button_text、accent 用于调色板，
+    # 其余颜色填入 QSS 模板中的 $名称 占位符；content_* 和 link 是书籍正文的颜色
     THEME_COLORS = {
         Theme.DARK: {
             "window": "#2B2B2B",
             "window_text": "#FFFFFF",
             "button": "#555555",
             "button_text": "#FFFFFF",
-            "accent": "#0078D7"
+            "accent": "#0078D7",
+            # QSS 模板中的颜色
+            "text": "#DDDDDD",
+            "secondary_text": "#CCCCCC",
+            "base": "#323232",
+            "surface": "#3A3A3A",
+            "surface_dark": "#353535",
+            "divider": "#404040",
+            "border": "#555555",
+            "border_hover": "#666666",
+            "hover": "#444444",
+            "hover_light": "#505050",
+            "tab_hover": "#454545",
+            "pressed": "#333333",
+            "handle": "#777777",
+            "handle_hover": "#AAAAAA",
+            "groove": "#222222",
+            "accent_dark": "#005A9E",
+            # 书籍正文
+            "content_background": "#2B2B2B",
+            "content_text": "#DDDDDD",
+            "link": "#4DA3FF"
         },
         Theme.LIGHT: {
             "window": "#F5F5F5",
             "window_text": "#333333",
             "button": "#DDDDDD",
             "button_text": "#000000",
-            "accent": "#0078D7"
+            "accent": "#0078D7",
+            # QSS 模板中的颜色
+            "text": "#222222",
+            "secondary_text": "#555555",
+            "control_text": "#333333",
+            "base": "#FFFFFF",
+            "surface": "#F0F0F0",
+            "surface_dark": "#E8E8E8",
+            "paper": "#FDFDFD",
+            "divider": "#D0D0D0",
+            "border": "#CCCCCC",
+            "border_hover": "#999999",
+            "hover": "#E6E6E6",
+            "hover_light": "#F8F8F8",
+            "pressed": "#D4D4D4",
+            "button_pressed": "#E0E0E0",
+            "handle": "#BBBBBB",
+            "handle_hover": "#AAAAAA",
+            "handle_border_hover": "#888888",
+            "groove": "#DDDDDD",
+            "accent_dark": "#005A9E",
+            # 书籍正文
+            "content_background": "#FFFFFF",
+            "content_text": "#333333",
+            "link": "#005A9E"
         },
         Theme.DEFAULT: {
             "window": "#FFFFFF",
             "window_text": "#000000",
             "button": "#F0F0F0",
             "button_text": "#000000",
-            "accent": "#0078D7"
+            "accent": "#0078D7",
+            # 书籍正文
+            "content_background": "#FFFFFF",
+            "content_text": "#000000",
+            "link": "#0000EE"
         },
         Theme.MODERN: {
             "window": "#FAFAFA",
             "window_text": "#2C3E50",
             "button": "#ECF0F1",
             "button_text": "#2C3E50",
-            "accent": "#3498DB"
+            "accent": "#3498DB",
+            # QSS 模板中的颜色
+            "text": "#2C3E50",
+            "secondary_text": "#495057",
+            "base": "#FFFFFF",
+            "surface": "#F8F9FA",
+            "surface_dark": "#E9ECEF",
+            "divider": "#E9ECEF",
+            "border": "#DEE2E6",
+            "border_hover": "#ADB5BD",
+            "hover": "#E3F2FD",
+            "hover_light": "#E3F2FD",
+            "pressed": "#BBDEFB",
+            "button_hover": "#F8F9FA",
+            "button_pressed": "#E3F2FD",
+            "gradient_end": "#F8F9FA",
+            "handle": "#DEE2E6",
+            "accent_light": "#5DADE2",
+            "accent_dark": "#2980B9",
+            "accent_darker": "#2471A3",
+            "disabled_text": "#ADB5BD",
+            "disabled_border": "#E9ECEF",
+            # 书籍正文
+            "content_background": "#FFFFFF",
+            "content_text": "#2C3E50",
+            "link": "#2980B9"
         },
         Theme.BLUE: {
             "window": "#E3F2FD",
             "window_text": "#1565C0",
             "button": "#BBDEFB",
             "button_text": "#0D47A1",
-            "accent": "#2196F3"
+            "accent": "#2196F3",
+            # QSS 模板中的颜色
+            "text": "#1565C0",
+            "secondary_text": "#1565C0",
+            "base": "#FFFFFF",
+            "surface": "#F3F8FF",
+            "surface_dark": "#E3F2FD",
+            "divider": "#BBDEFB",
+            "border": "#BBDEFB",
+            "border_hover": "#90CAF9",
+            "hover": "#BBDEFB",
+            "hover_light": "#E3F2FD",
+            "pressed": "#90CAF9",
+            "button_hover": "#BBDEFB",
+            "button_pressed": "#64B5F6",
+            "gradient_end": "#E3F2FD",
+            "handle": "#90CAF9",
+            "accent_light": "#42A5F5",
+            "accent_dark": "#1976D2",
+            "accent_darker": "#1565C0",
+            "disabled_text": "#9E9E9E",
+            "disabled_border": "#E1E8ED",
+            # 书籍正文
+            "content_background": "#FFFFFF",
+            "content_text": "#1565C0",
+            "link": "#0D47A1"
         }
     }
 
-    # QSS 文件路径
+    # QSS 模板路径，结构相同的主题共用一个模板
     QSS_PATHS = {
-        Theme.DARK: "./qss/dark_theme.qss",
-        Theme.LIGHT: "./qss/light_theme.qss",
-        Theme.DEFAULT: "./qss/default_theme.qss",
-        Theme.MODERN: "./qss/modern_theme.qss",
-        Theme.BLUE: "./qss/blue_theme.qss"
+        Theme.DARK: "qss/dark_theme.qss",
+        Theme.LIGHT: "qss/light_theme.qss",
+        Theme.DEFAULT: "qss/default_theme.qss",
+        Theme.MODERN: "qss/gradient_theme.qss",
+        Theme.BLUE: "qss/gradient_theme.qss"
     }
 
+    # 章节文档的默认样式表模板。颜色在解析 HTML 时写入字符格式，这里只放颜色、
+    # 不改变排版，已有的分页结果不受主题影响
+    DOCUMENT_STYLESHEET = "a { color: $link; }"
+
+    # 调色板角色 -> THEME_COLORS 中的颜色名
+    PALETTE_ROLES = (
+        (qtg.QPalette.ColorRole.Window, "window"),
+        (qtg.QPalette.ColorRole.WindowText, "window_text"),
+        (qtg.QPalette.ColorRole.Button, "button"),
+        (qtg.QPalette.ColorRole.ButtonText, "button_text"),
+        (qtg.QPalette.ColorRole.Highlight, "accent"),
+        (qtg.QPalette.ColorRole.Base, "content_background"),
+        (qtg.QPalette.ColorRole.Text, "content_text"),
+        (qtg.QPalette.ColorRole.Link, "link"),
+    )
+
     def __init__(self, app: qtw.QApplication):
         self.app = app
+        self.current_theme: Theme | None = None
+        self.window: qtw.QWidget | None = None  # 套用样式表的主窗口
+        self._templates: dict[str, Template] = {}  # 模板路径 -> 模板
+        self._stylesheets: dict[Theme, str] = {}  # 主题 -> 编译后的 QSS
+        self._palettes: dict[Theme, qtg.QPalette] = {}
 
     def load_theme(self, theme: Theme = Theme.DEFAULT):
         """根据传入的枚举值加载主题"""
-        # 首先设置调色板
-        self.set_theme_palette(theme)
+        with span("theme.switch", theme=theme.value) as attrs:
+            # 首先设置调色板
+            with span("theme.palette", theme=theme.value):
+                self.set_theme_palette(theme)
 
-        # 然后加载QSS文件
-        if theme in self.QSS_PATHS:
-            self.load_qss(self.QSS_PATHS[theme])
-        else:
-            self.load_qss(self.QSS_PATHS[Theme.DEFAULT])
+            # 然后套用编译好的样式表，还没有主窗口时在 attach 中套用
+            with span("theme.stylesheet", theme=theme.value):
+                stylesheet = self.stylesheet(theme)
+                attrs["palette_only"] = self.window is None or stylesheet == self.window.styleSheet()
+                if not attrs["palette_only"]:
+                    self.window.setStyleSheet(stylesheet)
+            self.current_theme = theme
 
         logger.info(f"Loaded theme: {theme.value}")
 
+    def attach(self, window: qtw.QWidget):
+        """把当前主题的样式表套用到主窗口上，之后切换主题时只更新主窗口"""
+        self.window = window
+        if self.current_theme is not None:
+            window.setStyleSheet(self.stylesheet(self.current_theme))
+
+    def _template(self, path) -> Template:
+        template = self._templates.get(path)
+        if template is None:
+            template = self._templates[path] = Template(read_resource_text(path))
+        return template
+
+    def stylesheet(self, theme: Theme) -> str:
+        """主题的 QSS，第一次使用时从模板编译"""
+        stylesheet = self._stylesheets.get(theme)
+        if stylesheet is None:
+            template = self._template(self.QSS_PATHS.get(theme, self.QSS_PATHS[Theme.DEFAULT]))
+            stylesheet = self._stylesheets[theme] = template.substitute(self.THEME_COLORS[theme])
+        return stylesheet
+
+    def palette(self, theme: Theme) -> qtg.QPalette:
+        palette = self._palettes.get(theme)
+        if palette is None:
+            colors = self.THEME_COLORS[theme]
+            palette = self._palettes[theme] = qtg.QPalette()
+            for role, name in self.PALETTE_ROLES:
+                palette.setColor(role, qtg.QColor(colors[name]))
+            palette.setColor(qtg.QPalette.ColorRole.HighlightedText,
+                             qtg.QColor("#FFFFFF"))
+        return palette
+
+    def document_stylesheet(self, theme: Theme) -> str:
+        """章节文档的默认样式表"""
+        return Template(self.DOCUMENT_STYLESHEET).substitute(self.THEME_COLORS[theme])
+
+    def link_color(self, theme: Theme) -> str:
+        return self.THEME_COLORS[theme]["link"]
+
     def set_theme_palette(self, theme: Theme):
         """根据主题设置调色板"""
-        palette = qtg.QPalette()
-        colors = self.THEME_COLORS[theme]
-
-        palette.setColor(qtg.QPalette.ColorRole.Window,
-                         qtg.QColor(colors["window"]))
-        palette.setColor(qtg.QPalette.ColorRole.WindowText,
-                         qtg.QColor(colors["window_text"]))
-        palette.setColor(qtg.QPalette.ColorRole.Button,
-                         qtg.QColor(colors["button"]))
-        palette.setColor(qtg.QPalette.ColorRole.ButtonText,
-                         qtg.QColor(colors["button_text"]))
-        palette.setColor(qtg.QPalette.ColorRole.Highlight,
-                         qtg.QColor(colors["accent"]))
-        palette.setColor(qtg.QPalette.ColorRole.HighlightedText,
-                         qtg.QColor("#FFFFFF"))
-
-        self.app.setPalette(palette)
+        self.app.setPalette(self.palette(theme))
 
     def set_dark_theme(self):
         """设置深色主题"""
-        palette = qtg.QPalette()
-        palette.setColor(qtg.QPalette.ColorRole.Window, qtg.QColor(
-            self.THEME_COLORS[Theme.DARK]["window"]))
-        palette.setColor(qtg.QPalette.ColorRole.WindowText,
-                         qtg.QColor(self.THEME_COLORS[Theme.DARK]["window_text"]))
-        palette.setColor(qtg.QPalette.ColorRole.Button, qtg.QColor(
-            self.THEME_COLORS[Theme.DARK]["button"]))
-        palette.setColor(qtg.QPalette.ColorRole.ButtonText,
-                         qtg.QColor(self.THEME_COLORS[Theme.DARK]["button_text"]))
-        self.app.setPalette(palette)
+        self.set_theme_palette(Theme.DARK)
 
     def set_light_theme(self):
         """设置浅色主题"""
-        palette = qtg.QPalette()
-        palette.setColor(qtg.QPalette.ColorRole.Window, qtg.QColor(
-            self.THEME_COLORS[Theme.LIGHT]["window"]))
-        palette.setColor(qtg.QPalette.ColorRole.WindowText,
-                         qtg.QColor(self.THEME_COLORS[Theme.LIGHT]["window_text"]))
-        palette.setColor(qtg.QPalette.ColorRole.Button, qtg.QColor(
-            self.THEME_COLORS[Theme.LIGHT]["button"]))
-        palette.setColor(qtg.QPalette.ColorRole.ButtonText,
-                         qtg.QColor(self.THEME_COLORS[Theme.LIGHT]["button_text"]))
-        self.app.setPalette(palette)
-
-    def load_qss(self, theme_file: str):
-        """加载 QSS 样式文件"""
-        with open(theme_file, "r", encoding='utf-8') as f:
-            style = f.read()
-            self.app.setStyleSheet(style)
+        self.set_theme_palette(Theme.LIGHT)
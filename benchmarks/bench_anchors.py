@@ -0,0 +1,156 @@
+"""锚点跳转和滚动时同步目录的耗时：锚点很多的章节与锚点很少的章节对比
+
+用合成 EPUB 生成两本书：一本每章只有几个目录项，另一本每章有上千个小节标题和
+页码锚点。逐章模式下分别测量：
+
+- 建立锚点索引：遍历一次整章。加载章节时不建立，第一次滚动停下后才建立
+- 跳转：QTextBrowser.scrollToAnchor（每次在文档中查找锚点）与建立索引后的
+  scroll_to_anchor（查表）；第一次查表跳转的耗时包括建立索引，并列出建立索引后
+  需要跳转多少次才能抵消建立索引的开销
+- 滚动：在整章中均匀取若干滚动位置，每次滚动后 sync_toc 的耗时
+
+    python benchmarks/bench_anchors.py
+    python benchmarks/bench_anchors.py --anchors 5000 --chapter-kb 800
+
+加载章节时建立了锚点索引，查表跳转的中位数比 scrollToAnchor 慢，或者锚点很多的
+章节每次滚动同步目录的中位数超过锚点很少的章节 SYNC_TOLERANCE 倍时返回 1。
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import EBookCache  # noqa: E402
+from commom_import import qtw  # noqa: E402
+from epub_factory import EpubSpec, write_epub  # noqa: E402
+
+# 标签页的大小（像素）
+VIEW_SIZE = (900, 700)
+# 每次滚动同步目录的耗时应与锚点数量无关，允许的测量噪声
+SYNC_TOLERANCE = 2.0
+# 每章测量跳转的锚点数
+JUMP_SAMPLES = 50
+
+
+def _median_ms(seconds):
+    return statistics.median(seconds) * 1000
+
+
+def measure(app, epub_path, scrolls):
+    from EBookTabWidget import EBookChapterDisplay
+    from Ebook import EBook
+    eBook = EBook(epub_path)
+    display = EBookChapterDisplay(eBook)
+    display.set_document_theme("", "#0000ee")
+    display.resize(*VIEW_SIZE)
+    display.show()
+    app.processEvents()
+    eBook._now_toc_idx = 0
+    display.load_chapter(eBook.get_anchor())
+    app.processEvents()
+    built_on_load = display.built_anchor_index() is not None
+
+    start = time.perf_counter()
+    display._anchor_index = None
+    index = display.anchor_index()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    toc_indexes = eBook.toc_indexes_for_chapter(display.chapter_idx)
+    fragments = [eBook.get_anchor(toc_idx).get_anchor() for toc_idx in toc_indexes]
+    fragments = [fragment for fragment in fragments if fragment]
+    step = max(1, len(fragments) // JUMP_SAMPLES)
+    fragments = fragments[::step][:JUMP_SAMPLES]
+    qt_jump, indexed_jump = [], []
+    for fragment in fragments:
+        start = time.perf_counter()
+        display.scrollToAnchor(fragment)
+        qt_jump.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        display.scroll_to_anchor(fragment)
+        indexed_jump.append(time.perf_counter() - start)
+
+    scroll_bar = display.verticalScrollBar()
+    sync = []
+    for i in range(scrolls):
+        scroll_bar.blockSignals(True)
+        scroll_bar.setValue(scroll_bar.maximum() * i // max(1, scrolls - 1))
+        scroll_bar.blockSignals(False)
+        start = time.perf_counter()
+        display.sync_toc()
+        sync.append(time.perf_counter() - start)
+
+    row = {
+        "anchors": len(index),
+        "toc": index.toc_count(),
+        "chars": display.document().characterCount(),
+        "built_on_load": built_on_load,
+        "build": build_ms,
+        "qt_jump": _median_ms(qt_jump),
+        "jump": _median_ms(indexed_jump),
+        "sync": _median_ms(sync),
+        "sync_max": max(sync) * 1000,
+    }
+    # 第一次查表跳转包括建立索引；之后每次比 scrollToAnchor 省下的时间抵消建立索引的开销
+    row["first_jump"] = build_ms + row["jump"]
+    saved = row["qt_jump"] - row["jump"]
+    row["break_even"] = math.ceil(build_ms / saved) if saved > 0 else None
+    display.deleteLater()
+    eBook.close()
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--anchors", type=int, default=2000, help="锚点很多的章节中小节标题的数量")
+    parser.add_argument("--chapter-kb", type=int, default=400)
+    parser.add_argument("--scrolls", type=int, default=200, help="每章测量的滚动位置数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="qepuber-bench-") as work_dir:
+        EBookCache.CACHE_ROOT = os.path.join(work_dir, "eBookCache")
+        few = write_epub(os.path.join(work_dir, "few.epub"), EpubSpec(
+            chapters=2, chapter_kb=args.chapter_kb, toc_per_chapter=8))
+        many = write_epub(os.path.join(work_dir, "many.epub"), EpubSpec(
+            chapters=2, chapter_kb=args.chapter_kb, toc_per_chapter=args.anchors, styled=True))
+        app = qtw.QApplication(sys.argv[:1])
+        rows = [("few anchors", measure(app, few, args.scrolls)),
+                ("many anchors", measure(app, many, args.scrolls))]
+        from EBookChapterCache import get_chapter_store
+        get_chapter_store().close()
+
+        print(f"chapter of {args.chapter_kb} KB, view {VIEW_SIZE[0]}x{VIEW_SIZE[1]}, "
+              f"median of {JUMP_SAMPLES} jumps and {args.scrolls} scroll positions (ms)\n")
+        print(f"{'':>13} {'anchors':>8} {'toc':>6} {'scrollToAnchor':>15} {'index':>8} {'1st indexed':>12} "
+              f"{'indexed':>8} {'break-even':>11} {'sync':>8} {'sync max':>9}")
+        for name, row in rows:
+            break_even = "never" if row["break_even"] is None else f"{row['break_even']} jumps"
+            print(f"{name:>13} {row['anchors']:>8} {row['toc']:>6} {row['qt_jump']:>15.3f} {row['build']:>8.2f} "
+                  f"{row['first_jump']:>12.2f} {row['jump']:>8.3f} {break_even:>11} "
+                  f"{row['sync']:>8.3f} {row['sync_max']:>9.3f}")
+        del app
+
+    failed = False
+    few_row, many_row = rows[0][1], rows[1][1]
+    if any(row["built_on_load"] for _, row in rows):
+        print("\nLoading a chapter built the anchor index")
+        failed = True
+    if many_row["jump"] > many_row["qt_jump"]:
+        print("\nIndexed jumps are slower than scrollToAnchor")
+        failed = True
+    if many_row["sync"] > few_row["sync"] * SYNC_TOLERANCE:
+        print(f"\nPer-scroll TOC sync grows with the number of anchors "
+              f"({many_row['sync']:.3f} ms vs {few_row['sync']:.3f} ms)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""单章加载和排版的耗时：原始 XHTML 与预处理后的 HTML 对比
+
+用合成 EPUB（按常见转换工具的输出排版：链接样式表、section 分节、页码锚点）
+逐章测量两种加载方式：
+
+- 原始：读取章节文件并解码，QTextDocument 解析 HTML 时再加载链接的样式表
+- 预处理：从磁盘缓存读取 EBookChapterCache 预处理好的 HTML 并解析
+
+分别统计加载（读取加解析）和排版（按正文宽度布局整章）的耗时，单独列出第一次
+打开时预处理并写入缓存的耗时，并检查每章的锚点在文档中能否找到。
+
+    python benchmarks/bench_chapter.py
+    python benchmarks/bench_chapter.py --chapters 20 --chapter-kb 60 --runs 5
+
+预处理后能找到的锚点比原始方式少，或加载加排版的中位数比原始方式慢
+SLOWDOWN_TOLERANCE 以上时返回 1。
+"""
+import argparse
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import EBookCache  # noqa: E402
+from commom_import import qtc, qtg, qtw  # noqa: E402
+from epub_factory import EpubSpec, write_epub  # noqa: E402
+
+# 排版所用的正文宽度（像素）
+TEXT_WIDTH = 760
+# 允许的测量噪声，两种方式解析和排版的内容相同，耗时接近
+SLOWDOWN_TOLERANCE = 0.1
+_ID_RE = re.compile(rb"""\sid\s*=\s*["']([^"']+)["']""")
+
+
+class RawDocument(qtg.QTextDocument):
+    """按预处理之前的方式加载资源：样式表从书中读取，图片不加载"""
+
+    def __init__(self, eBook):
+        super().__init__()
+        self.eBook = eBook
+
+    def loadResource(self, type, name):
+        if type == qtg.QTextDocument.ResourceType.StyleSheetResource:
+            data = self.eBook.read_file(name.toLocalFile())
+            if data is not None:
+                return qtc.QByteArray(data)
+        return None
+
+
+def anchor_names(document: qtg.QTextDocument) -> set[str]:
+    """文档中可以用 scrollToAnchor 跳转的锚点"""
+    names = set()
+    block = document.begin()
+    while block.isValid():
+        it = block.begin()
+        while not it.atEnd():
+            char_format = it.fragment().charFormat()
+            if char_format.isAnchor():
+                names.update(char_format.anchorNames())
+            it += 1
+        block = block.next()
+    return names
+
+
+def load_raw(eBook, local_path) -> tuple[qtg.QTextDocument, float, float]:
+    from EBookParser import normalize_html
+    start = time.perf_counter()
+    document = RawDocument(eBook)
+    document.setBaseUrl(qtc.QUrl.fromLocalFile(local_path))
+    document.setHtml(normalize_html(eBook.read_file(local_path)))
+    loaded = time.perf_counter()
+    document.setTextWidth(TEXT_WIDTH)
+    document.size()  # 触发整个文档的布局
+    return document, (loaded - start) * 1000, (time.perf_counter() - loaded) * 1000
+
+
+def load_simplified(eBook, local_path) -> tuple[qtg.QTextDocument, float, float]:
+    from EBookChapterCache import load_simplified_chapter
+    start = time.perf_counter()
+    document = qtg.QTextDocument()
+    document.setBaseUrl(qtc.QUrl.fromLocalFile(local_path))
+    document.setHtml(load_simplified_chapter(eBook, local_path).html)
+    loaded = time.perf_counter()
+    document.setTextWidth(TEXT_WIDTH)
+    document.size()
+    return document, (loaded - start) * 1000, (time.perf_counter() - loaded) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--chapter-kb", type=int, default=40)
+    parser.add_argument("--toc-per-chapter", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=5, help="每章每种方式测量的次数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="qepuber-bench-") as work_dir:
+        EBookCache.CACHE_ROOT = os.path.join(work_dir, "eBookCache")
+        epub_path = write_epub(os.path.join(work_dir, "styled.epub"), EpubSpec(
+            chapters=args.chapters, chapter_kb=args.chapter_kb, toc_per_chapter=args.toc_per_chapter,
+            styled=True))
+        app = qtw.QApplication(sys.argv[:1])
+        from EBookChapterCache import get_chapter_store, load_simplified_chapter
+        from Ebook import EBook
+        eBook = EBook(epub_path)
+        local_paths = [eBook.local_path(path) for path in eBook.chapter_path_list]
+
+        # 第一次打开：预处理并写入磁盘缓存
+        simplify_ms = []
+        for local_path in local_paths:
+            start = time.perf_counter()
+            load_simplified_chapter(eBook, local_path)
+            simplify_ms.append((time.perf_counter() - start) * 1000)
+
+        rows = []
+        for local_path in local_paths:
+            data = eBook.read_file(local_path)
+            ids = {match.decode() for match in _ID_RE.findall(data)}
+            raw = [load_raw(eBook, local_path) for _ in range(args.runs)]
+            simplified = [load_simplified(eBook, local_path) for _ in range(args.runs)]
+            rows.append({
+                "name": os.path.basename(local_path),
+                "kb": len(data) / 1024,
+                "raw_load": statistics.median(row[1] for row in raw),
+                "raw_layout": statistics.median(row[2] for row in raw),
+                "load": statistics.median(row[1] for row in simplified),
+                "layout": statistics.median(row[2] for row in simplified),
+                "ids": len(ids),
+                "raw_anchors": len(ids & anchor_names(raw[0][0])),
+                "anchors": len(ids & anchor_names(simplified[0][0])),
+            })
+
+        print(f"{len(rows)} chapters, text width {TEXT_WIDTH}px, median of {args.runs} runs (ms)\n")
+        print(f"{'chapter':>18} {'KB':>6} {'raw load':>9} {'layout':>8} {'load':>8} {'layout':>8} "
+              f"{'anchors raw/now/ids':>20}")
+        for row in rows:
+            print(f"{row['name']:>18} {row['kb']:>6.1f} {row['raw_load']:>9.2f} {row['raw_layout']:>8.2f} "
+                  f"{row['load']:>8.2f} {row['layout']:>8.2f} "
+                  f"{row['raw_anchors']:>8}/{row['anchors']}/{row['ids']}")
+
+        raw_total = statistics.median(row["raw_load"] + row["raw_layout"] for row in rows)
+        total = statistics.median(row["load"] + row["layout"] for row in rows)
+        print(f"\nfirst open, simplify and cache: median {statistics.median(simplify_ms):.2f} ms per chapter")
+        print(f"load + layout per chapter: raw median {raw_total:.2f} ms, simplified median {total:.2f} ms "
+              f"({raw_total / total:.1f}x)")
+        print(f"anchors found: raw {sum(row['raw_anchors'] for row in rows)}, "
+              f"simplified {sum(row['anchors'] for row in rows)} of {sum(row['ids'] for row in rows)}")
+        get_chapter_store().close()
+        eBook.close()
+        del app
+        failed = False
+        if any(row["anchors"] < row["raw_anchors"] for row in rows):
+            print("Some anchors found in raw chapters are missing from simplified chapters")
+            failed = True
+        if total > raw_total * (1 + SLOWDOWN_TOLERANCE):
+            print(f"Simplified chapters are more than {SLOWDOWN_TOLERANCE:.0%} slower than raw chapters")
+            failed = True
+        return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""OPF 包模型与目录映射的规模测试
+
+生成书脊章节数和目录项数相同的合成 EPUB，统计 OPFPackage、parse_toc
+和 map_toc_to_spine 的耗时。每个目录项的平均耗时应基本不随规模增长。
+
+    python benchmarks/bench_package.py --sizes 1000 10000 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from EBookArchive import EBookArchive  # noqa: E402
+from EBookParser import OPFPackage, map_toc_to_spine, parse_toc  # noqa: E402
+from epub_factory import EpubSpec, write_epub  # noqa: E402
+
+
+def run(size, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        epub_path = os.path.join(tmp, f"bench_{size}.epub")
+        # 每章一个目录项、正文只有标题，耗时集中在 OPF 和目录的解析上
+        write_epub(epub_path, EpubSpec(chapters=size, chapter_kb=0, toc_per_chapter=1))
+        best = float("inf")
+        with EBookArchive(epub_path) as archive:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                package = OPFPackage(archive)
+                entries = map_toc_to_spine(parse_toc(archive, package), package)
+                best = min(best, time.perf_counter() - start)
+        assert len(entries) == size
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 5000, 10000, 25000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    per_entry = []
+    print(f"{'entries':>8} {'total ms':>10} {'us/entry':>10}")
+    for size in args.sizes:
+        seconds = run(size, args.repeat)
+        per_entry.append(seconds / size)
+        print(f"{size:>8} {seconds * 1000:>10.1f} {seconds / size * 1e6:>10.2f}")
+    growth = per_entry[-1] / per_entry[0]
+    print(f"us/entry growth from {args.sizes[0]} to {args.sizes[-1]}: x{growth:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""EBookParser 与 EBook 的基准测试
+
+用 epub_factory 生成几种典型的合成 EPUB，分别统计 extract_epub、parse_chapters、
+parse_toc、EBook.__init__、extract_chapters、iter_chapters 和 extract_anchors 的冷/热耗时和
+峰值内存，并按章节数统计规模曲线。
+
+冷/热指应用自身的缓存：冷启动时使用全新的 eBookCache 目录（没有解压缓存和
+书籍索引）并重新打开归档，热启动时保留这些状态重复运行取最快的一次。
+合成文件刚刚写入，操作系统的页缓存始终是热的。峰值内存由 tracemalloc 在
+另一次冷启动中统计，只包含 Python 分配的内存。
+
+    python benchmarks/bench_parser.py                        # 运行并与基线比较
+    python benchmarks/bench_parser.py --save-baseline        # 保存为新的基线
+    python benchmarks/bench_parser.py --threshold 0.5 --scale 50 200 800
+
+与基线相比，任何一项的耗时或峰值内存超过基线的 (1 + threshold) 倍时返回 1。
+计时前先检查提取的文字（行内元素之间的空格、块之间的断行），结果不对时直接返回 1。
+基线与机器相关，应在同一台机器上生成和比较；比较耗时前会按一段固定的校准
+负载的耗时折算基线，抵消机器整体变快或变慢的影响。
+"""
+import argparse
+import collections
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import EBookCache  # noqa: E402
+import EBookIndex  # noqa: E402
+from EBookArchive import EBookArchive  # noqa: E402
+from EBookParser import extract_anchors, extract_chapters, extract_epub, iter_chapters, parse_chapters, parse_toc  # noqa: E402
+from EBookSearch import extract_text, iter_text  # noqa: E402
+from Ebook import EBook  # noqa: E402
+from epub_factory import EpubSpec, write_epub  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "bench_parser.json")
+# 默认的回归阈值：比基线慢或多占用 25% 以上视为回归
+DEFAULT_THRESHOLD = 0.25
+# 低于这些差值的变化视为噪声，不算回归
+MIN_TIME_DELTA = 0.005
+MIN_MEMORY_DELTA = 256 * 1024
+
+SCENARIOS = {
+    "epub2": EpubSpec(chapters=40, chapter_kb=30, toc_per_chapter=3, toc_depth=2, images=10),
+    "epub3": EpubSpec(chapters=40, chapter_kb=30, toc_per_chapter=3, toc_depth=2, images=10, epub3=True),
+    "deep_toc": EpubSpec(chapters=60, chapter_kb=10, toc_per_chapter=12, toc_depth=5),
+    "images": EpubSpec(chapters=20, chapter_kb=10, images=200, image_kb=200),
+}
+# 规模曲线使用的章节数，其余参数与 epub2 相同
+DEFAULT_SCALE = [25, 100, 400]
+# 文字提取的检查用例：(章节字节, 提取的文字)
+TEXT_CASES = [
+    (b"<p><span>New</span> <span>York</span></p>", "\nNew York"),
+    (b"<b>Hello</b> <i>world</i>", "Hello world"),
+    (b"<p>a<br/>b</p>", "\na\nb"),
+    (b"<p>  first</p>\n  <p>\n second  line</p>", "\nfirst \nsecond line"),
+    (b"<head><title>t</title></head><p>x<script>y</script> z</p>", "\nx z"),
+    ('<?xml version="1.0" encoding="GBK"?><p>第一章 开始</p>'.encode("gbk"), "\n第一章 开始"),
+    ("<p>第一章</p>".encode("utf-16"), "\n第一章"),
+    (b"\xef\xbb\xbf<p>\xe7\xac\xac</p>", "\n第"),
+]
+
+
+class BenchContext:
+    """一次冷启动的环境：全新的 eBookCache 目录、书籍索引和归档"""
+
+    def __init__(self, epub_path, work_dir):
+        self.epub_path = epub_path
+        self.work_dir = work_dir
+        self.cache_root = None
+        self._book_root = None
+        self._spine = None
+
+    def reset(self):
+        self.close()
+        self.cache_root = tempfile.mkdtemp(prefix="cache-", dir=self.work_dir)
+        EBookCache.CACHE_ROOT = self.cache_root
+        EBookCache._cache_manager = None
+        EBookIndex._book_index = None
+
+    @property
+    def book_root(self) -> EBookArchive:
+        if self._book_root is None:
+            self._book_root = EBookArchive(self.epub_path)
+        return self._book_root
+
+    @property
+    def spine(self):
+        if self._spine is None:
+            self._spine = parse_chapters(self.book_root)
+        return self._spine
+
+    def close(self):
+        if self._book_root is not None:
+            self._book_root.close()
+            self._book_root = None
+        if EBookIndex._book_index is not None:
+            EBookIndex._book_index.close()
+            EBookIndex._book_index = None
+        if self.cache_root is not None:
+            shutil.rmtree(self.cache_root, ignore_errors=True)
+            self.cache_root = None
+
+
+def _open_ebook(ctx: BenchContext):
+    EBook(ctx.epub_path).close()
+
+
+def _iter_chapters(mode):
+    # 逐章消费而不保留结果，峰值内存反映流式接口的实际占用
+    def factory(ctx: BenchContext):
+        return lambda: collections.deque(iter_chapters(ctx.epub_path, mode), maxlen=0)
+    return factory
+
+
+def _extract_anchors(ctx: BenchContext):
+    spine = ctx.spine
+    return lambda: [extract_anchors(path, ctx.book_root) for path in spine]
+
+
+# 基准名 -> 在给定环境下返回被测函数的工厂，工厂中的准备工作不计入耗时
+BENCHMARKS = {
+    "extract_epub": lambda ctx: lambda: extract_epub(ctx.epub_path, os.path.join(ctx.cache_root, "extracted")),
+    "parse_chapters": lambda ctx: lambda: parse_chapters(ctx.book_root),
+    "parse_toc": lambda ctx: lambda: parse_toc(ctx.book_root),
+    "EBook.__init__": lambda ctx: lambda: _open_ebook(ctx),
+    "extract_chapters": lambda ctx: lambda: extract_chapters(ctx.epub_path),
+    "iter_chapters.html": _iter_chapters("html"),
+    "iter_chapters.text": _iter_chapters("text"),
+    "extract_anchors": _extract_anchors,
+}
+
+
+def check_text_extraction() -> list[str]:
+    """按 TEXT_CASES 检查整篇提取和逐字节流式提取的文字，返回不一致的用例"""
+    errors = []
+    for data, expected in TEXT_CASES:
+        for name, text in (("extract_text", extract_text(data)[0]),
+                           ("iter_text", "".join(iter_text(io.BytesIO(data), chunk_size=1)))):
+            if text != expected:
+                errors.append(f"{name}({data!r}) = {text!r}, expected {expected!r}")
+    return errors
+
+
+def _timed(function):
+    # 与 timeit 一样计时期间关闭垃圾回收，减少回收时机不同带来的波动
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def calibrate(repeat=5):
+    """固定的纯 Python 负载的最快耗时，用于折算不同时刻机器速度的差异"""
+    def workload():
+        data = [{"title": f"第{i}章", "anchor": f"Text/{i}.xhtml#s{i}", "level": i % 4} for i in range(20000)]
+        json.loads(json.dumps(data, ensure_ascii=False))
+        sorted(data, key=lambda entry: entry["anchor"])
+    return min(_timed(workload) for _ in range(repeat))
+
+
+def measure(ctx: BenchContext, make_function, repeat) -> dict:
+    """冷启动和热启动各自重复 repeat 次的最快耗时，以及冷启动的峰值内存"""
+    cold = float("inf")
+    for _ in range(repeat):
+        ctx.reset()
+        function = make_function(ctx)
+        cold = min(cold, _timed(function))
+    warm = min(_timed(function) for _ in range(repeat))
+    ctx.reset()
+    function = make_function(ctx)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    ctx.close()
+    return {"cold_s": cold, "warm_s": warm, "peak_bytes": peak}
+
+
+def run_scenario(name, spec: EpubSpec, work_dir, repeat, benchmarks) -> dict:
+    epub_path = write_epub(os.path.join(work_dir, f"{name}.epub"), spec)
+    ctx = BenchContext(epub_path, work_dir)
+    results = {}
+    for bench_name in benchmarks:
+        results[bench_name] = measure(ctx, BENCHMARKS[bench_name], repeat)
+    return results
+
+
+def _format_bytes(size):
+    return f"{size / 1024 ** 2:.1f} MiB" if size >= 1024 ** 2 else f"{size / 1024:.0f} KiB"
+
+
+def print_results(title, results):
+    print(f"\n== {title}")
+    print(f"{'benchmark':<18} {'cold ms':>10} {'warm ms':>10} {'peak':>10}")
+    for bench_name, result in results.items():
+        print(f"{bench_name:<18} {result['cold_s'] * 1000:>10.1f} {result['warm_s'] * 1000:>10.1f} "
+              f"{_format_bytes(result['peak_bytes']):>10}")
+
+
+def print_scaling(scaling):
+    sizes = sorted(scaling, key=int)
+    print("\n== scaling (warm ms per chapter)")
+    print(f"{'benchmark':<18}" + "".join(f"{size + ' ch':>12}" for size in sizes) + f"{'growth':>10}")
+    for bench_name in scaling[sizes[0]]:
+        per_chapter = [scaling[size][bench_name]["warm_s"] * 1000 / int(size) for size in sizes]
+        growth = per_chapter[-1] / per_chapter[0] if per_chapter[0] else float("nan")
+        print(f"{bench_name:<18}" + "".join(f"{value:>12.3f}" for value in per_chapter) + f"{'x' + format(growth, '.2f'):>10}")
+
+
+def flatten(report) -> dict:
+    """把报告展开成 {指标名: 数值}，用于和基线逐项比较"""
+    metrics = {}
+    for scenario, results in report["scenarios"].items():
+        for bench_name, result in results.items():
+            for key, value in result.items():
+                metrics[f"{scenario}/{bench_name}/{key}"] = value
+    for size, results in report["scaling"].items():
+        for bench_name, result in results.items():
+            for key, value in result.items():
+                metrics[f"scale-{size}/{bench_name}/{key}"] = value
+    return metrics
+
+
+def compare(report, baseline, threshold) -> list[str]:
+    """与基线逐项比较，返回超过阈值的回归"""
+    current = flatten(report)
+    speed = report["calibration_s"] / baseline.get("calibration_s", report["calibration_s"])
+    regressions = []
+    for key, base in flatten(baseline).items():
+        value = current.get(key)
+        if value is None:
+            continue
+        if key.endswith("_s"):
+            base *= speed
+        min_delta = MIN_MEMORY_DELTA if key.endswith("_bytes") else MIN_TIME_DELTA
+        if value > base * (1 + threshold) and value - base > min_delta:
+            regressions.append(f"{key}: {base:.6g} -> {value:.6g} (x{value / base:.2f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--scale", type=int, nargs="*", default=DEFAULT_SCALE,
+                        help="规模曲线的章节数，不指定数值时跳过")
+    parser.add_argument("--repeat", type=int, default=3, help="冷启动和热启动各自的重复次数")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--json", help="另外把本次结果写入该文件")
+    args = parser.parse_args()
+
+    errors = check_text_extraction()
+    if errors:
+        print("Text extraction check failed:")
+        for line in errors:
+            print(f"  {line}")
+        return 1
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "specs": {name: SCENARIOS[name].to_dict() for name in args.scenarios},
+        "scenarios": {},
+        "scaling": {},
+    }
+    # 运行前后各校准一次取平均，运行期间机器速度的变化也能部分抵消
+    calibration = calibrate()
+    with tempfile.TemporaryDirectory(prefix="qepuber-bench-") as work_dir:
+        for name in args.scenarios:
+            report["scenarios"][name] = run_scenario(
+                name, SCENARIOS[name], work_dir, args.repeat, args.benchmarks)
+            print_results(name, report["scenarios"][name])
+        base_spec = SCENARIOS["epub2"].to_dict()
+        for chapters in args.scale:
+            spec = EpubSpec(**{**base_spec, "chapters": chapters})
+            report["scaling"][str(chapters)] = run_scenario(
+                f"scale{chapters}", spec, work_dir, args.repeat, args.benchmarks)
+        if report["scaling"]:
+            print_scaling(report["scaling"])
+    report["calibration_s"] = (calibration + calibrate()) / 2
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.threshold)
+    if "calibration_s" in baseline:
+        print(f"\nMachine speed relative to baseline: x{baseline['calibration_s'] / report['calibration_s']:.2f}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%} against {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nNo regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""冷启动到主窗口第一次绘制的耗时
+
+每次测量启动一个新的 Python 进程（无界面，offscreen），按 main.py 的顺序
+导入模块、注册资源包、创建主窗口并显示，记录主窗口第一次收到绘制事件的时间。
+分别统计导入、创建窗口和从进程启动到第一次绘制的耗时，并检查启动期间没有
+导入只有打开书籍才需要的模块。子进程使用临时的 eBookCache，没有上次的会话。
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --target-ms 400
+    python benchmarks/bench_startup.py --no-bundle     # 不使用资源包，逐个读取磁盘上的文件
+
+第一次绘制的中位数超过目标，或者启动时导入了延迟导入的模块时返回 1。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# 从进程启动到第一次绘制的目标耗时（毫秒）
+DEFAULT_TARGET_MS = 400
+# 只在打开书籍、建立索引或扫描书库时才需要的模块，启动时不应导入
+DEFERRED_MODULES = ("bs4", "ebooklib", "lxml", "multiprocessing", "concurrent.futures.process")
+
+# 在子进程中运行：与 main.main 相同的启动顺序，第一次绘制时输出结果并立即退出
+_CHILD = r"""
+import time
+start = time.perf_counter()
+import json, os, sys
+root, cache_root, use_bundle = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+sys.path.insert(0, root)
+# logger 把日志写到当前目录下的 QEpuber.log：在临时目录中导入，再切换到程序目录按相对路径加载资源
+os.chdir(cache_root)
+import logger
+os.chdir(root)
+import EBookCache
+EBookCache.CACHE_ROOT = cache_root
+from PyQt6 import QtCore, QtWidgets
+import main
+from EBookResources import register_resources
+imported = time.perf_counter()
+app = QtWidgets.QApplication(sys.argv[:1])
+registered = register_resources() if use_bundle else False
+window = main.create_window(app)
+created = time.perf_counter()
+
+
+class FirstPaint(QtCore.QObject):
+    def eventFilter(self, obj, event):
+        if (event.type() == QtCore.QEvent.Type.Paint and isinstance(obj, QtWidgets.QWidget)
+                and obj.window() is window):
+            painted = time.perf_counter()
+            print(json.dumps({
+                "imports_ms": (imported - start) * 1000,
+                "window_ms": (created - imported) * 1000,
+                "paint_ms": (painted - start) * 1000,
+                "bundle": registered,
+                "deferred_loaded": [name for name in json.loads(sys.argv[4]) if name in sys.modules],
+            }), flush=True)
+            os._exit(0)
+        return False
+
+
+first_paint = FirstPaint()
+app.installEventFilter(first_paint)
+window.show()
+app.exec()
+"""
+
+
+def run_once(use_bundle):
+    with tempfile.TemporaryDirectory(prefix="qepuber-bench-") as cache_root:
+        env = dict(os.environ)
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", _CHILD, ROOT_DIR, cache_root, "1" if use_bundle else "0",
+             json.dumps(DEFERRED_MODULES)],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True).stdout
+        elapsed = (time.perf_counter() - start) * 1000
+    result = json.loads(output.strip().splitlines()[-1])
+    # 父进程看到的耗时包括解释器本身的启动
+    result["process_ms"] = elapsed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--target-ms", type=float, default=DEFAULT_TARGET_MS,
+                        help="从进程启动到第一次绘制的目标")
+    parser.add_argument("--no-bundle", action="store_true", help="不注册资源包")
+    args = parser.parse_args()
+
+    if not args.no_bundle and not os.path.exists(os.path.join(ROOT_DIR, "resources.rcc")):
+        print("resources.rcc not found, run build_resources.py first")
+        return 1
+    # 第一次运行预热操作系统的文件缓存和 __pycache__，不计入结果
+    run_once(not args.no_bundle)
+    results = [run_once(not args.no_bundle) for _ in range(args.runs)]
+
+    print(f"{args.runs} cold starts, resource bundle {'off' if args.no_bundle else 'on'}\n")
+    print(f"{'':>22} {'median':>8} {'min':>8} {'max':>8}")
+    for key, label in (("imports_ms", "imports"), ("window_ms", "create window"),
+                       ("paint_ms", "first paint (script)"), ("process_ms", "first paint (process)")):
+        values = [result[key] for result in results]
+        print(f"{label:>22} {statistics.median(values):>8.1f} {min(values):>8.1f} {max(values):>8.1f}")
+
+    failed = False
+    loaded = sorted({name for result in results for name in result["deferred_loaded"]})
+    if loaded:
+        print(f"\nDeferred modules imported during startup: {', '.join(loaded)}")
+        failed = True
+    median = statistics.median(result["process_ms"] for result in results)
+    if median > args.target_ms:
+        print(f"\nMedian time to first paint {median:.1f} ms is over the {args.target_ms:.0f} ms target")
+        failed = True
+    else:
+        print(f"\nMedian time to first paint {median:.1f} ms is within the {args.target_ms:.0f} ms target")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""主题切换延迟的基准测试
+
+在无界面（offscreen）的主窗口中打开若干本合成 EPUB，依次切换各个主题，
+统计 MainWindow.change_theme 本身的耗时（同步）和之后处理完重绘、字体和
+链接颜色更新等事件的耗时（稳定），并与一帧的时间预算比较。再次套用当前
+主题时编译好的样式表没有变化，只更新调色板，单独列出。
+
+    python benchmarks/bench_theme.py
+    python benchmarks/bench_theme.py --tabs 30 --rounds 5 --budget-ms 16.7
+
+同步耗时的中位数超过预算时返回 1。
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import EBookCache  # noqa: E402
+from commom_import import qtc, qtw  # noqa: E402
+from epub_factory import EpubSpec, write_epub  # noqa: E402
+
+# 60 Hz 下一帧的时间
+FRAME_BUDGET_MS = 1000 / 60
+
+
+def wait_until(app, condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("books did not finish loading")
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def background_idle():
+    """后台线程池都空闲时返回 True，测量期间的解析和预读线程会与界面线程争用 GIL"""
+    from EBookFindBar import get_find_pool
+    from EBookPagination import get_pagination_pool
+    from EBookPrefetch import get_prefetch_pool
+    from EBookProgress import get_progress_pool
+    from EBookSearchDialog import get_index_pool
+    from EBookThumbnails import get_thumbnail_pool
+    from EBookTocDocker import get_library_pool
+    pools = (qtc.QThreadPool.globalInstance(), get_find_pool(), get_index_pool(), get_library_pool(),
+             get_pagination_pool(), get_prefetch_pool(), get_progress_pool(), get_thumbnail_pool())
+    return all(pool.activeThreadCount() == 0 for pool in pools)
+
+
+def settle(app):
+    """处理完切换之后排队的事件（包括延迟 0 毫秒的定时器和重绘），并像事件循环一样
+    删除 deleteLater 的控件，processEvents 本身不删除"""
+    for _ in range(3):
+        app.processEvents()
+        app.sendPostedEvents(None, qtc.QEvent.Type.DeferredDelete.value)
+
+
+def measure(app, window, theme):
+    start = time.perf_counter()
+    window.change_theme(theme)
+    switched = time.perf_counter()
+    settle(app)
+    return (switched - start) * 1000, (time.perf_counter() - switched) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tabs", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=3, help="每个主题切换的轮数")
+    parser.add_argument("--chapters", type=int, default=20)
+    parser.add_argument("--chapter-kb", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=FRAME_BUDGET_MS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="qepuber-bench-") as work_dir:
+        # 设置、缓存和阅读进度写入临时目录，不影响本机的会话
+        EBookCache.CACHE_ROOT = os.path.join(work_dir, "eBookCache")
+        books_dir = os.path.join(work_dir, "books")
+        os.makedirs(books_dir)
+        for index in range(args.tabs):
+            write_epub(os.path.join(books_dir, f"book{index:03d}.epub"),
+                       EpubSpec(chapters=args.chapters, chapter_kb=args.chapter_kb, seed=index))
+
+        # 主窗口按相对路径加载图标和 QSS
+        os.chdir(ROOT_DIR)
+        app = qtw.QApplication(sys.argv[:1])
+        from EBookTabWidget import EBookChapterDisplay
+        from MainWindow import MainWindow
+        from ThemeManager import Theme, ThemeManager
+
+        theme_manager = ThemeManager(app)
+        theme_manager.load_theme(Theme.MODERN)
+        window = MainWindow(theme_manager)
+        window.resize(1200, 800)
+        window.show()
+        tab_widget = window._tab_widget
+        for epub_path in sorted(glob.glob(os.path.join(books_dir, "*.epub"))):
+            window.load_epub_by_path(epub_path)
+        wait_until(app, lambda: sum(isinstance(tab_widget.widget(i), EBookChapterDisplay)
+                                    for i in range(tab_widget.count())) == args.tabs)
+        # 打开的书籍陆续加入全文索引，两本书之间线程池会短暂空闲，要等索引全部完成
+        wait_until(app, lambda: background_idle() and not window._search_indexer.is_running())
+        settle(app)
+        print(f"{args.tabs} tabs open, platform {app.platformName()}, "
+              f"budget {args.budget_ms:.1f} ms per switch\n")
+
+        themes = [Theme.DARK, Theme.LIGHT, Theme.BLUE, Theme.MODERN, Theme.DEFAULT]
+        # 先把每个主题套用一次，编译样式表的开销只在第一次切换时出现
+        first = {theme: measure(app, window, theme) for theme in themes}
+        results = {theme: [] for theme in themes}
+        for _ in range(args.rounds):
+            for theme in themes:
+                results[theme].append(measure(app, window, theme))
+        palette_only = [measure(app, window, themes[-1]) for _ in range(args.rounds)]
+
+        print(f"{'theme':>8} {'first ms':>10} {'sync med':>10} {'sync max':>10} {'settle med':>11} {'settle max':>11}")
+        for theme in themes:
+            sync = [row[0] for row in results[theme]]
+            settled = [row[1] for row in results[theme]]
+            print(f"{theme.value:>8} {first[theme][0]:>10.1f} {statistics.median(sync):>10.1f} {max(sync):>10.1f} "
+                  f"{statistics.median(settled):>11.1f} {max(settled):>11.1f}")
+        print(f"{'palette':>8} {'':>10} {statistics.median(row[0] for row in palette_only):>10.1f} "
+              f"{max(row[0] for row in palette_only):>10.1f} "
+              f"{statistics.median(row[1] for row in palette_only):>11.1f} {max(row[1] for row in palette_only):>11.1f}")
+
+        sync = [row[0] for rows in results.values() for row in rows]
+        total = [row[0] + row[1] for rows in results.values() for row in rows]
+        median = statistics.median(sync)
+        print(f"\nswitch: median {median:.1f} ms, max {max(sync):.1f} ms; "
+              f"until settled: median {statistics.median(total):.1f} ms, max {max(total):.1f} ms")
+        window.close()
+        if median > args.budget_ms:
+            print(f"Median switch is over the {args.budget_ms:.1f} ms budget")
+            return 1
+        print(f"Median switch is within the {args.budget_ms:.1f} ms budget")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""基准测试用的合成 EPUB 生成器
+
+章节数、每章大小、目录规模和嵌套深度、图片数量和大小、EPUB 2.0 (toc.ncx)
+或 EPUB 3.0 (nav.xhtml) 目录都可以配置。同样的参数和种子总是生成相同的内容。
+图片只是带 JPEG 文件头的随机数据，用来占据归档大小，不能解码。
+"""
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+CONTAINER_XML = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+# 正文中混合使用的汉字和英文单词
+_HANZI = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经"
+_WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do"]
+
+
+class EpubSpec:
+    """合成 EPUB 的参数
+
+    chapters: 书脊章节数
+    chapter_kb: 每章正文的大约大小（KB）
+    toc_per_chapter: 每章的目录项数，第一项指向章节开头，其余指向章内的小节锚点
+    toc_depth: 目录的最大嵌套层数，小节按 1, 2, ..., toc_depth - 1 层循环嵌套
+    images: 图片总数，依次插入各章
+    image_kb: 每张图片的大小（KB）
+    epub3: 为 True 时生成 EPUB 3.0 的 nav.xhtml，否则生成 toc.ncx
+    styled: 为 True 时按常见的转换工具输出排版：各章链接全书共用的样式表（含 @font-face、
+        @media、Qt 不支持的属性和大量类规则），正文放在 section 中，段落带类名，
+        段落之间有 EPUB 3 的 <span epub:type="pagebreak" id="..."/> 页码锚点
+    """
+
+    def __init__(self, chapters=20, chapter_kb=20, toc_per_chapter=2, toc_depth=2,
+                 images=0, image_kb=50, epub3=False, styled=False, seed=0):
+        self.chapters = chapters
+        self.chapter_kb = chapter_kb
+        self.toc_per_chapter = max(1, toc_per_chapter)
+        self.toc_depth = max(1, toc_depth)
+        self.images = images
+        self.image_kb = image_kb
+        self.epub3 = epub3
+        self.styled = styled
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    def toc_size(self):
+        return self.chapters * self.toc_per_chapter
+
+
+# styled 为 True 时各章链接的样式表
+STYLESHEET_CSS = """@charset "utf-8";
+@font-face { font-family: "Body"; src: url(../Fonts/body.ttf); }
+@page { margin: 5pt; }
+body { font-family: "Body", serif; line-height: 1.6; widows: 2; orphans: 2; -webkit-hyphens: auto; hyphens: auto; }
+section { display: block; page-break-before: always; }
+h1 { font-size: 1.6em; text-align: center; margin: 2em 0 1em; page-break-after: avoid; }
+h2 { font-size: 1.3em; margin: 1.5em 0 0.5em; -webkit-text-stroke: 0; }
+p { text-indent: 2em; margin: 0; text-align: justify; text-rendering: optimizeLegibility; }
+p:first-of-type { text-indent: 0; }
+p::first-letter { font-size: 1.2em; }
+img { max-width: 100%; object-fit: contain; }
+span.pagebreak { display: none; }
+@media amzn-kf8 { p { text-indent: 1.5em; } }
+@media screen and (min-width: 600px) { body { margin: 0 5%; } }
+""" + "".join(
+    # 转换工具为全书生成的类，每章只用到其中几个
+    f".calibre{index} {{ display: block; font-size: {0.8 + index % 5 * 0.1:.1f}em; margin: 0 0 {index % 3}pt; "
+    f"-webkit-hyphens: auto; }}\n.calibre{index} > span.c{index}, div.calibre{index} p {{ font-weight: bold; }}\n"
+    for index in range(100))
+
+
+def _paragraph(rng: random.Random):
+    if rng.random() < 0.5:
+        return "".join(rng.choice(_HANZI) for _ in range(rng.randint(60, 160)))
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(30, 80)))
+
+
+def _toc_entries(spec: EpubSpec):
+    """扁平的目录项 [(标题, href, 层级)]，层级序列保证每项最多比上一项深一层"""
+    entries = []
+    for chapter in range(spec.chapters):
+        href = f"Text/chapter{chapter:05d}.xhtml"
+        entries.append((f"第{chapter + 1}章", href, 0))
+        for section in range(1, spec.toc_per_chapter):
+            level = 0 if spec.toc_depth == 1 else 1 + (section - 1) % (spec.toc_depth - 1)
+            entries.append((f"第{chapter + 1}章 第{section}节", f"{href}#s{section}", level))
+    return entries
+
+
+def _nest(entries, open_item, close_item, open_children, close_children):
+    """把扁平的目录项按层级转换成嵌套的 XML 片段"""
+    parts = []
+    stack = []  # 尚未闭合的层级
+    for index, (title, href, level) in enumerate(entries):
+        while stack and stack[-1] > level:
+            stack.pop()
+            parts.append(close_item + close_children)
+        if stack and stack[-1] == level:
+            parts.append(close_item)
+        else:
+            if stack:
+                parts.append(open_children)
+            stack.append(level)
+        parts.append(open_item(index, escape(title), escape(href)))
+    while stack:
+        stack.pop()
+        parts.append(close_item + (close_children if stack else ""))
+    return "".join(parts)
+
+
+def _ncx(entries):
+    nav_map = _nest(
+        entries,
+        lambda i, title, href: (f'<navPoint id="n{i}" playOrder="{i + 1}">'
+                                f'<navLabel><text>{title}</text></navLabel><content src="{href}"/>'),
+        "</navPoint>", "", "")
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+            f'<head/><docTitle><text>Benchmark</text></docTitle><navMap>{nav_map}</navMap></ncx>')
+
+
+def _nav(entries):
+    items = _nest(
+        entries,
+        lambda i, title, href: f'<li><a href="{href}">{title}</a>',
+        "</li>", "<ol>", "</ol>")
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            '<head><title>Navigation</title></head><body>'
+            f'<nav epub:type="toc"><ol>{items}</ol></nav></body></html>')
+
+
+def _chapter(spec: EpubSpec, chapter, images, rng: random.Random):
+    """一章的 XHTML：标题、正文段落，小节锚点和图片均匀分布在段落之间"""
+    paragraphs = []
+    size = 0
+    while size < spec.chapter_kb * 1024:
+        paragraph = _paragraph(rng)
+        paragraphs.append(f"<p>{paragraph}</p>")
+        size += len(paragraph.encode())
+    if spec.styled:
+        # 每 5 段一个页码锚点
+        paragraphs = [paragraph.replace("<p>", f'<p class="calibre{1 + index % 3}">', 1)
+                      for index, paragraph in enumerate(paragraphs)]
+        paragraphs = [f'<span class="pagebreak" epub:type="pagebreak" id="page{chapter}_{index // 5}" '
+                      f'title="{index // 5}"/>{paragraph}' if index % 5 == 0 else paragraph
+                      for index, paragraph in enumerate(paragraphs)]
+    blocks = [f'<h1 id="top">第{chapter + 1}章</h1>']
+    inserts = [f'<h2 id="s{section}">第{section}节</h2>' for section in range(1, spec.toc_per_chapter)]
+    inserts += [f'<p><img src="../Images/{image}" alt=""/></p>' for image in images]
+    step = max(1, len(paragraphs) // (len(inserts) + 1))
+    for index, paragraph in enumerate(paragraphs):
+        if inserts and index and index % step == 0:
+            blocks.append(inserts.pop(0))
+        blocks.append(paragraph)
+    blocks.extend(inserts)
+    if not spec.styled:
+        return ('<?xml version="1.0" encoding="utf-8"?>'
+                '<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+                f'<title>第{chapter + 1}章</title></head><body>{"".join(blocks)}</body></html>')
+    return ('<?xml version="1.0" encoding="utf-8"?><!DOCTYPE html>'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><head>'
+            f'<title>第{chapter + 1}章</title>'
+            '<link rel="stylesheet" type="text/css" href="../Styles/style.css"/></head>'
+            f'<body><section epub:type="chapter">{"".join(blocks)}</section></body></html>')
+
+
+def write_epub(path, spec: EpubSpec):
+    """按 spec 生成 EPUB 并返回路径"""
+    rng = random.Random(spec.seed)
+    image_names = [f"image{index:05d}.jpg" for index in range(spec.images)]
+    chapter_images = [image_names[chapter::spec.chapters] for chapter in range(spec.chapters)]
+    entries = _toc_entries(spec)
+
+    manifest = [f'<item id="c{i}" href="Text/chapter{i:05d}.xhtml" media-type="application/xhtml+xml"/>'
+                for i in range(spec.chapters)]
+    manifest += [f'<item id="i{i}" href="Images/{name}" media-type="image/jpeg"/>'
+                 for i, name in enumerate(image_names)]
+    if spec.styled:
+        manifest.append('<item id="css" href="Styles/style.css" media-type="text/css"/>')
+    if spec.epub3:
+        manifest.append('<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>')
+        spine_attrs, version = "", "3.0"
+    else:
+        manifest.append('<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>')
+        spine_attrs, version = ' toc="ncx"', "2.0"
+    itemrefs = "".join(f'<itemref idref="c{i}"/>' for i in range(spec.chapters))
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip")
+        zf.writestr("META-INF/container.xml", CONTAINER_XML)
+        zf.writestr("OEBPS/content.opf", (
+            f'<?xml version="1.0" encoding="utf-8"?><package xmlns="http://www.idpf.org/2007/opf" version="{version}">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>Benchmark</dc:title>'
+            '<dc:creator>QEpuber</dc:creator><dc:language>zh</dc:language></metadata>'
+            f'<manifest>{"".join(manifest)}</manifest><spine{spine_attrs}>{itemrefs}</spine></package>'))
+        if spec.epub3:
+            zf.writestr("OEBPS/nav.xhtml", _nav(entries))
+        else:
+            zf.writestr("OEBPS/toc.ncx", _ncx(entries))
+        for chapter in range(spec.chapters):
+            zf.writestr(f"OEBPS/Text/chapter{chapter:05d}.xhtml",
+                        _chapter(spec, chapter, chapter_images[chapter], rng))
+        if spec.styled:
+            zf.writestr("OEBPS/Styles/style.css", STYLESHEET_CSS)
+        for name in image_names:
+            data = b"\xff\xd8\xff\xe0" + rng.randbytes(spec.image_kb * 1024)
+            # 随机数据无法压缩，直接存储
+            zf.writestr(zipfile.ZipInfo(f"OEBPS/Images/{name}"), data)
+    return path
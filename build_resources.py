@@ -0,0 +1,145 @@
+"""把图标和 QSS 打包为 Qt 二进制资源文件 resources.rcc
+
+    python build_resources.py                 # 修改 figures/ 或 qss/ 后重新生成
+    python build_resources.py -o out.rcc
+
+输出格式与 Qt 的 ``rcc -binary`` 相同（格式版本 1），启动时由 EBookResources
+整体映射到内存，程序通过 ":/figures/..." 和 ":/qss/..." 访问其中的文件，
+不再逐个打开磁盘上的文件。PyQt6 不带 rcc 工具，这里直接写出该格式，不依赖 Qt。
+"""
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+# 打包的目录，相对于本文件所在目录
+RESOURCE_DIRS = ("figures", "qss")
+DEFAULT_OUTPUT = "resources.rcc"
+# 压缩后不大于原大小的这一比例时才压缩，与 rcc 的默认阈值相同
+COMPRESS_THRESHOLD = 0.7
+
+_FLAG_COMPRESSED = 0x01
+_FLAG_DIRECTORY = 0x02
+# 文件节点的地区和语言：AnyTerritory、C，即不区分语言
+_TERRITORY_ANY = 0
+_LANGUAGE_C = 1
+
+
+def qt_hash(name: str) -> int:
+    """Qt 资源树中用于二分查找子节点的名称哈希（qt_hash）"""
+    h = 0
+    for unit in struct.unpack(f">{len(name.encode('utf-16-be')) // 2}H", name.encode("utf-16-be")):
+        h = (h << 4) + unit
+        h ^= (h & 0xF0000000) >> 23
+        h &= 0x0FFFFFFF
+    return h
+
+
+class _Node:
+    __slots__ = ("name", "children", "data", "name_offset", "data_offset", "child_offset", "flags")
+
+    def __init__(self, name, data=None):
+        self.name = name
+        self.children = {} if data is None else None
+        self.data = data
+        self.name_offset = 0
+        self.data_offset = 0
+        self.child_offset = 0
+        self.flags = _FLAG_DIRECTORY if data is None else 0
+
+    def sorted_children(self):
+        return sorted(self.children.values(), key=lambda child: qt_hash(child.name))
+
+
+def collect_files(root_dir, dirs=RESOURCE_DIRS) -> dict[str, bytes]:
+    """资源路径 -> 文件内容，资源路径使用 / 分隔"""
+    files = {}
+    for directory in dirs:
+        for current, subdirs, names in os.walk(os.path.join(root_dir, directory)):
+            subdirs.sort()
+            for name in sorted(names):
+                path = os.path.join(current, name)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, root_dir).replace(os.sep, "/")] = f.read()
+    return files
+
+
+def build_rcc(files: dict[str, bytes]) -> bytes:
+    """按 Qt 二进制资源格式打包：文件头、数据块、名称表、目录树"""
+    root = _Node("")
+    for path, data in files.items():
+        node = root
+        *parents, name = path.split("/")
+        for part in parents:
+            node = node.children.setdefault(part, _Node(part))
+        node.children[name] = _Node(name, data)
+
+    # 与 rcc 相同的遍历顺序：先计算每个目录的子节点起始下标，再按同样的顺序写出
+    order = []
+    pending = [root]
+    offset = 1
+    while pending:
+        node = pending.pop()
+        node.child_offset = offset
+        for child in node.sorted_children():
+            offset += 1
+            order.append(child)
+            if child.children is not None:
+                pending.append(child)
+
+    header_size = 20
+    data = bytearray()
+    for node in order:
+        if node.children is not None:
+            continue
+        blob = node.data
+        compressed = zlib.compress(blob, 9)
+        if blob and len(compressed) + 4 <= len(blob) * COMPRESS_THRESHOLD:
+            # qUncompress 的格式：4 字节大端的原始大小 + zlib 数据
+            blob = struct.pack(">I", len(node.data)) + compressed
+            node.flags |= _FLAG_COMPRESSED
+        node.data_offset = len(data)
+        data += struct.pack(">I", len(blob)) + blob
+
+    names = bytearray()
+    name_offsets = {}
+    for node in order:
+        if node.name not in name_offsets:
+            name_offsets[node.name] = len(names)
+            encoded = node.name.encode("utf-16-be")
+            names += struct.pack(">HI", len(encoded) // 2, qt_hash(node.name)) + encoded
+        node.name_offset = name_offsets[node.name]
+
+    tree = bytearray()
+    for node in [root] + order:
+        if node.children is not None:
+            tree += struct.pack(">IHII", node.name_offset, node.flags, len(node.children), node.child_offset)
+        else:
+            tree += struct.pack(">IHHHI", node.name_offset, node.flags, _TERRITORY_ANY, _LANGUAGE_C,
+                                node.data_offset)
+
+    data_offset = header_size
+    names_offset = data_offset + len(data)
+    tree_offset = names_offset + len(names)
+    header = b"qres" + struct.pack(">IIII", 1, tree_offset, data_offset, names_offset)
+    return header + bytes(data) + bytes(names) + bytes(tree)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+    parser.add_argument("-o", "--output", default=os.path.join(root_dir, DEFAULT_OUTPUT))
+    args = parser.parse_args(argv)
+
+    files = collect_files(root_dir)
+    bundle = build_rcc(files)
+    with open(args.output + ".part", "wb") as f:
+        f.write(bundle)
+    os.replace(args.output + ".part", args.output)
+    print(f"{len(files)} files, {sum(map(len, files.values()))} bytes -> {args.output} ({len(bundle)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
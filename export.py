@@ -0,0 +1,230 @@
+"""批量导出 EPUB 为纯文本、单个 HTML 文件或按章节的 JSON，不需要图形界面
+
+    python export.py books/ -o out/ --format text
+    python export.py a.epub b.epub -o out/ --format json --jobs 4
+    python export.py books/ -o out/ --force        # 忽略已导出的结果重新导出
+
+每本书在进程池中单独导出，章节逐个读取并写入，内存占用与书的大小无关。
+导出先写入 .part 临时文件，完成后才改为正式文件名；再次运行时跳过比书籍新的
+导出结果，中断的任务可以直接重新运行继续。
+"""
+import argparse
+import html
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from EBookArchive import EBookArchive
+from EBookLibrary import walk_folder
+from EBookParser import OPFPackage, iter_chapters, parse_toc_tree
+
+# 导出格式 -> (文件扩展名, iter_chapters 的模式)
+EXPORT_FORMATS = {
+    "text": (".txt", "text"),
+    "html": (".html", "html"),
+    "json": (".json", "text"),
+}
+
+_BODY_RE = re.compile(r"<body\b[^>]*>(.*)</body\s*>", re.IGNORECASE | re.DOTALL)
+
+
+def _chapter_body(chapter_html: str) -> str:
+    """章节 HTML 中 body 的内容，没有 body 时返回整个文档"""
+    match = _BODY_RE.search(chapter_html)
+    return match.group(1) if match else chapter_html
+
+
+def _read_package(epub_path):
+    """书籍元数据、目录 [(标题, 书内路径#锚点, 层级)] 和每个书脊章节的标题"""
+    with EBookArchive(epub_path) as archive:
+        package = OPFPackage(archive)
+        toc = parse_toc_tree(archive, package)
+    titles = {}
+    for title, anchor, _ in toc:
+        chapter_idx = package.chapter_index(anchor)
+        if chapter_idx is not None:
+            titles.setdefault(package.spine[chapter_idx], title)
+    return package.metadata, toc, titles
+
+
+def _write_text(f, epub_path, metadata, toc, titles):
+    count = 0
+    for _, text in iter_chapters(epub_path, "text"):
+        f.write(text.strip())
+        f.write("\n\n")
+        count += 1
+    return count
+
+
+def _write_html(f, epub_path, metadata, toc, titles):
+    title = html.escape(metadata.get("title") or os.path.basename(epub_path))
+    f.write(f'<!DOCTYPE html>\n<html lang="{html.escape(metadata.get("language") or "")}">\n'
+            f'<head><meta charset="utf-8"><title>{title}</title></head>\n<body>\n')
+    count = 0
+    for index, (path, chapter_html) in enumerate(iter_chapters(epub_path, "html")):
+        f.write(f'<section id="chapter-{index}" data-path="{html.escape(path)}">\n')
+        f.write(_chapter_body(chapter_html).strip())
+        f.write("\n</section>\n")
+        count += 1
+    f.write("</body>\n</html>\n")
+    return count
+
+
+def _write_json(f, epub_path, metadata, toc, titles):
+    """先写出元数据和目录，章节逐个追加到 chapters 数组中"""
+    header = {
+        "source": os.path.basename(epub_path),
+        "metadata": metadata,
+        "toc": [{"title": title, "href": anchor, "level": level} for title, anchor, level in toc],
+    }
+    f.write(json.dumps(header, ensure_ascii=False)[:-1])
+    f.write(', "chapters": [')
+    count = 0
+    for index, (path, text) in enumerate(iter_chapters(epub_path, "text")):
+        if index:
+            f.write(", ")
+        f.write(json.dumps({"index": index, "path": path, "title": titles.get(path), "text": text},
+                           ensure_ascii=False))
+        count += 1
+    f.write("]}\n")
+    return count
+
+
+_WRITERS = {"text": _write_text, "html": _write_html, "json": _write_json}
+
+
+def export_book(epub_path, output_path, export_format) -> dict:
+    """在子进程中导出一本书，返回耗时和大小，失败时记录错误而不抛出异常"""
+    start = time.perf_counter()
+    result = {"epub_path": epub_path, "output_path": output_path, "chapters": 0,
+              "input_bytes": 0, "output_bytes": 0, "error": None}
+    part_path = output_path + ".part"
+    try:
+        result["input_bytes"] = os.path.getsize(epub_path)
+        metadata, toc, titles = _read_package(epub_path)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(part_path, "w", encoding="utf-8", newline="\n") as f:
+            result["chapters"] = _WRITERS[export_format](f, epub_path, metadata, toc, titles)
+        os.replace(part_path, output_path)
+        result["output_bytes"] = os.path.getsize(output_path)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _unique_outputs(jobs: dict) -> dict:
+    """不同书籍的导出路径相同时（如 a/x.epub 和 b/x.epub 都作为文件输入），在这些书的
+    文件名后加上所在文件夹名，仍然相同时再加序号，避免互相覆盖同一个导出文件"""
+    by_output = {}
+    for epub_path in sorted(jobs):
+        by_output.setdefault(os.path.normcase(jobs[epub_path]), []).append(epub_path)
+    used = set(by_output)
+    unique = {}
+    for epub_paths in by_output.values():
+        if len(epub_paths) == 1:
+            unique[epub_paths[0]] = jobs[epub_paths[0]]
+            continue
+        for epub_path in epub_paths:
+            stem, extension = os.path.splitext(jobs[epub_path])
+            folder = os.path.basename(os.path.dirname(epub_path))
+            candidate, number = f"{stem} ({folder}){extension}", 2
+            while os.path.normcase(candidate) in used:
+                candidate, number = f"{stem} ({folder} {number}){extension}", number + 1
+            used.add(os.path.normcase(candidate))
+            unique[epub_path] = candidate
+    return unique
+
+
+def collect_jobs(inputs, output_dir, export_format):
+    """展开输入的文件和文件夹，返回 [(书籍路径, 导出路径)]
+
+    文件夹中的书籍按相对路径导出到以该文件夹命名的子目录，避免不同文件夹的同名书籍冲突；
+    其余导出路径相同的书籍由 _unique_outputs 改为不同的文件名。
+    """
+    extension = EXPORT_FORMATS[export_format][0]
+    jobs = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            folder = os.path.abspath(item)
+            for epub_path, _, _ in walk_folder(folder):
+                relative = os.path.relpath(epub_path, folder)
+                jobs.setdefault(epub_path, os.path.join(
+                    output_dir, os.path.basename(folder), os.path.splitext(relative)[0] + extension))
+        else:
+            epub_path = os.path.abspath(item)
+            name = os.path.splitext(os.path.basename(epub_path))[0]
+            jobs.setdefault(epub_path, os.path.join(output_dir, name + extension))
+    return sorted(_unique_outputs(jobs).items())
+
+
+def is_up_to_date(epub_path, output_path):
+    """导出结果存在且不比书籍旧时视为已完成"""
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(epub_path)
+    except OSError:
+        return False
+
+
+def _format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="EPUB 文件或包含 EPUB 的文件夹")
+    parser.add_argument("-o", "--output", required=True, help="导出目录")
+    parser.add_argument("-f", "--format", choices=list(EXPORT_FORMATS), default="text")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="进程数，默认为 CPU 核数")
+    parser.add_argument("--force", action="store_true", help="重新导出已经完成的书籍")
+    args = parser.parse_args(argv)
+
+    jobs = collect_jobs(args.inputs, args.output, args.format)
+    pending = [(epub_path, output_path) for epub_path, output_path in jobs
+               if args.force or not is_up_to_date(epub_path, output_path)]
+    skipped = len(jobs) - len(pending)
+    print(f"{len(jobs)} books, {skipped} already exported, {len(pending)} to export "
+          f"with {args.jobs} processes", flush=True)
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max(1, args.jobs)) as executor:
+        futures = [executor.submit(export_book, epub_path, output_path, args.format)
+                   for epub_path, output_path in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            status = (f"ERROR {result['error']}" if result["error"] else
+                      f"{result['chapters']} chapters, {_format_size(result['output_bytes'])}")
+            print(f"[{done}/{len(pending)}] {result['seconds'] * 1000:8.0f} ms  "
+                  f"{os.path.basename(result['epub_path'])}: {status}", flush=True)
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if result["error"]]
+    exported = [result for result in results if not result["error"]]
+    input_bytes = sum(result["input_bytes"] for result in exported)
+    busy = sum(result["seconds"] for result in results)
+    print(f"\nexported {len(exported)}, failed {len(failed)}, skipped {skipped} in {elapsed:.2f} s")
+    if exported and elapsed > 0:
+        print(f"throughput: {len(exported) / elapsed:.1f} books/s, "
+              f"{_format_size(input_bytes / elapsed)}/s of EPUB, "
+              f"parallel speedup x{busy / elapsed:.2f}")
+        slowest = sorted(exported, key=lambda result: result["seconds"], reverse=True)[:5]
+        print("slowest: " + ", ".join(f"{os.path.basename(result['epub_path'])} "
+                                      f"{result['seconds'] * 1000:.0f} ms" for result in slowest))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
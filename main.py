@@ -2,15 +2,21 @@ import sys
 
 from PyQt6.QtWidgets import QApplication
 
+from EBookResources import register_resources
 from MainWindow import MainWindow
 from ThemeManager import ThemeManager, Theme
 
 
-def main():
-    app = QApplication(sys.argv)
+def create_window(app: QApplication) -> MainWindow:
     theme_manager = ThemeManager(app)
     theme_manager.load_theme(Theme.MODERN)  # 使用现代主题作为默认主题
-    window = MainWindow(theme_manager)
+    return MainWindow(theme_manager)
+
+
+def main():
+    app = QApplication(sys.argv)
+    register_resources()  # 图标和 QSS 从预先打包的资源文件中读取
+    window = create_window(app)
     window.show()
     return app.exec()
 